@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+examples/bench_client_socket.py
+
+Benchmark de vazão e latência para o simple_server_socket.py no modo eventos: abre N conexões
+persistentes (uma única thread, selectors) e, em cada uma, faz M trocas mensagem/resposta.
+Ao final imprime requisições por segundo e percentis de latência.
+
+Exemplos:
+  python examples/simple_server_socket.py --modo eventos --backlog 1024 &
+  python examples/bench_client_socket.py --conns 1000 --requests 100
+"""
+
+import argparse
+import selectors
+import socket
+import time
+
+RESPONSE_SIZE = len("Mensagem recebida".encode('utf-8'))
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Benchmark do servidor TCP simples (modo eventos)')
+    p.add_argument('--host', default='localhost', help='Servidor (padrão: localhost)')
+    p.add_argument('--port', type=int, default=65432, help='Porta TCP (padrão: 65432)')
+    p.add_argument('--conns', type=int, default=100, help='Conexões simultâneas (padrão: 100)')
+    p.add_argument('--requests', type=int, default=100, help='Trocas por conexão (padrão: 100)')
+    p.add_argument('--message', default='Olá, servidor!', help='Mensagem enviada em cada troca')
+    return p.parse_args()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+class BenchConnection:
+    def __init__(self, sock, remaining):
+        self.sock = sock
+        self.remaining = remaining
+        self.received = 0
+        self.sent_at = 0.0
+
+
+def main():
+    args = parse_args()
+    payload = args.message.encode('utf-8')
+    sel = selectors.DefaultSelector()
+    latencies = []
+
+    def send(conn):
+        conn.received = 0
+        conn.sent_at = time.perf_counter()
+        conn.sock.sendall(payload)  # mensagem pequena: cabe no buffer de envio
+
+    start = time.perf_counter()
+    for _ in range(args.conns):
+        sock = socket.create_connection((args.host, args.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setblocking(False)
+        conn = BenchConnection(sock, args.requests)
+        sel.register(sock, selectors.EVENT_READ, conn)
+    connect_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for key in list(sel.get_map().values()):
+        send(key.data)
+
+    active = args.conns
+    while active:
+        for key, _mask in sel.select():
+            conn = key.data
+            try:
+                data = conn.sock.recv(65536)
+            except BlockingIOError:
+                continue
+            if not data:
+                raise ConnectionError('servidor encerrou a conexão durante o benchmark')
+            conn.received += len(data)
+            if conn.received < RESPONSE_SIZE:
+                continue
+            latencies.append(time.perf_counter() - conn.sent_at)
+            conn.remaining -= 1
+            if conn.remaining:
+                send(conn)
+            else:
+                sel.unregister(conn.sock)
+                conn.sock.close()
+                active -= 1
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"Conexões: {args.conns} (abertas em {connect_time:.2f}s), trocas: {total} em {elapsed:.2f}s")
+    print(f"Vazão: {total / elapsed:.0f} req/s")
+    print("Latência (ms): " + ', '.join(
+        f"p{pct}={percentile(latencies, pct) * 1000:.2f}" for pct in (50, 90, 99)
+    ) + f", max={latencies[-1] * 1000:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,47 +1,256 @@
-import socket
+import argparse
+import collections
+import errno
 import random
-from threading import Thread
+import selectors
+import socket
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from framing import FrameDecoder, FrameError, encode_frame
 
 sujeitos = ["O gato", "A Maria", "O sistema", "Um robô", "O professor", "O carro", "A criança", "O cachorro", "O programador", "O cientista"]
 verbos = ["correu", "saltou", "falhou", "funcionou", "desapareceu", "apareceu", "programou", "descobriu", "construiu", "quebrou"]
 objetos = ["na rua", "na escola", "no trabalho", "em casa", "na internet", "no parque", "no laboratório", "no quarto", "no mercado", "na estrada"]
 
 
-def chat(socket):
+# Protocolo: conexões persistentes com quadros [tamanho (4 bytes)] + "usuario|mensagem" em UTF-8
+# (ver framing.py). O cliente pode enviar vários pedidos sem esperar (pipelining); as respostas
+# voltam na mesma ordem, uma por pedido: a frase aleatória ou "ERROR".
+
+# Respostas prontas esperando o cliente ler: acima de OUTBUF_HIGH bytes o servidor para de ler
+# novos pedidos da conexão e só volta abaixo de OUTBUF_LOW (cliente que não lê não faz a memória crescer)
+OUTBUF_HIGH = 1024 * 1024
+OUTBUF_LOW = 256 * 1024
+
+# accept() sem descritores livres (EMFILE/ENFILE) ou memória: o listener sai do selector até uma
+# sessão fechar ou por ACCEPT_BACKOFF segundos, em vez de derrubar o loop (e todas as sessões).
+# Conexões abortadas ainda na fila (ECONNABORTED) só são puladas.
+ACCEPT_BACKOFF = 1.0
+ACCEPT_TRANSIENT_ERRORS = (errno.ECONNABORTED, errno.EPROTO, errno.ECONNRESET)
+
+
+def chat(msg, verbose=True):
     try:
-        msg = socket.recv(1024).decode('utf-8')
-        msg_list = msg.split('|')
+        msg_list = msg.decode('utf-8').split('|', 1)
         if len(msg_list) != 2:
             raise Exception
         else:
             username, mensagem = msg_list[0], msg_list[1]
             resposta = f"{random.choice(sujeitos)} {random.choice(verbos)} {random.choice(objetos)}."
-            socket.send(resposta.encode('utf-8'))
-            print(f"{username}: {mensagem}")
-            print(f"chat: {resposta}")
+            if verbose:
+                print(f"{username}: {mensagem}")
+                print(f"chat: {resposta}")
+            return resposta.encode('utf-8')
     except Exception:
-        socket.send("ERROR".encode('utf-8'))
+        return "ERROR".encode('utf-8')
+
+
+class Session:
+    """Conexão persistente: decodificador de quadros, respostas pendentes (em ordem) e buffer de saída."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.decoder = FrameDecoder()
+        self.pending = collections.deque()  # futures na ordem dos pedidos
+        self.outbuf = bytearray()
+        self.events = selectors.EVENT_READ  # 0 = fora do seletor (nada a ler nem a escrever agora)
+        self.closing = False  # cliente encerrou o envio: fechar depois de responder tudo
+        self.throttled = False  # outbuf passou de OUTBUF_HIGH: não ler até baixar de OUTBUF_LOW
+        self.closed = False
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Servidor de frases aleatórias (quadros, conexões persistentes)')
+    p.add_argument('--host', default='10.1.23.44', help='Endereço de bind (padrão: 10.1.23.44)')
+    p.add_argument('--port', type=int, default=9003, help='Porta TCP (padrão: 9003)')
+    p.add_argument('--workers', type=int, default=4, help='Threads do pool que processam os pedidos (padrão: 4)')
+    p.add_argument('--backlog', type=int, default=128, help='Fila de conexões pendentes (padrão: 128)')
+    p.add_argument('--max-pending', type=int, default=256,
+                   help='Pedidos em processamento por conexão antes de parar de ler dela (padrão: 256)')
+    p.add_argument('--quiet', action='store_true', help='Não imprimir cada mensagem')
+    return p.parse_args()
+
+
+def serve(server_socket, workers, max_pending, verbose=True):
+    sel = selectors.DefaultSelector()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    # workers avisam o loop de I/O que há respostas prontas escrevendo neste par de sockets
+    wake_r, wake_w = socket.socketpair()
+    wake_r.setblocking(False)
+    wake_w.setblocking(False)
+    ready = collections.deque()
+    server_socket.setblocking(False)
+    sel.register(server_socket, selectors.EVENT_READ, 'accept')
+    sel.register(wake_r, selectors.EVENT_READ, 'wake')
+    sessions = 0
+    accept_paused_until = None  # listener fora do selector até este instante (ou até uma sessão fechar)
+
+    def pause_accept(error):
+        nonlocal accept_paused_until
+        if accept_paused_until is None:
+            sel.unregister(server_socket)
+            print(f"accept falhou ({error}); pausando novas conexões ({sessions} abertas)")
+        accept_paused_until = time.monotonic() + ACCEPT_BACKOFF
+
+    def resume_accept():
+        nonlocal accept_paused_until
+        if accept_paused_until is not None:
+            accept_paused_until = None
+            sel.register(server_socket, selectors.EVENT_READ, 'accept')
+
+    def notify(session):
+        ready.append(session)
+        try:
+            wake_w.send(b'\0')
+        except BlockingIOError:
+            pass  # o loop já tem um aviso pendente
+
+    def close(session):
+        nonlocal sessions
+        if session.events:
+            sel.unregister(session.sock)
+        session.sock.close()
+        session.closed = True
+        sessions -= 1
+        resume_accept()  # um descritor foi liberado
+
+    def update_events(session):
+        if session.closed:
+            return
+        if session.closing and not session.pending and not session.outbuf:
+            close(session)
+            return
+        if len(session.outbuf) >= OUTBUF_HIGH:
+            session.throttled = True
+        elif len(session.outbuf) <= OUTBUF_LOW:
+            session.throttled = False
+        events = 0
+        if not session.closing and not session.throttled and len(session.pending) < max_pending:
+            events |= selectors.EVENT_READ
+        if session.outbuf:
+            events |= selectors.EVENT_WRITE
+        if events == session.events:
+            return
+        if not session.events:
+            sel.register(session.sock, events, session)
+        elif not events:
+            sel.unregister(session.sock)
+        else:
+            sel.modify(session.sock, events, session)
+        session.events = events
+
+    def flush(session):
+        # respostas saem na ordem dos pedidos, mesmo que os workers terminem fora de ordem
+        while session.pending and session.pending[0].done():
+            session.outbuf += encode_frame(session.pending.popleft().result())
+        if session.outbuf:
+            try:
+                sent = session.sock.send(session.outbuf)
+            except BlockingIOError:
+                sent = 0
+            except ConnectionError:
+                session.outbuf.clear()
+                session.pending.clear()
+                close(session)
+                return
+            del session.outbuf[:sent]
+        update_events(session)
+
+    def on_read(session):
+        try:
+            data = session.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except ConnectionError:
+            data = b''
+        if not data:
+            # cliente terminou de enviar: responder o que falta e então fechar
+            session.closing = True
+            flush(session)
+            return
+        try:
+            frames = session.decoder.feed(data)
+        except FrameError:
+            # quadro inválido: responder os pedidos anteriores, depois "ERROR", e encerrar
+            error = Future()
+            error.set_result("ERROR".encode('utf-8'))
+            session.pending.append(error)
+            session.closing = True
+            flush(session)
+            return
+        for frame in frames:
+            future = pool.submit(chat, frame, verbose)
+            future.add_done_callback(lambda _f, s=session: notify(s))
+            session.pending.append(future)
+        update_events(session)
+
+    try:
+        while True:
+            if accept_paused_until is not None and time.monotonic() >= accept_paused_until:
+                resume_accept()
+            timeout = ACCEPT_BACKOFF if accept_paused_until is not None else None
+            for key, mask in sel.select(timeout):
+                if key.data == 'accept':
+                    while True:
+                        try:
+                            client_socket, _client_address = server_socket.accept()
+                        except (BlockingIOError, InterruptedError):
+                            break
+                        except OSError as e:
+                            if e.errno in ACCEPT_TRANSIENT_ERRORS:
+                                continue
+                            pause_accept(e)
+                            break
+                        client_socket.setblocking(False)
+                        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                        sel.register(client_socket, selectors.EVENT_READ, Session(client_socket))
+                        sessions += 1
+                elif key.data == 'wake':
+                    try:
+                        while wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    while ready:
+                        session = ready.popleft()
+                        if not session.closed:
+                            flush(session)
+                else:
+                    session = key.data
+                    if mask & selectors.EVENT_READ:
+                        on_read(session)
+                    if mask & selectors.EVENT_WRITE and not session.closed:
+                        flush(session)
     finally:
-        socket.close()
+        pool.shutdown(wait=False)
+        wake_r.close()
+        wake_w.close()
 
 
-IP, PORTA = '10.1.23.44', 9003
+def main():
+    args = parse_args()
+    IP, PORTA = args.host, args.port
 
-# Criar o Socket
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Criar o Socket
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
-# Bind IP, Porta
-server_socket.bind((IP, PORTA))
+    # Bind IP, Porta
+    server_socket.bind((IP, PORTA))
 
-# Listen
-server_socket.listen(10)
+    # Listen
+    server_socket.listen(args.backlog)
 
-print("Servidor iniciado...")
+    print("Servidor iniciado...")
+
+    try:
+        serve(server_socket, args.workers, args.max_pending, verbose=not args.quiet)
+    except KeyboardInterrupt:
+        print("\nEncerrando servidor...")
+    finally:
+        server_socket.close()
 
-#idx = 0
-# Accept
-while True:
-    client_socket, client_address = server_socket.accept()
-    t = Thread(target=chat, args=(client_socket,))
-    t.start()
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+examples/framing.py
+
+Enquadramento por prefixo de tamanho para conexões TCP persistentes: cada mensagem é enviada
+como [tamanho (4 bytes, big-endian)] + dados. Sem isso, um recv(1024) pode cortar mensagens
+longas ou juntar várias mensagens em uma só leitura.
+"""
+
+import struct
+
+HEADER = struct.Struct('!I')
+MAX_FRAME = 16 * 1024 * 1024
+
+
+class FrameError(Exception):
+    pass
+
+
+def encode_frame(payload):
+    if len(payload) > MAX_FRAME:
+        raise FrameError(f'quadro de {len(payload)} bytes excede o limite de {MAX_FRAME}')
+    return HEADER.pack(len(payload)) + payload
+
+
+def send_frame(sock, payload):
+    sock.sendall(encode_frame(payload))
+
+
+def recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        part = sock.recv(size - len(buf))
+        if not part:
+            return None
+        buf += part
+    return bytes(buf)
+
+
+def recv_frame(sock):
+    """Lê um quadro de um socket bloqueante. Retorna None se a conexão foi encerrada."""
+    head = recv_exact(sock, HEADER.size)
+    if head is None:
+        return None
+    (size,) = HEADER.unpack(head)
+    if size > MAX_FRAME:
+        raise FrameError(f'quadro de {size} bytes excede o limite de {MAX_FRAME}')
+    payload = recv_exact(sock, size)
+    if payload is None:
+        raise FrameError('conexão encerrada no meio de um quadro')
+    return payload
+
+
+class FrameDecoder:
+    """Decodificador incremental para sockets não bloqueantes: feed(dados) devolve os quadros completos."""
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        self.buf += data
+        frames = []
+        offset = 0
+        while len(self.buf) - offset >= HEADER.size:
+            (size,) = HEADER.unpack_from(self.buf, offset)
+            if size > MAX_FRAME:
+                raise FrameError(f'quadro de {size} bytes excede o limite de {MAX_FRAME}')
+            end = offset + HEADER.size + size
+            if len(self.buf) < end:
+                break
+            frames.append(bytes(self.buf[offset + HEADER.size:end]))
+            offset = end
+        del self.buf[:offset]
+        return frames
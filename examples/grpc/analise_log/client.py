@@ -1,19 +1,165 @@
-import sys
+import argparse
+import asyncio
+import signal
+import time
+
 import grpc
 
 import logan_pb2 as pb
 import logan_pb2_grpc as pb_grpc
 
-def main():
-    path = sys.argv[1] if len(sys.argv) > 1 else "example.log"
-    with grpc.insecure_channel("localhost:50051") as channel:
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Cliente gRPC de análise de logs")
+    p.add_argument("path", nargs="*", default=["example.log"],
+                   help="Arquivo(s) de log no servidor ou padrões glob entre aspas, como 'logs/*.log'; "
+                        "com mais de um, um stream só em ordem de timestamp (padrão: example.log)")
+    p.add_argument("--target", default="localhost:50051", help="Servidor (padrão: localhost:50051)")
+    p.add_argument("--aio", action="store_true", help="Usar grpc.aio (asyncio) em vez do cliente bloqueante")
+    p.add_argument("--level", action="append", default=[], help="Só este nível (pode repetir: --level ERROR --level WARN)")
+    p.add_argument("--contains", default="", help="Só linhas que contêm este texto")
+    p.add_argument("--regex", default="", help="Só linhas em que esta expressão regular é encontrada")
+    p.add_argument("--start", type=int, default=0, help="Primeira linha (a partir de 1)")
+    p.add_argument("--end", type=int, default=0, help="Última linha, inclusive")
+    p.add_argument("--batch", type=int, default=None, metavar="N",
+                   help="Receber em lotes (StreamLogBatches) de até N eventos; 0 = padrão do servidor")
+    p.add_argument("--last", type=int, default=0, metavar="N", help="Só as últimas N linhas (como tail -n N)")
+    p.add_argument("--follow", "-f", action="store_true", help="Continuar recebendo as linhas novas (tail -f)")
+    p.add_argument("--resume", default=None, metavar="TOKEN",
+                   help="Continuar de onde outra execução parou (token impresso ao sair: offset:linha:inode)")
+    p.add_argument("--summary", action="store_true",
+                   help="Só o resumo (Summarize): linhas por nível, mensagens mais repetidas e histograma por tempo")
+    p.add_argument("--top", type=int, default=0, metavar="K", help="(resumo) Mensagens mais repetidas; 0 = padrão do servidor")
+    p.add_argument("--bucket", type=int, default=0, metavar="S", help="(resumo) Segundos por intervalo; 0 = 60")
+    return p.parse_args()
+
+
+def format_token(token):
+    return f"{token.offset}:{token.lineno}:{token.inode}"
+
+
+def parse_token(text):
+    offset, lineno, inode = (int(part) for part in text.split(":"))
+    return pb.ResumeToken(offset=offset, lineno=lineno, inode=inode)
+
+
+def build_request(args):
+    # um único arquivo (ou padrão) vai em path, para não mudar pedidos de um arquivo só
+    path, paths = (args.path[0], []) if len(args.path) == 1 else ("", args.path)
+    return pb.LogRequest(path=path, paths=paths, levels=args.level, contains=args.contains, regex=args.regex,
+                         start_line=args.start, end_line=args.end, batch_size=args.batch or 0,
+                         follow=args.follow, last_lines=args.last, resume=parse_token(args.resume) if args.resume else None)
+
+
+class Progress:
+    """Guarda o token do último evento recebido, para imprimir ao sair."""
+
+    def __init__(self):
+        self.token = None
+
+    def show(self, event):
+        print_event(event)
+        if not event.source:  # com vários arquivos não há como retomar (sem resume)
+            self.token = event.token
+
+    def report(self):
+        if self.token is not None and self.token.offset:
+            print(f"Para continuar daqui: --resume {format_token(self.token)}")
+
+
+def print_event(event):
+    source = f"{event.source}:" if event.source else ""
+    print(f"{source}[{event.lineno:02d}] {event.level:7} | {event.line}")
+
+
+def print_summary(summary):
+    print(f"Linhas: {summary.lines}")
+    for level, count in sorted(summary.levels.items(), key=lambda item: -item[1]):
+        print(f"  {level:7} {count}")
+    if summary.top_messages:
+        print("Mensagens mais repetidas:")
+        for message in summary.top_messages:
+            print(f"  {message.count:8} {message.level:7} | {message.message}")
+    if summary.buckets:
+        print(f"Por intervalo de {summary.bucket_seconds}s (UTC):")
+        for bucket in summary.buckets:
+            start = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(bucket.start))
+            counts = ", ".join(f"{level}={count}" for level, count in sorted(bucket.levels.items()))
+            print(f"  {start} {counts}")
+    if summary.untimed_lines:
+        print(f"Linhas sem timestamp: {summary.untimed_lines}")
+
+
+def summary_request(args):
+    return pb.SummaryRequest(path=args.path[0], top_k=args.top, bucket_seconds=args.bucket)
+
+
+def main(request, batched=False, target="localhost:50051"):
+    progress = Progress()
+    with grpc.insecure_channel(target) as channel:
+        stub = pb_grpc.LogServiceStub(channel)
+        try:
+            if batched:
+                for batch in stub.StreamLogBatches(request):
+                    for event in batch.events:
+                        progress.show(event)
+            else:
+                for event in stub.StreamLogs(request):
+                    progress.show(event)
+        except grpc.RpcError as e:
+            print("Erro gRPC:", e.code().name, e.details())
+        except KeyboardInterrupt:
+            pass
+    progress.report()
+
+
+async def main_aio(request, batched=False, target="localhost:50051", progress=None):
+    # Ctrl-C cancela a tarefa e o canal é fechado normalmente (útil com --follow)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGINT, asyncio.current_task().cancel)
+    async with grpc.aio.insecure_channel(target) as channel:
+        stub = pb_grpc.LogServiceStub(channel)
+        try:
+            if batched:
+                async for batch in stub.StreamLogBatches(request):
+                    for event in batch.events:
+                        progress.show(event)
+            else:
+                async for event in stub.StreamLogs(request):
+                    progress.show(event)
+        except grpc.RpcError as e:
+            print("Erro gRPC:", e.code().name, e.details())
+        except asyncio.CancelledError:
+            pass
+
+
+def main_summary(request, target="localhost:50051"):
+    with grpc.insecure_channel(target) as channel:
+        stub = pb_grpc.LogServiceStub(channel)
+        try:
+            print_summary(stub.Summarize(request))
+        except grpc.RpcError as e:
+            print("Erro gRPC:", e.code().name, e.details())
+
+
+async def main_summary_aio(request, target="localhost:50051"):
+    async with grpc.aio.insecure_channel(target) as channel:
         stub = pb_grpc.LogServiceStub(channel)
-        request = pb.LogRequest(path=path)
         try:
-            for event in stub.StreamLogs(request):
-                print(f"[{event.lineno:02d}] {event.level:7} | {event.line}")
+            print_summary(await stub.Summarize(request))
         except grpc.RpcError as e:
             print("Erro gRPC:", e.code().name, e.details())
 
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.summary:
+        if args.aio:
+            asyncio.run(main_summary_aio(summary_request(args), args.target))
+        else:
+            main_summary(summary_request(args), args.target)
+    elif args.aio:
+        progress = Progress()
+        asyncio.run(main_aio(build_request(args), args.batch is not None, args.target, progress))
+        progress.report()
+    else:
+        main(build_request(args), args.batch is not None, args.target)
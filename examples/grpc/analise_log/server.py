@@ -1,9 +1,99 @@
+import argparse
+import asyncio
+import calendar
+import collections
+import ctypes
+import ctypes.util
+import errno
+import functools
+import glob
+import heapq
+import itertools
+import mmap
+import multiprocessing
+import os
+import queue
+import re
+import select
+import struct
+import threading
+import time
+import zlib
+from array import array
+
 import grpc
 from concurrent import futures
 
 import logan_pb2 as pb
 import logan_pb2_grpc as pb_grpc
 
+# eventos por lote lido; no modo aio cada lote é uma ida ao pool de threads.
+# Também é o padrão de eventos por mensagem em StreamLogBatches.
+READ_BATCH = 1000
+MAX_BATCH = 10000
+# um lote é fechado antes de passar deste total de texto, para não chegar perto do limite
+# de 4 MB por mensagem do gRPC com linhas longas
+MAX_BATCH_BYTES = 1024 * 1024
+
+LEVELS = ("ERROR", "WARN", "INFO", "UNKNOWN")
+
+# follow: o quanto um leitor lê por vez antes de devolver o controle (mesmo sem eventos, por causa
+# dos filtros) e de quanto em quanto tempo confere o arquivo quando não há inotify
+MAX_SCAN_BYTES = 4 * 1024 * 1024
+FOLLOW_POLL = 0.5
+
+# Índice de linhas em arquivo ao lado do log (<log>.idx): o byte de início de cada bloco de
+# INDEX_STRIDE linhas e as contagens por nível de cada bloco. Só para logs a partir de
+# INDEX_MIN_SIZE; menores são lidos direto.
+INDEX_MAGIC = b"LOGIDX02"
+# magic, inode, tamanho do arquivo, bytes indexados, mtime_ns, stride, linhas, crc32 do fim do trecho indexado
+INDEX_HEADER = struct.Struct("!8sQQQqIII")
+INDEX_STRIDE = 1024
+INDEX_MIN_SIZE = 8 * 1024 * 1024
+# índice e agregados guardam o crc32 dos últimos TAIL_CHECK bytes que cobrem: um arquivo maior, com
+# o mesmo inode, só é tratado como "cresceu" se esses bytes não mudaram (não foi reescrito no lugar)
+TAIL_CHECK = 4096
+
+# Modo paralelo (--processes): a parte indexada de um log grande é dividida em faixas de blocos
+# inteiros do índice, de até PARALLEL_CHUNK bytes, classificadas em processos separados. Só vale
+# a partir de PARALLEL_MIN_BYTES por ler; cada processo fica com até PARALLEL_READAHEAD faixas
+# adiantadas, o que limita a memória das respostas esperando a vez de sair.
+PARALLEL_MIN_BYTES = 16 * 1024 * 1024
+PARALLEL_CHUNK = 4 * 1024 * 1024
+PARALLEL_READAHEAD = 2
+
+# Summarize: timestamp ISO 8601 ("2024-05-01T12:00:00", "2024-05-01 12:00:00,123", com ou sem fuso)
+# procurado só nos primeiros TIMESTAMP_SCAN caracteres da linha. As mensagens são contadas sem
+# timestamp e nível e com os números trocados por "#"; acima de MAX_MESSAGES mensagens distintas
+# as menos frequentes são descartadas (as contagens do topo passam a ser aproximadas).
+TIMESTAMP_RE = re.compile(r"(\d{4}-\d{2}-\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:[.,](\d+))?(Z|[+-]\d{2}:?\d{2})?")
+TIMESTAMP_SCAN = 64
+LEVEL_TAG_RE = re.compile(r"^[\s\[(<]*(?:ERROR|WARN(?:ING)?|INFO)\b[\])>:]*\s*", re.IGNORECASE)
+DIGITS_RE = re.compile(r"\d+")
+TOP_K = 10
+MAX_TOP_K = 1000
+BUCKET_SECONDS = 60
+MAX_BUCKET_SECONDS = 7 * 24 * 3600
+MAX_MESSAGES = 100000
+SUMMARY_READ = 4 * 1024 * 1024
+# agregados em memória de no máximo MAX_STATS arquivos (os usados há mais tempo saem primeiro)
+MAX_STATS = 32
+
+# vários arquivos no mesmo stream (LogRequest.paths): lotes que cada arquivo pode ter lidos à
+# frente da intercalação; limita a memória quando um arquivo está muito adiantado no tempo
+MERGE_READAHEAD = 4
+
+# inotify(7): mudanças no diretório do log (escrita, criação, renomeação, remoção)
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
 def infer_level(line: str) -> str:
     line_up = line.upper()
     if "ERROR" in line_up:
@@ -14,28 +104,915 @@ def infer_level(line: str) -> str:
         return "INFO"
     return "UNKNOWN"
 
+
+def line_levels(text):
+    """Níveis (infer_level) de cada linha de um trecho decodificado; um "\n" final não gera linha vazia."""
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return [infer_level(line) for line in lines]
+
+
+def line_filter(request):
+    """Predicado (linha, nível) -> bool com os filtros do LogRequest. Filtros inválidos: ValueError."""
+    levels = {level.upper() for level in request.levels}
+    unknown = levels.difference(LEVELS)
+    if unknown:
+        raise ValueError(f"Nível desconhecido: {', '.join(sorted(unknown))} (use {', '.join(LEVELS)})")
+    try:
+        pattern = re.compile(request.regex) if request.regex else None
+    except re.error as e:
+        raise ValueError(f"Expressão regular inválida: {e}") from e
+    contains = request.contains
+
+    def keep(line, level):
+        if levels and level not in levels:
+            return False
+        if contains and contains not in line:
+            return False
+        return pattern is None or pattern.search(line) is not None
+
+    return keep
+
+
+def check_request(request):
+    """Valida o LogRequest antes de abrir o stream (ValueError se inválido)."""
+    line_filter(request)
+    if request.start_line < 0 or request.end_line < 0:
+        raise ValueError("start_line e end_line não podem ser negativos")
+    if request.end_line and request.end_line < request.start_line:
+        raise ValueError("end_line menor que start_line")
+    if request.batch_size < 0:
+        raise ValueError("batch_size não pode ser negativo")
+    if request.last_lines < 0:
+        raise ValueError("last_lines não pode ser negativo")
+
+
+class LogIndex:
+    """
+    Índice esparso de um arquivo de log: offsets[k] é o byte da linha k*stride + 1 e
+    counts[4k:4k+4] as contagens de cada nível (ordem de LEVELS) nas linhas do bloco k.
+    Cobre as linhas completas até `indexed` bytes e é estendido quando o arquivo cresce.
+    """
+
+    def __init__(self, inode, stride=INDEX_STRIDE):
+        self.inode = inode
+        self.stride = stride
+        self.file_size = 0
+        self.indexed = 0
+        self.mtime_ns = 0
+        self.tail_crc = 0
+        self.lines = 0
+        self.offsets = array("Q")
+        self.counts = array("I")
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            magic, inode, file_size, indexed, mtime_ns, stride, lines, crc = INDEX_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return None
+        if magic != INDEX_MAGIC:
+            return None
+        index = cls(inode, stride)
+        index.file_size, index.indexed, index.mtime_ns, index.lines = file_size, indexed, mtime_ns, lines
+        index.tail_crc = crc
+        blocks = (lines + stride - 1) // stride
+        pos = INDEX_HEADER.size
+        index.offsets.frombytes(data[pos:pos + 8 * blocks])
+        index.counts.frombytes(data[pos + 8 * blocks:pos + 8 * blocks + 16 * blocks])
+        if len(index.offsets) != blocks or len(index.counts) != 4 * blocks:
+            return None  # arquivo de índice cortado
+        return index
+
+    def save(self, path):
+        # escreve em arquivo temporário e renomeia: um leitor nunca vê o índice pela metade
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.inode, self.file_size, self.indexed,
+                                      self.mtime_ns, self.stride, self.lines, self.tail_crc))
+            f.write(self.offsets.tobytes())
+            f.write(self.counts.tobytes())
+        os.replace(tmp, path)
+
+    def extend(self, f, st):
+        """Indexa as linhas completas a partir de `indexed` (o arquivo só cresceu)."""
+        f.seek(self.indexed)
+        offset, lines = self.indexed, self.lines
+        level_slot = {level: i for i, level in enumerate(LEVELS)}
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break  # linha ainda sendo escrita: fica para a próxima extensão
+            if lines % self.stride == 0:
+                self.offsets.append(offset)
+                self.counts.extend((0, 0, 0, 0))
+            level = infer_level(raw.decode("utf-8", errors="replace"))
+            self.counts[4 * (lines // self.stride) + level_slot[level]] += 1
+            offset += len(raw)
+            lines += 1
+        self.indexed, self.lines = offset, lines
+        self.file_size, self.mtime_ns = st.st_size, st.st_mtime_ns
+        self.tail_crc = tail_crc(f, self.indexed)
+
+    def locate(self, lineno):
+        """(byte, linhas antes dele) do início do bloco que contém `lineno`, ou (0, 0)."""
+        block = min((lineno - 1) // self.stride, len(self.offsets) - 1)
+        if block <= 0:
+            return 0, 0
+        return self.offsets[block], block * self.stride
+
+    def block_has(self, block, slots):
+        return any(self.counts[4 * block + slot] for slot in slots)
+
+
+_indexes = {}
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+def path_lock(key):
+    """Lock por arquivo (e tipo de dado em cache): quem chega depois espera e reaproveita o resultado."""
+    with _path_locks_guard:
+        return _path_locks.setdefault(key, threading.Lock())
+
+
+def tail_crc(f, end):
+    """crc32 dos TAIL_CHECK bytes de `f` que terminam em `end` (move a posição de `f`)."""
+    start = max(0, end - TAIL_CHECK)
+    f.seek(start)
+    return zlib.crc32(f.read(end - start))
+
+
+def same_file(cached, st, f=None, covered=0):
+    """
+    O arquivo de `st` ainda é o que `cached` (inode, file_size, mtime_ns) descreve, no máximo com
+    linhas a mais? Não se o inode mudou, se diminuiu ou se mudou de mtime sem mudar de tamanho.
+    Com `f` (o arquivo aberto), também não se cresceu mas o fim do trecho já coberto (os bytes até
+    `covered`, cached.tail_crc) mudou: reescrito no lugar. Pode mover a posição de `f`.
+    """
+    if cached.inode != st.st_ino or st.st_size < cached.file_size:
+        return False
+    if st.st_size == cached.file_size:
+        return st.st_mtime_ns == cached.mtime_ns
+    return f is None or tail_crc(f, covered) == cached.tail_crc
+
+
+def get_index(path, f):
+    """
+    Índice atualizado de um log aberto em `f`, ou None se o arquivo é pequeno. Reaproveita o
+    índice em memória ou em <log>.idx e o reconstrói se o arquivo não é mais o mesmo (same_file);
+    se só cresceu, indexa apenas o trecho novo. A posição de `f` é preservada.
+    """
+    st = os.fstat(f.fileno())
+    if st.st_size < INDEX_MIN_SIZE:
+        return None
+    # same_file e extend leem por `f`: a posição volta para quem chamou (LogTail em follow lê por ele)
+    pos = f.tell()
+    with path_lock(("index", path)):
+        sidecar = path + ".idx"
+        index = _indexes.get(path) or LogIndex.load(sidecar)
+        try:
+            if index is None or not same_file(index, st, f, index.indexed):
+                index = LogIndex(st.st_ino)
+            extend = st.st_size != index.file_size or st.st_mtime_ns != index.mtime_ns
+            if extend:
+                index.extend(f, st)
+        finally:
+            f.seek(pos)
+        if extend:
+            try:
+                index.save(sidecar)
+            except OSError:
+                pass  # diretório sem permissão de escrita: o índice fica só em memória
+        _indexes[path] = index
+        return index
+
+
+class LogTail:
+    """
+    Leitor incremental de um arquivo de log com posição em bytes, para retomar (ResumeToken) e
+    para follow. read_batch() nunca espera: no fim do arquivo marca at_eof e devolve o que tiver;
+    quem chama decide se termina ou espera por mudanças (FileWatcher). Com follow, rotação
+    (o caminho passa a apontar para outro inode) e truncamento são detectados no fim do arquivo.
+    """
+
+    def __init__(self, request):
+        self.path = request.path
+        self.follow = request.follow
+        self.keep = line_filter(request)
+        self.start = max(1, request.start_line)
+        self.end = request.end_line or None
+        self.done = False
+        self.at_eof = False
+        self._open()
+        self.index = get_index(self.path, self.f)
+        # com filtro de nível e índice, blocos sem nenhuma linha dos níveis pedidos são pulados
+        self.level_slots = [LEVELS.index(level.upper()) for level in request.levels]
+        token = request.resume
+        if token.offset and token.inode in (0, self.inode) and token.offset <= os.fstat(self.f.fileno()).st_size:
+            self.reader.seek(token.offset)
+            self.offset, self.lineno = token.offset, token.lineno
+            return
+        # se o arquivo do token foi rotacionado ou truncado, começa do início do arquivo atual
+        if request.last_lines:
+            total = self._count_lines()
+            self.start = max(self.start, total - request.last_lines + 1)
+        if self.index and self.start > 1:
+            # pula direto para o bloco da linha inicial em vez de ler as anteriores
+            self.offset, self.lineno = self.index.locate(self.start)
+            self.reader.seek(self.offset)
+
+    def _open(self):
+        self.f = open(self.path, "rb")
+        st = os.fstat(self.f.fileno())
+        self.inode = st.st_ino
+        self.offset = 0
+        self.lineno = 0
+        # sem follow o arquivo é lido como está agora: mmap evita cópias por leitura e permite
+        # posicionar em qualquer byte sem custo; em follow ele cresce, então lê pelo arquivo
+        self.mm = None
+        if not self.follow and st.st_size > 0:
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.reader = self.mm or self.f
+
+    def _count_lines(self):
+        if self.index is None:
+            self.reader.seek(0)
+            total = sum(1 for _ in iter(self.reader.readline, b""))
+            self.reader.seek(0)
+            return total
+        # linhas indexadas mais as do trecho final ainda não indexado (inclusive uma incompleta)
+        self.reader.seek(self.index.indexed)
+        total = self.index.lines + sum(1 for _ in iter(self.reader.readline, b""))
+        self.reader.seek(0)
+        return total
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+        self.f.close()
+
+    def _skip_block(self):
+        # no início de um bloco indexado sem nenhuma linha dos níveis pedidos: pula o bloco
+        block = self.lineno // self.index.stride
+        if block + 1 >= len(self.index.offsets) or self.lineno + 1 < self.start:
+            return False
+        if self.index.block_has(block, self.level_slots):
+            return False
+        self.lineno += self.index.stride
+        self.offset = self.index.offsets[block + 1]
+        self.reader.seek(self.offset)
+        return True
+
+    def parallel_ranges(self):
+        """
+        Faixas (início, fim, linhas antes dela) que cobrem o trecho indexado ainda por ler, em blocos
+        inteiros do índice e com até PARALLEL_CHUNK bytes, para classify_range. Blocos sem os níveis
+        pedidos ficam de fora. O leitor passa para o fim das faixas: read_batch continua dali com
+        o que não foi indexado. Lista vazia quando o modo paralelo não se aplica.
+        """
+        index = self.index
+        if (self.follow or index is None or self.lineno % index.stride
+                or index.indexed - self.offset < PARALLEL_MIN_BYTES):
+            return []
+        stride, blocks = index.stride, len(index.offsets)
+        last = blocks if not self.end else min(blocks, (self.end - 1) // stride + 1)
+        ranges = []
+        run = None
+        for block in range(self.lineno // stride, last):
+            start = index.offsets[block]
+            end = index.offsets[block + 1] if block + 1 < blocks else index.indexed
+            if self.level_slots and not index.block_has(block, self.level_slots):
+                run = None
+            elif run is not None and end - run[0] <= PARALLEL_CHUNK:
+                run[1] = end
+            else:
+                run = [start, end, block * stride]
+                ranges.append(run)
+        if last < blocks:
+            self.done = True  # end_line cai dentro das faixas
+        else:
+            self.offset, self.lineno = index.indexed, index.lines
+            self.reader.seek(self.offset)
+        return [tuple(run) for run in ranges]
+
+    def read_batch(self, batch_size):
+        batch, size, scanned = [], 0, 0
+        self.at_eof = False
+        while len(batch) < batch_size and size < MAX_BATCH_BYTES and scanned < MAX_SCAN_BYTES:
+            if (self.index and self.level_slots and self.lineno % self.index.stride == 0
+                    and self.offset < self.index.indexed and self._skip_block()):
+                if self.end and self.lineno >= self.end:
+                    self.done = True
+                    break
+                continue
+            raw = self.reader.readline()
+            if not raw or (self.follow and not raw.endswith(b"\n")):
+                # linha incompleta em follow: deixa para quando o resto for escrito
+                self.reader.seek(self.offset)
+                self.at_eof = True
+                if not self.follow:
+                    self.done = True
+                elif not batch and self._check_replaced():
+                    self.at_eof = False  # arquivo novo ou truncado: já há o que ler de novo
+                break
+            self.offset += len(raw)
+            self.lineno += 1
+            scanned += len(raw)
+            if self.lineno < self.start:
+                continue
+            if self.end and self.lineno > self.end:
+                self.done = True
+                break
+            line = raw.decode("utf-8", errors="replace").strip()
+            level = infer_level(line)
+            if not self.keep(line, level):
+                continue
+            token = pb.ResumeToken(offset=self.offset, lineno=self.lineno, inode=self.inode)
+            batch.append(pb.LogEvent(lineno=self.lineno, level=level, line=line, token=token))
+            size += len(raw)
+        return batch
+
+    def _check_replaced(self):
+        # no fim do arquivo em follow: o caminho ainda é o mesmo arquivo, do mesmo tamanho?
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False  # rotação em andamento: o arquivo novo ainda não foi criado
+        if st.st_ino != self.inode:
+            # rotacionado: o antigo já foi lido até o fim (at_eof), segue no novo desde o início
+            self.close()
+            self._open()
+            self.index = None
+        elif st.st_size < self.offset:
+            # truncado (copytruncate, > arquivo): recomeça do início
+            self.reader.seek(0)
+            self.offset = self.lineno = 0
+            self.index = None
+        else:
+            return False
+        return True
+
+
+class FileChangedError(Exception):
+    pass
+
+
+def classify_range(path, inode, start, end, lineno, first, last, request_bytes, batch_size, events=False):
+    """
+    Executado nos processos do modo paralelo: lê as linhas inteiras em [start, end) do log (lineno
+    é o número da linha anterior a start), fica com as linhas de first a last (None = sem fim) que
+    passam nos filtros do LogRequest serializado e devolve os lotes já serializados, em ordem: cada
+    um como LogBatch ou, com events, como lista de LogEvent. Bytes atravessam o pool bem mais
+    barato que objetos e saem para o cliente como estão (serializer).
+    """
+    keep = line_filter(pb.LogRequest.FromString(request_bytes))
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_ino != inode:
+            raise FileChangedError(f"Arquivo substituído durante a leitura: {path}")
+        f.seek(start)
+        data = f.read(end - start)
+    raws = data.split(b"\n")
+    raws.pop()  # a faixa termina em fim de linha
+    # "\n" nunca faz parte de um caractere multibyte: decodificar a faixa inteira dá as mesmas linhas
+    text = data.decode("utf-8", errors="replace")
+    if events:
+        def serialize(batch):
+            return [event.SerializeToString() for event in batch]
+    else:
+        def serialize(batch):
+            return pb.LogBatch(events=batch).SerializeToString()
+    batches, batch, size = [], [], 0
+    offset = start
+    for raw, line, level in zip(raws, text.split("\n"), line_levels(text)):
+        offset += len(raw) + 1
+        lineno += 1
+        if lineno < first:
+            continue
+        if last and lineno > last:
+            break
+        line = line.strip()
+        if not keep(line, level):
+            continue
+        token = pb.ResumeToken(offset=offset, lineno=lineno, inode=inode)
+        batch.append(pb.LogEvent(lineno=lineno, level=level, line=line, token=token))
+        size += len(raw)
+        if len(batch) >= batch_size or size >= MAX_BATCH_BYTES:
+            batches.append(serialize(batch))
+            batch, size = [], 0
+    if batch:
+        batches.append(serialize(batch))
+    return batches
+
+
+def submit_ranges(pool, tail, ranges, request, batch_size, events=False):
+    """Futures de classify_range, na ordem do arquivo; gerador, para submeter só o que cabe no readahead."""
+    request_bytes = request.SerializeToString()
+    for start, end, lineno in ranges:
+        yield pool.submit(classify_range, tail.path, tail.inode, start, end, lineno, tail.start, tail.end,
+                          request_bytes, batch_size, events)
+
+
+def process_pool(processes):
+    # spawn: processos novos, sem herdar as threads do gRPC por fork
+    return futures.ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+
+
+@functools.lru_cache(maxsize=1024)
+def day_start(date):
+    return calendar.timegm(time.strptime(date, "%Y-%m-%d"))
+
+
+def line_time(match):
+    """Segundos desde 1970 de um TIMESTAMP_RE encontrado; sem fuso, lido como UTC. None se inválido."""
+    date, hours, minutes, seconds, fraction, zone = match.groups()
+    try:
+        ts = day_start(date) + int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    except ValueError:
+        return None
+    if fraction:
+        ts += float("0." + fraction)
+    if zone and zone != "Z":
+        offset = int(zone[1:3]) * 3600 + int(zone[-2:]) * 60
+        ts -= offset if zone[0] == "+" else -offset
+    return ts
+
+
+def message_key(line):
+    return DIGITS_RE.sub("#", LEVEL_TAG_RE.sub("", line, count=1)).strip()
+
+
+class LogStats:
+    """
+    Agregados de um log para Summarize, de uma passada só e estendidos quando o arquivo só cresce
+    (como o LogIndex): linhas por nível, contagem de cada mensagem (nível, message_key) e linhas por
+    nível em cada intervalo de bucket_seconds. Cobre as linhas completas até `scanned` bytes.
+    """
+
+    def __init__(self, inode, bucket_seconds):
+        self.inode = inode
+        self.bucket_seconds = bucket_seconds
+        self.file_size = 0
+        self.scanned = 0
+        self.mtime_ns = 0
+        self.tail_crc = 0
+        self.lines = 0
+        self.untimed = 0
+        self.levels = collections.Counter()
+        self.messages = collections.Counter()
+        self.buckets = collections.defaultdict(collections.Counter)
+
+    def extend(self, f, st):
+        f.seek(self.scanned)
+        while True:
+            raws = f.readlines(SUMMARY_READ)
+            partial = bool(raws) and not raws[-1].endswith(b"\n")
+            if partial:
+                raws.pop()  # linha ainda sendo escrita: fica para a próxima extensão
+            if raws:
+                data = b"".join(raws)
+                self.scanned += len(data)
+                self._add(data.decode("utf-8", errors="replace"))
+            if partial or not raws:
+                break
+        self.file_size, self.mtime_ns = st.st_size, st.st_mtime_ns
+        self.tail_crc = tail_crc(f, self.scanned)
+
+    def _add(self, text):
+        levels = line_levels(text)
+        self.lines += len(levels)
+        self.levels.update(levels)
+        bucket_seconds, buckets, messages = self.bucket_seconds, self.buckets, self.messages
+        for line, level in zip(text.split("\n"), levels):
+            match = TIMESTAMP_RE.search(line, 0, TIMESTAMP_SCAN)
+            ts = line_time(match) if match else None
+            if ts is None:
+                self.untimed += 1
+            else:
+                ts = int(ts)
+                buckets[ts - ts % bucket_seconds][level] += 1
+                line = line[:match.start()] + line[match.end():]
+            messages[level, message_key(line)] += 1
+        if len(messages) > MAX_MESSAGES:
+            self.messages = collections.Counter(dict(messages.most_common(MAX_MESSAGES // 2)))
+
+    def summary(self, top_k):
+        return pb.LogSummary(
+            lines=self.lines,
+            levels=self.levels,
+            top_messages=[pb.MessageCount(message=message, level=level, count=count)
+                          for (level, message), count in self.messages.most_common(top_k)],
+            buckets=[pb.TimeBucket(start=start, levels=self.buckets[start]) for start in sorted(self.buckets)],
+            bucket_seconds=self.bucket_seconds,
+            untimed_lines=self.untimed,
+        )
+
+
+_stats = collections.OrderedDict()  # caminho -> LogStats, do usado há mais tempo ao mais recente
+_stats_guard = threading.Lock()
+
+
+def summarize(request):
+    """
+    LogSummary de um SummaryRequest. Os agregados ficam em memória (um por arquivo, até MAX_STATS
+    arquivos): uma nova chamada com a mesma largura de intervalo só lê o que foi acrescentado ao
+    log desde a anterior; com outra largura, o arquivo é lido de novo.
+    """
+    if request.top_k < 0:
+        raise ValueError("top_k não pode ser negativo")
+    if not 0 <= request.bucket_seconds <= MAX_BUCKET_SECONDS:
+        raise ValueError(f"bucket_seconds deve estar entre 1 e {MAX_BUCKET_SECONDS} (0 = {BUCKET_SECONDS})")
+    top_k = min(request.top_k or TOP_K, MAX_TOP_K)
+    bucket_seconds = request.bucket_seconds or BUCKET_SECONDS
+    path = request.path
+    with open(path, "rb") as f, path_lock(("stats", path)):
+        st = os.fstat(f.fileno())
+        with _stats_guard:
+            stats = _stats.get(path)
+        if stats is None or stats.bucket_seconds != bucket_seconds or not same_file(stats, st, f, stats.scanned):
+            stats = LogStats(st.st_ino, bucket_seconds)
+        if st.st_size != stats.file_size or st.st_mtime_ns != stats.mtime_ns:
+            stats.extend(f, st)
+        with _stats_guard:
+            _stats[path] = stats
+            _stats.move_to_end(path)
+            while len(_stats) > MAX_STATS:
+                _stats.popitem(last=False)
+        return stats.summary(top_k)
+
+
+def request_paths(request):
+    """path e paths do pedido, com os padrões glob expandidos (sem os índices .idx), sem repetições."""
+    paths = []
+    for pattern in ([request.path] if request.path else []) + list(request.paths):
+        if glob.has_magic(pattern):
+            matches = [path for path in sorted(glob.glob(pattern)) if not path.endswith(".idx")]
+            if not matches:
+                raise FileNotFoundError(errno.ENOENT, "Nenhum arquivo com este padrão", pattern)
+            paths.extend(matches)
+        else:
+            paths.append(pattern)
+    return list(dict.fromkeys(paths))
+
+
+def single_request(request, path):
+    single = pb.LogRequest()
+    single.CopyFrom(request)
+    single.path = path
+    del single.paths[:]
+    return single
+
+
+def open_tail(request):
+    """LogTail para um arquivo; MergedTail quando o pedido resulta em mais de um."""
+    paths = request_paths(request)
+    if len(paths) == 1:
+        return LogTail(single_request(request, paths[0]))
+    if not paths:
+        raise ValueError("Nenhum arquivo informado")
+    if request.follow or request.HasField("resume"):
+        raise ValueError("follow e resume não são suportados com vários arquivos")
+    return MergedTail(request, paths)
+
+
+class MergedTail:
+    """
+    Vários logs como um stream só, em ordem de timestamp: cada arquivo é lido por um LogTail em
+    uma thread própria, com até MERGE_READAHEAD lotes à frente, e os eventos são intercalados
+    com heapq.merge (k-way merge). Linhas sem timestamp ficam com o da linha anterior do mesmo
+    arquivo (continuações, stack traces); empates saem na ordem dos arquivos. Mesma interface de
+    LogTail para os servicers.
+    """
+
+    def __init__(self, request, paths):
+        self.follow = False
+        self.done = False
+        self.at_eof = False
+        self.stop = threading.Event()
+        self.tails = []
+        try:
+            for path in paths:
+                self.tails.append(LogTail(single_request(request, path)))
+        except Exception:
+            self.close()
+            raise
+        queues = [queue.Queue(MERGE_READAHEAD) for _ in self.tails]
+        self.threads = [threading.Thread(target=self._read, args=(tail, q), name=f"merge-{tail.path}", daemon=True)
+                        for tail, q in zip(self.tails, queues)]
+        for thread in self.threads:
+            thread.start()
+        self.events = heapq.merge(*(self._drain(q) for q in queues), key=lambda item: item[0])
+
+    def _read(self, tail, q):
+        last = float("-inf")  # linhas antes do primeiro timestamp do arquivo vêm primeiro
+        try:
+            while not tail.done and not self.stop.is_set():
+                items = []
+                for event in tail.read_batch(READ_BATCH):
+                    event.source = tail.path
+                    match = TIMESTAMP_RE.search(event.line, 0, TIMESTAMP_SCAN)
+                    ts = line_time(match) if match else None
+                    if ts is not None:
+                        last = ts
+                    items.append((last, event))
+                self._put(q, items)
+            self._put(q, None)
+        except Exception as e:
+            self._put(q, e)
+
+    def _put(self, q, item):
+        # espera vaga na fila, mas desiste se o stream foi fechado
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=FOLLOW_POLL)
+                return
+            except queue.Full:
+                pass
+
+    @staticmethod
+    def _drain(q):
+        while True:
+            items = q.get()
+            if items is None:
+                return
+            if isinstance(items, Exception):
+                raise items
+            yield from items
+
+    def parallel_ranges(self):
+        return []  # o modo paralelo vale para um arquivo só
+
+    def read_batch(self, batch_size):
+        batch = [event for _ts, event in itertools.islice(self.events, batch_size)]
+        if len(batch) < batch_size:
+            self.done = self.at_eof = True
+        return batch
+
+    def close(self):
+        self.stop.set()
+        for thread in getattr(self, "threads", []):
+            thread.join()
+        for tail in self.tails:
+            tail.close()
+
+
+class FileWatcher:
+    """Espera por mudanças no diretório de um arquivo: inotify no Linux, senão polling."""
+
+    def __init__(self, path):
+        self.fd = None
+        libc_name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+        if libc is None or not hasattr(libc, "inotify_init1"):
+            return
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(fd, directory.encode(), WATCH_MASK) < 0:
+            os.close(fd)
+            return
+        self.fd = fd
+
+    def _drain(self):
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout=FOLLOW_POLL):
+        if self.fd is None:
+            time.sleep(timeout)
+            return
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            self._drain()
+
+    async def wait_async(self, timeout=FOLLOW_POLL):
+        if self.fd is None:
+            await asyncio.sleep(timeout)
+            return
+        loop = asyncio.get_running_loop()
+        changed = loop.create_future()
+        loop.add_reader(self.fd, lambda: changed.done() or changed.set_result(None))
+        try:
+            await asyncio.wait_for(changed, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(self.fd)
+        self._drain()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def batch_size_for(request):
+    return min(request.batch_size or READ_BATCH, MAX_BATCH)
+
+
+def passthrough(message_class):
+    """Serializador de resposta que também aceita a mensagem já serializada (bytes) e a envia como está."""
+    serialize = message_class.SerializeToString
+
+    def serializer(message):
+        return message if isinstance(message, bytes) else serialize(message)
+
+    return serializer
+
+
+def add_servicer(servicer, server):
+    """
+    Como pb_grpc.add_LogServiceServicer_to_server, mas os streams aceitam LogEvent/LogBatch já
+    serializados: os lotes do modo paralelo saem dos processos direto para o gRPC, sem o processo
+    principal desserializar e serializar de novo cada evento.
+    """
+    handlers = {
+        "StreamLogs": grpc.unary_stream_rpc_method_handler(
+            servicer.StreamLogs,
+            request_deserializer=pb.LogRequest.FromString,
+            response_serializer=passthrough(pb.LogEvent),
+        ),
+        "StreamLogBatches": grpc.unary_stream_rpc_method_handler(
+            servicer.StreamLogBatches,
+            request_deserializer=pb.LogRequest.FromString,
+            response_serializer=passthrough(pb.LogBatch),
+        ),
+        "Summarize": grpc.unary_unary_rpc_method_handler(
+            servicer.Summarize,
+            request_deserializer=pb.SummaryRequest.FromString,
+            response_serializer=pb.LogSummary.SerializeToString,
+        ),
+    }
+    server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler("logdemo.LogService", handlers),))
+
+
 class LogServiceServicer(pb_grpc.LogServiceServicer):
+    def __init__(self, processes=0):
+        # com processes, trechos grandes já indexados são lidos em paralelo (classify_range)
+        self.pool = process_pool(processes) if processes else None
+        self.readahead = PARALLEL_READAHEAD * processes
+
+    # os lotes do modo paralelo chegam serializados (bytes) e passam direto (add_servicer)
     def StreamLogs(self, request, context):
-        path = request.path
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                for idx, line in enumerate(f, start=1):
-                    line = line.strip()
-                    yield pb.LogEvent(
-                        lineno=idx,
-                        level=infer_level(line),
-                        line=line
-                    )
+        for batch in self._batches(request, READ_BATCH, context, events=True):
+            yield from batch
+
+    def StreamLogBatches(self, request, context):
+        for batch in self._batches(request, batch_size_for(request), context):
+            yield batch if isinstance(batch, bytes) else pb.LogBatch(events=batch)
+
+    def Summarize(self, request, context):
+        try:
+            return summarize(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except FileNotFoundError:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Arquivo não encontrado: {request.path}")
+
+    def _batches(self, request, batch_size, context, events=False):
+        try:
+            check_request(request)
+            tail = open_tail(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except FileNotFoundError as e:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Arquivo não encontrado: {e.filename or request.path}")
+        watcher = FileWatcher(tail.path) if request.follow else None
+        try:
+            if self.pool:
+                yield from self._parallel(tail, request, batch_size, context, events)
+            while not tail.done and context.is_active():
+                batch = tail.read_batch(batch_size)
+                if batch:
+                    yield batch
+                elif tail.at_eof and watcher:
+                    watcher.wait()
+        finally:
+            tail.close()
+            if watcher:
+                watcher.close()
+
+    def _parallel(self, tail, request, batch_size, context, events=False):
+        ranges = submit_ranges(self.pool, tail, tail.parallel_ranges(), request, batch_size, events)
+        pending = collections.deque(itertools.islice(ranges, self.readahead))
+        try:
+            while pending and context.is_active():
+                batches = pending.popleft().result()
+                pending.extend(itertools.islice(ranges, 1))
+                yield from batches
+        except FileChangedError as e:
+            context.abort(grpc.StatusCode.ABORTED, str(e))
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class AioLogServiceServicer(pb_grpc.LogServiceServicer):
+    """
+    Streams em grpc.aio: cada stream aberto é uma corrotina, não uma thread do servidor. A leitura
+    do arquivo roda em threads (asyncio.to_thread), um lote por vez; em follow, a espera por
+    linhas novas é assíncrona (inotify no event loop), então streams parados não ocupam threads.
+    """
+
+    def __init__(self, processes=0):
+        self.pool = process_pool(processes) if processes else None
+        self.readahead = PARALLEL_READAHEAD * processes
+
+    async def StreamLogs(self, request, context):
+        async for batch in self._batches(request, READ_BATCH, context, events=True):
+            for event in batch:
+                yield event
+
+    async def StreamLogBatches(self, request, context):
+        async for batch in self._batches(request, batch_size_for(request), context):
+            yield batch if isinstance(batch, bytes) else pb.LogBatch(events=batch)
+
+    async def Summarize(self, request, context):
+        try:
+            return await asyncio.to_thread(summarize, request)
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
         except FileNotFoundError:
-            context.abort(grpc.StatusCode.NOT_FOUND, f"Arquivo não encontrado: {path}")
+            await context.abort(grpc.StatusCode.NOT_FOUND, f"Arquivo não encontrado: {request.path}")
+
+    async def _batches(self, request, batch_size, context, events=False):
+        try:
+            check_request(request)
+            tail = await asyncio.to_thread(open_tail, request)
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except FileNotFoundError as e:
+            await context.abort(grpc.StatusCode.NOT_FOUND, f"Arquivo não encontrado: {e.filename or request.path}")
+        watcher = FileWatcher(tail.path) if request.follow else None
+        try:
+            if self.pool:
+                async for batch in self._parallel(tail, request, batch_size, context, events):
+                    yield batch
+            while not tail.done:
+                batch = await asyncio.to_thread(tail.read_batch, batch_size)
+                if batch:
+                    yield batch
+                elif tail.at_eof and watcher:
+                    await watcher.wait_async()
+        finally:
+            tail.close()
+            if watcher:
+                watcher.close()
 
-def serve():
+    async def _parallel(self, tail, request, batch_size, context, events=False):
+        ranges = await asyncio.to_thread(tail.parallel_ranges)
+        ranges = submit_ranges(self.pool, tail, ranges, request, batch_size, events)
+        pending = collections.deque(asyncio.wrap_future(f) for f in itertools.islice(ranges, self.readahead))
+        try:
+            while pending:
+                batches = await pending.popleft()
+                pending.extend(asyncio.wrap_future(f) for f in itertools.islice(ranges, 1))
+                for batch in batches:
+                    yield batch
+        except FileChangedError as e:
+            await context.abort(grpc.StatusCode.ABORTED, str(e))
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Servidor gRPC de análise de logs")
+    p.add_argument("--port", type=int, default=50051, help="Porta (padrão: 50051)")
+    p.add_argument("--aio", action="store_true",
+                   help="Usar grpc.aio (asyncio): streams simultâneos não ficam limitados ao número de threads")
+    p.add_argument("--processes", type=int, default=0, metavar="N",
+                   help="Ler logs grandes já indexados em N processos em paralelo; 0 = desligado (padrão: 0)")
+    return p.parse_args()
+
+
+def serve(port=50051, processes=0):
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=5))
-    pb_grpc.add_LogServiceServicer_to_server(LogServiceServicer(), server)
-    server.add_insecure_port("[::]:50051")
-    print("Servidor ouvindo em 0.0.0.0:50051")
+    add_servicer(LogServiceServicer(processes), server)
+    server.add_insecure_port(f"[::]:{port}")
+    print(f"Servidor ouvindo em 0.0.0.0:{port}")
     server.start()
     server.wait_for_termination()
 
+
+async def serve_aio(port=50051, processes=0):
+    server = grpc.aio.server()
+    add_servicer(AioLogServiceServicer(processes), server)
+    server.add_insecure_port(f"[::]:{port}")
+    print(f"Servidor (aio) ouvindo em 0.0.0.0:{port}")
+    await server.start()
+    await server.wait_for_termination()
+
+
 if __name__ == "__main__":
-    serve()
+    args = parse_args()
+    if args.aio:
+        asyncio.run(serve_aio(args.port, args.processes))
+    else:
+        serve(args.port, args.processes)
@@ -24,21 +24,41 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\ncalc.proto\x12\x04\x63\x61lc\" \n\x08\x42inaryOp\x12\t\n\x01\x61\x18\x01 \x01(\x01\x12\t\n\x01\x62\x18\x02 \x01(\x01\"\'\n\tBinaryMat\x12\x0c\n\x04mat2\x18\x01 \x03(\x01\x12\x0c\n\x04mat1\x18\x02 \x03(\x01\"\x1a\n\tResultMat\x12\r\n\x05value\x18\x01 \x03(\x01\"\x17\n\x06Result\x12\r\n\x05value\x18\x01 \x01(\x01\x32\xa7\x01\n\nCalculator\x12#\n\x03\x41\x64\x64\x12\x0e.calc.BinaryOp\x1a\x0c.calc.Result\x12#\n\x03Mul\x12\x0e.calc.BinaryOp\x1a\x0c.calc.Result\x12#\n\x03\x44iv\x12\x0e.calc.BinaryOp\x1a\x0c.calc.Result\x12*\n\x06MatMul\x12\x0f.calc.BinaryMat\x1a\x0f.calc.ResultMatb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\ncalc.proto\x12\x04\x63\x61lc\" \n\x08\x42inaryOp\x12\t\n\x01\x61\x18\x01 \x01(\x01\x12\t\n\x01\x62\x18\x02 \x01(\x01\"\x17\n\x06Result\x12\r\n\x05value\x18\x01 \x01(\x01\":\n\x0c\x42\x61tchRequest\x12\x14\n\x02op\x18\x01 \x01(\x0e\x32\x08.calc.Op\x12\t\n\x01\x61\x18\x02 \x03(\x01\x12\t\n\x01\x62\x18\x03 \x03(\x01\"2\n\x0b\x42\x61tchResult\x12\x0e\n\x06values\x18\x01 \x03(\x01\x12\x13\n\x0b\x64iv_by_zero\x18\x02 \x03(\r\"D\n\tOperation\x12\x0b\n\x03tag\x18\x01 \x01(\x04\x12\x14\n\x02op\x18\x02 \x01(\x0e\x32\x08.calc.Op\x12\t\n\x01\x61\x18\x03 \x01(\x01\x12\t\n\x01\x62\x18\x04 \x01(\x01\"5\n\x08OpResult\x12\x0b\n\x03tag\x18\x01 \x01(\x04\x12\r\n\x05value\x18\x02 \x01(\x01\x12\r\n\x05\x65rror\x18\x03 \x01(\t\"*\n\nOperations\x12\x1c\n\x03ops\x18\x01 \x03(\x0b\x32\x0f.calc.Operation\",\n\tOpResults\x12\x1f\n\x07results\x18\x01 \x03(\x0b\x32\x0e.calc.OpResult\"H\n\x05Instr\x12\x16\n\x02op\x18\x01 \x01(\x0e\x32\x08.calc.OpH\x00\x12\r\n\x03var\x18\x02 \x01(\tH\x00\x12\x10\n\x06number\x18\x03 \x01(\x01H\x00\x42\x06\n\x04kind\"$\n\x07Program\x12\x19\n\x04\x63ode\x18\x01 \x03(\x0b\x32\x0b.calc.Instr\"(\n\x08Variable\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0e\n\x06values\x18\x02 \x03(\x01\"K\n\x0b\x45valRequest\x12\x1e\n\x07program\x18\x01 \x01(\x0b\x32\r.calc.Program\x12\x1c\n\x04vars\x18\x02 \x03(\x0b\x32\x0e.calc.Variable\"1\n\nEvalResult\x12\x0e\n\x06values\x18\x01 \x03(\x01\x12\x13\n\x0b\x64iv_by_zero\x18\x02 \x03(\r*(\n\x02Op\x12\x07\n\x03\x41\x44\x44\x10\x00\x12\x07\n\x03SUB\x10\x01\x12\x07\n\x03MUL\x10\x02\x12\x07\n\x03\x44IV\x10\x03\x32\x95\x02\n\nCalculator\x12#\n\x03\x41\x64\x64\x12\x0e.calc.BinaryOp\x1a\x0c.calc.Result\x12#\n\x03Mul\x12\x0e.calc.BinaryOp\x1a\x0c.calc.Result\x12#\n\x03\x44iv\x12\x0e.calc.BinaryOp\x1a\x0c.calc.Result\x12\x35\n\x0c\x42\x61tchCompute\x12\x12.calc.BatchRequest\x1a\x11.calc.BatchResult\x12\x30\n\x07\x43ompute\x12\x10.calc.Operations\x1a\x0f.calc.OpResults(\x01\x30\x01\x12/\n\x08\x45valuate\x12\x11.calc.EvalRequest\x1a\x10.calc.EvalResultb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'calc_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
+  _globals['_OP']._serialized_start=688
+  _globals['_OP']._serialized_end=728
   _globals['_BINARYOP']._serialized_start=20
   _globals['_BINARYOP']._serialized_end=52
-  _globals['_BINARYMAT']._serialized_start=54
-  _globals['_BINARYMAT']._serialized_end=93
-  _globals['_RESULTMAT']._serialized_start=95
-  _globals['_RESULTMAT']._serialized_end=121
-  _globals['_RESULT']._serialized_start=123
-  _globals['_RESULT']._serialized_end=146
-  _globals['_CALCULATOR']._serialized_start=149
-  _globals['_CALCULATOR']._serialized_end=316
+  _globals['_RESULT']._serialized_start=54
+  _globals['_RESULT']._serialized_end=77
+  _globals['_BATCHREQUEST']._serialized_start=79
+  _globals['_BATCHREQUEST']._serialized_end=137
+  _globals['_BATCHRESULT']._serialized_start=139
+  _globals['_BATCHRESULT']._serialized_end=189
+  _globals['_OPERATION']._serialized_start=191
+  _globals['_OPERATION']._serialized_end=259
+  _globals['_OPRESULT']._serialized_start=261
+  _globals['_OPRESULT']._serialized_end=314
+  _globals['_OPERATIONS']._serialized_start=316
+  _globals['_OPERATIONS']._serialized_end=358
+  _globals['_OPRESULTS']._serialized_start=360
+  _globals['_OPRESULTS']._serialized_end=404
+  _globals['_INSTR']._serialized_start=406
+  _globals['_INSTR']._serialized_end=478
+  _globals['_PROGRAM']._serialized_start=480
+  _globals['_PROGRAM']._serialized_end=516
+  _globals['_VARIABLE']._serialized_start=518
+  _globals['_VARIABLE']._serialized_end=558
+  _globals['_EVALREQUEST']._serialized_start=560
+  _globals['_EVALREQUEST']._serialized_end=635
+  _globals['_EVALRESULT']._serialized_start=637
+  _globals['_EVALRESULT']._serialized_end=686
+  _globals['_CALCULATOR']._serialized_start=731
+  _globals['_CALCULATOR']._serialized_end=1008
 # @@protoc_insertion_point(module_scope)
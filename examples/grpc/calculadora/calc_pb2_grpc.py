@@ -26,7 +26,7 @@ if _version_not_supported:
 
 
 class CalculatorStub(object):
-    """Serviço com três RPCs unary
+    """Serviço: RPCs unary de um par de operandos, vetorizadas, um stream bidirecional e avaliação de expressões
     """
 
     def __init__(self, channel):
@@ -50,15 +50,25 @@ class CalculatorStub(object):
                 request_serializer=calc__pb2.BinaryOp.SerializeToString,
                 response_deserializer=calc__pb2.Result.FromString,
                 _registered_method=True)
-        self.MatMul = channel.unary_unary(
-                '/calc.Calculator/MatMul',
-                request_serializer=calc__pb2.BinaryMat.SerializeToString,
-                response_deserializer=calc__pb2.ResultMat.FromString,
+        self.BatchCompute = channel.unary_unary(
+                '/calc.Calculator/BatchCompute',
+                request_serializer=calc__pb2.BatchRequest.SerializeToString,
+                response_deserializer=calc__pb2.BatchResult.FromString,
+                _registered_method=True)
+        self.Compute = channel.stream_stream(
+                '/calc.Calculator/Compute',
+                request_serializer=calc__pb2.Operations.SerializeToString,
+                response_deserializer=calc__pb2.OpResults.FromString,
+                _registered_method=True)
+        self.Evaluate = channel.unary_unary(
+                '/calc.Calculator/Evaluate',
+                request_serializer=calc__pb2.EvalRequest.SerializeToString,
+                response_deserializer=calc__pb2.EvalResult.FromString,
                 _registered_method=True)
 
 
 class CalculatorServicer(object):
-    """Serviço com três RPCs unary
+    """Serviço: RPCs unary de um par de operandos, vetorizadas, um stream bidirecional e avaliação de expressões
     """
 
     def Add(self, request, context):
@@ -79,7 +89,19 @@ class CalculatorServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
-    def MatMul(self, request, context):
+    def BatchCompute(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Compute(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Evaluate(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
@@ -103,10 +125,20 @@ def add_CalculatorServicer_to_server(servicer, server):
                     request_deserializer=calc__pb2.BinaryOp.FromString,
                     response_serializer=calc__pb2.Result.SerializeToString,
             ),
-            'MatMul': grpc.unary_unary_rpc_method_handler(
-                    servicer.MatMul,
-                    request_deserializer=calc__pb2.BinaryMat.FromString,
-                    response_serializer=calc__pb2.ResultMat.SerializeToString,
+            'BatchCompute': grpc.unary_unary_rpc_method_handler(
+                    servicer.BatchCompute,
+                    request_deserializer=calc__pb2.BatchRequest.FromString,
+                    response_serializer=calc__pb2.BatchResult.SerializeToString,
+            ),
+            'Compute': grpc.stream_stream_rpc_method_handler(
+                    servicer.Compute,
+                    request_deserializer=calc__pb2.Operations.FromString,
+                    response_serializer=calc__pb2.OpResults.SerializeToString,
+            ),
+            'Evaluate': grpc.unary_unary_rpc_method_handler(
+                    servicer.Evaluate,
+                    request_deserializer=calc__pb2.EvalRequest.FromString,
+                    response_serializer=calc__pb2.EvalResult.SerializeToString,
             ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
@@ -117,7 +149,7 @@ def add_CalculatorServicer_to_server(servicer, server):
 
  # This class is part of an EXPERIMENTAL API.
 class Calculator(object):
-    """Serviço com três RPCs unary
+    """Serviço: RPCs unary de um par de operandos, vetorizadas, um stream bidirecional e avaliação de expressões
     """
 
     @staticmethod
@@ -202,7 +234,61 @@ class Calculator(object):
             _registered_method=True)
 
     @staticmethod
-    def MatMul(request,
+    def BatchCompute(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/calc.Calculator/BatchCompute',
+            calc__pb2.BatchRequest.SerializeToString,
+            calc__pb2.BatchResult.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Compute(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/calc.Calculator/Compute',
+            calc__pb2.Operations.SerializeToString,
+            calc__pb2.OpResults.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Evaluate(request,
             target,
             options=(),
             channel_credentials=None,
@@ -215,9 +301,9 @@ class Calculator(object):
         return grpc.experimental.unary_unary(
             request,
             target,
-            '/calc.Calculator/MatMul',
-            calc__pb2.BinaryMat.SerializeToString,
-            calc__pb2.ResultMat.FromString,
+            '/calc.Calculator/Evaluate',
+            calc__pb2.EvalRequest.SerializeToString,
+            calc__pb2.EvalResult.FromString,
             options,
             channel_credentials,
             insecure,
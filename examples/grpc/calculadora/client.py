@@ -1,10 +1,294 @@
+import argparse
+import asyncio
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
 import grpc
+import numpy as np
 
 import calc_pb2 as pb
 import calc_pb2_grpc as pb_grpc
+from server import GRPC_OPTIONS
+
+# operações juntadas em uma mensagem do stream de Compute
+MAX_COALESCE = 4096
+
+# elementos por chamada de BatchCompute: 128K pares de double ~ 2 MB por mensagem
+BATCH_CHUNK = 128 * 1024
+
+
+def batch_requests(op, a, b, chunk=BATCH_CHUNK):
+    """Divide vetores de qualquer tamanho em BatchRequests de até `chunk` elementos."""
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    for start in range(0, len(a), chunk):
+        part_b = b if len(b) == 1 else b[start:start + chunk]
+        yield pb.BatchRequest(op=op, a=a[start:start + chunk], b=part_b)
+
+
+def merge_batch_results(results, chunk=BATCH_CHUNK):
+    """Junta os BatchResults (na ordem dos pedidos) em (valores como ndarray, índices com divisão por zero)."""
+    values, div_by_zero = [], []
+    for i, r in enumerate(results):
+        values.append(np.fromiter(r.values, dtype=np.float64, count=len(r.values)))
+        div_by_zero.extend(i * chunk + j for j in r.div_by_zero)
+    return (np.concatenate(values) if values else np.empty(0)), div_by_zero
+
+
+def batch_compute(stub, op, a, b, chunk=BATCH_CHUNK):
+    """Aplica `op` elemento a elemento em vetores de qualquer tamanho, em lotes de `chunk` elementos."""
+    return merge_batch_results([stub.BatchCompute(r) for r in batch_requests(op, a, b, chunk)], chunk)
+
+POSTFIX_OPS = {"+": pb.ADD, "-": pb.SUB, "*": pb.MUL, "/": pb.DIV}
+
+
+def postfix_program(text):
+    """'a b + c * d /' -> Program: números viram constantes, + - * / operações, o resto variáveis."""
+    code = []
+    for token in text.split():
+        if token in POSTFIX_OPS:
+            code.append(pb.Instr(op=POSTFIX_OPS[token]))
+        else:
+            try:
+                code.append(pb.Instr(number=float(token)))
+            except ValueError:
+                code.append(pb.Instr(var=token))
+    return pb.Program(code=code)
+
+
+def eval_request(program, **variables):
+    """EvalRequest com cada variável escalar ou vetor (um valor por binding)."""
+    return pb.EvalRequest(program=program, vars=[
+        pb.Variable(name=name, values=np.atleast_1d(np.asarray(values, dtype=np.float64)))
+        for name, values in variables.items()
+    ])
+
+
+def eval_values(r):
+    return np.fromiter(r.values, dtype=np.float64, count=len(r.values)), list(r.div_by_zero)
+
 
-def main():
-    with grpc.insecure_channel("localhost:50051") as channel:
+def evaluate(stub, program, **variables):
+    """Avalia o programa no servidor para todos os bindings de uma vez."""
+    return eval_values(stub.Evaluate(eval_request(program, **variables)))
+
+class ComputeStream:
+    """
+    Pipelining sobre o RPC Compute (stream bidirecional): submit() envia a operação e devolve
+    um Future sem esperar a resposta; no máximo `max_in_flight` operações ficam sem resposta
+    (submit bloqueia além disso; com o stream já encerrado, levanta o erro dele). As respostas
+    são associadas aos Futures pelo tag. O que estiver na fila quando o gRPC pede a próxima
+    mensagem vai junto, até MAX_COALESCE operações.
+    """
+
+    def __init__(self, stub, max_in_flight=1024):
+        self.outbox = queue.Queue()
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.tags = itertools.count()
+        self.error = None
+        self.responses = stub.Compute(self._requests())
+        self.reader = threading.Thread(target=self._read, name="compute-stream", daemon=True)
+        self.reader.start()
+
+    def _requests(self):
+        while True:
+            ops = [self.outbox.get()]
+            while ops[-1] is not None and len(ops) < MAX_COALESCE:
+                try:
+                    ops.append(self.outbox.get_nowait())
+                except queue.Empty:
+                    break
+            done = ops[-1] is None
+            if done:
+                ops.pop()
+            if ops:
+                yield pb.Operations(ops=ops)
+            if done:
+                return
+
+    def _read(self):
+        try:
+            for batch in self.responses:
+                for result in batch.results:
+                    with self.lock:
+                        future = self.pending.pop(result.tag, None)
+                    if future is None:
+                        continue  # tag desconhecido: nada esperando por ele
+                    self.slots.release()
+                    if result.error:
+                        future.set_exception(ArithmeticError(result.error))
+                    else:
+                        future.set_result(result.value)
+            error = RuntimeError("stream encerrado sem resposta")
+        except grpc.RpcError as e:
+            error = e
+        with self.lock:
+            # a partir daqui submit() falha na hora; quem está esperando vaga é liberado abaixo
+            self.error = error
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            self.slots.release()
+            future.set_exception(error)
+
+    def submit(self, op, a, b):
+        if self.error is not None:
+            raise self.error
+        self.slots.acquire()
+        future = Future()
+        tag = next(self.tags)
+        with self.lock:
+            if self.error is not None:
+                self.slots.release()
+                raise self.error
+            self.pending[tag] = future
+        self.outbox.put(pb.Operation(tag=tag, op=op, a=a, b=b))
+        return future
+
+    def close(self):
+        """Encerra o envio e espera as respostas pendentes."""
+        self.outbox.put(None)
+        self.reader.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AioComputeStream:
+    """ComputeStream para grpc.aio: submit() é corrotina e devolve um asyncio.Future."""
+
+    def __init__(self, stub, max_in_flight=1024):
+        self.call = stub.Compute()
+        self.outbox = asyncio.Queue()
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.pending = {}
+        self.tags = itertools.count()
+        self.error = None
+        self.writer = asyncio.create_task(self._write())
+        self.reader = asyncio.create_task(self._read())
+
+    async def _write(self):
+        while True:
+            ops = [await self.outbox.get()]
+            while ops[-1] is not None and len(ops) < MAX_COALESCE and not self.outbox.empty():
+                ops.append(self.outbox.get_nowait())
+            done = ops[-1] is None
+            if done:
+                ops.pop()
+            if ops:
+                await self.call.write(pb.Operations(ops=ops))
+            if done:
+                await self.call.done_writing()
+                return
+
+    async def _read(self):
+        try:
+            while True:
+                batch = await self.call.read()
+                if batch is grpc.aio.EOF:
+                    break
+                for result in batch.results:
+                    future = self.pending.pop(result.tag, None)
+                    if future is None:
+                        continue  # tag desconhecido: nada esperando por ele
+                    self.slots.release()
+                    if result.error:
+                        future.set_exception(ArithmeticError(result.error))
+                    else:
+                        future.set_result(result.value)
+            error = RuntimeError("stream encerrado sem resposta")
+        except grpc.RpcError as e:
+            error = e
+        # a partir daqui submit() falha na hora; quem está esperando vaga é liberado abaixo
+        self.error = error
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            self.slots.release()
+            future.set_exception(error)
+
+    async def submit(self, op, a, b):
+        if self.error is not None:
+            raise self.error
+        await self.slots.acquire()
+        future = asyncio.get_running_loop().create_future()
+        if self.error is not None:
+            self.slots.release()
+            raise self.error
+        tag = next(self.tags)
+        self.pending[tag] = future
+        self.outbox.put_nowait(pb.Operation(tag=tag, op=op, a=a, b=b))
+        return future
+
+    async def close(self):
+        self.outbox.put_nowait(None)
+        await self.writer
+        await self.reader
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Cliente gRPC da calculadora")
+    p.add_argument("--target", default="localhost:50051", help="Servidor (padrão: localhost:50051)")
+    p.add_argument("--aio", action="store_true", help="Usar grpc.aio (asyncio) em vez do cliente bloqueante")
+    return p.parse_args()
+
+
+async def main_aio(target):
+    async with grpc.aio.insecure_channel(target, options=GRPC_OPTIONS) as channel:
+        stub = pb_grpc.CalculatorStub(channel)
+
+        r1 = await stub.Add(pb.BinaryOp(a=10, b=5))
+        print("Add(10,5) =", r1.value)
+
+        try:
+            await stub.Div(pb.BinaryOp(a=10, b=0))
+        except grpc.RpcError as e:
+            print("Erro em Div(10,0):", e.code().name, e.details())
+
+        # chamadas unary concorrentes sem uma thread por chamada; o semáforo limita as em voo
+        # (milhares de streams HTTP/2 abertos de uma vez acabam cancelados)
+        limit = asyncio.Semaphore(256)
+
+        async def mul(a, b):
+            async with limit:
+                return await stub.Mul(pb.BinaryOp(a=a, b=b))
+
+        n = 2000
+        start = time.perf_counter()
+        results = await asyncio.gather(*(mul(i, 2) for i in range(n)))
+        assert [r.value for r in results] == [i * 2.0 for i in range(n)]
+        print(f"Mul unary concorrente (aio): {n / (time.perf_counter() - start):,.0f} op/s")
+
+        requests = list(batch_requests(pb.DIV, [10, 1, 7, 9], [4, 0, 2, 0]))
+        values, zeros = merge_batch_results(await asyncio.gather(*(stub.BatchCompute(r) for r in requests)))
+        print("BatchCompute(DIV, [10,1,7,9], [4,0,2,0]) =", values.tolist(), "divisão por zero em", zeros)
+
+        async with AioComputeStream(stub) as stream:
+            n = 50_000
+            start = time.perf_counter()
+            futures = [await stream.submit(pb.MUL, i, 2) for i in range(n)]
+            assert [await f for f in futures] == [i * 2.0 for i in range(n)]
+            print(f"Compute (stream aio, pipelining): {n / (time.perf_counter() - start):,.0f} op/s")
+
+        program = postfix_program("a b + c * d /")
+        values, zeros = eval_values(await stub.Evaluate(eval_request(program, a=[1, 2, 3], b=4, c=[2, 2, 2], d=[5, 0, 1])))
+        print("Evaluate((a+b)*c/d) =", values.tolist(), "divisão por zero em", zeros)
+
+
+def main(target="localhost:50051"):
+    with grpc.insecure_channel(target, options=GRPC_OPTIONS) as channel:
         stub = pb_grpc.CalculatorStub(channel)
 
         r1 = stub.Add(pb.BinaryOp(a=10, b=5))
@@ -22,5 +306,60 @@ def main():
         r4 = stub.Div(pb.BinaryOp(a=10, b=4))
         print("Div(10,4) =", r4.value)
 
+        values, zeros = batch_compute(stub, pb.DIV, [10, 1, 7, 9], [4, 0, 2, 0])
+        print("BatchCompute(DIV, [10,1,7,9], [4,0,2,0]) =", values.tolist(), "divisão por zero em", zeros)
+
+        # comparação: N chamadas unary contra um vetor de N operações
+        n = 2000
+        start = time.perf_counter()
+        for i in range(n):
+            stub.Mul(pb.BinaryOp(a=i, b=2))
+        unary = n / (time.perf_counter() - start)
+
+        a = np.random.rand(1_000_000)
+        b = np.random.rand(1_000_000)
+        start = time.perf_counter()
+        values, _ = batch_compute(stub, pb.MUL, a, b)
+        batched = len(values) / (time.perf_counter() - start)
+        assert np.allclose(values, a * b)
+        print(f"Mul unary: {unary:,.0f} op/s; BatchCompute: {batched:,.0f} op/s")
+
+        with ComputeStream(stub) as stream:
+            f1 = stream.submit(pb.ADD, 10, 5)
+            f2 = stream.submit(pb.DIV, 1, 0)
+            print("Compute ADD(10,5) =", f1.result())
+            try:
+                f2.result()
+            except ArithmeticError as e:
+                print("Erro em Compute DIV(1,0):", e)
+
+            n = 50_000
+            start = time.perf_counter()
+            results = [stream.submit(pb.MUL, i, 2) for i in range(n)]
+            assert [f.result() for f in results] == [i * 2.0 for i in range(n)]
+            print(f"Compute (stream, pipelining): {n / (time.perf_counter() - start):,.0f} op/s")
+
+        # (a+b)*c/d em uma chamada, em vez de três dependentes
+        program = postfix_program("a b + c * d /")
+        values, zeros = evaluate(stub, program, a=[1, 2, 3], b=4, c=[2, 2, 2], d=[5, 0, 1])
+        print("Evaluate((a+b)*c/d) =", values.tolist(), "divisão por zero em", zeros)
+
+        n = 100_000
+        a, b, c, d = (np.random.rand(n) + 0.5 for _ in range(4))
+        start = time.perf_counter()
+        values, _ = evaluate(stub, program, a=a, b=b, c=c, d=d)
+        elapsed = time.perf_counter() - start
+        assert np.allclose(values, (a + b) * c / d)
+        print(f"Evaluate: {n:,} bindings em {elapsed * 1000:.1f} ms")
+
+        try:
+            evaluate(stub, postfix_program("a +"), a=1)
+        except grpc.RpcError as e:
+            print("Erro em Evaluate('a +'):", e.code().name, e.details())
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.aio:
+        asyncio.run(main_aio(args.target))
+    else:
+        main(args.target)
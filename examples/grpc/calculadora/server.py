@@ -1,3 +1,8 @@
+import argparse
+import asyncio
+import functools
+import operator
+
 import grpc
 from concurrent import futures
 
@@ -5,6 +10,143 @@ import calc_pb2 as pb
 import calc_pb2_grpc as pb_grpc
 import numpy as np
 
+# lotes grandes: 1M de pares de double são ~16 MB, acima do limite padrão de 4 MB do gRPC
+MAX_MESSAGE = 64 * 1024 * 1024
+GRPC_OPTIONS = [
+    ("grpc.max_send_message_length", MAX_MESSAGE),
+    ("grpc.max_receive_message_length", MAX_MESSAGE),
+]
+
+BATCH_OPS = {
+    pb.ADD: np.add,
+    pb.SUB: np.subtract,
+    pb.MUL: np.multiply,
+}
+
+SCALAR_OPS = {
+    pb.ADD: operator.add,
+    pb.SUB: operator.sub,
+    pb.MUL: operator.mul,
+    pb.DIV: operator.truediv,
+}
+
+
+def as_array(values):
+    # campo repeated -> ndarray sem passar por uma lista intermediária
+    return np.fromiter(values, dtype=np.float64, count=len(values))
+
+
+def divide(a, b, shape):
+    """a / b elemento a elemento; onde b == 0 o resultado é NaN. Retorna (valores, máscara de b == 0)."""
+    zero = np.broadcast_to(np.equal(b, 0), shape)
+    return np.divide(a, b, out=np.full(shape, np.nan), where=~zero), zero
+
+
+@functools.lru_cache(maxsize=256)
+def compile_program(code):
+    """
+    Valida um programa pós-fixo (Program serializado, que também é a chave do cache) e o
+    converte em passos (tipo, argumento) para evaluate(). Retorna (passos, variáveis usadas).
+    """
+    steps, variables, depth = [], [], 0
+    for i, instr in enumerate(pb.Program.FromString(code).code):
+        kind = instr.WhichOneof("kind")
+        if kind == "op":
+            if instr.op not in SCALAR_OPS:
+                raise ValueError(f"instruction {i}: unknown op {instr.op}")
+            if depth < 2:
+                raise ValueError(f"instruction {i}: stack underflow")
+            depth -= 1
+            steps.append(("op", instr.op))
+        elif kind == "var":
+            if instr.var not in variables:
+                variables.append(instr.var)
+            depth += 1
+            steps.append(("var", instr.var))
+        elif kind == "number":
+            depth += 1
+            steps.append(("number", instr.number))
+        else:
+            raise ValueError(f"instruction {i}: empty")
+    if depth != 1:
+        raise ValueError(f"program leaves {depth} values on the stack, expected 1")
+    return tuple(steps), tuple(variables)
+
+
+def evaluate(steps, columns, size):
+    """Executa os passos sobre vetores de `size` bindings. Retorna (valores, máscara de divisão por zero)."""
+    stack = []
+    div_by_zero = np.zeros(size, dtype=bool)
+    for kind, arg in steps:
+        if kind == "var":
+            stack.append(columns[arg])
+        elif kind == "number":
+            stack.append(arg)
+        else:
+            b = stack.pop()
+            a = stack.pop()
+            if arg == pb.DIV:
+                result, zero = divide(a, b, (size,))
+                div_by_zero |= zero
+            else:
+                result = BATCH_OPS[arg](a, b)
+            stack.append(result)
+    values = np.broadcast_to(stack.pop(), (size,)).astype(np.float64)
+    values[div_by_zero] = np.nan
+    return values, div_by_zero
+
+
+def batch_compute(request):
+    """Implementação de BatchCompute, comum aos servicers síncrono e aio. Erros de validação: ValueError."""
+    a = as_array(request.a)
+    b = as_array(request.b)
+    if len(b) != len(a) and len(b) != 1:
+        raise ValueError(f"b must have 1 or {len(a)} values, got {len(b)}")
+    if request.op == pb.DIV:
+        # divide só onde b != 0; o resto fica NaN e os índices são reportados
+        values, zero = divide(a, b, a.shape)
+        div_by_zero = np.flatnonzero(zero).tolist()
+    elif request.op in BATCH_OPS:
+        values = BATCH_OPS[request.op](a, b)
+        div_by_zero = []
+    else:
+        raise ValueError(f"Unknown op: {request.op}")
+    return pb.BatchResult(values=values.tolist(), div_by_zero=div_by_zero)
+
+
+def compute_batch(batch):
+    """Resultados de uma mensagem do stream Compute; um erro em uma operação vira OpResult.error."""
+    results = []
+    for operation in batch.ops:
+        func = SCALAR_OPS.get(operation.op)
+        if func is None:
+            results.append(pb.OpResult(tag=operation.tag, error=f"Unknown op: {operation.op}"))
+        elif operation.op == pb.DIV and operation.b == 0:
+            results.append(pb.OpResult(tag=operation.tag, error="Division by zero"))
+        else:
+            results.append(pb.OpResult(tag=operation.tag, value=func(operation.a, operation.b)))
+    return pb.OpResults(results=results)
+
+
+def evaluate_request(request):
+    """Implementação de Evaluate, comum aos servicers síncrono e aio. Erros de validação: ValueError."""
+    # programas repetidos (mesmos bytes) são compilados uma vez só
+    try:
+        steps, variables = compile_program(request.program.SerializeToString(deterministic=True))
+    except ValueError as e:
+        raise ValueError(f"Invalid program: {e}") from e
+    columns = {var.name: as_array(var.values) for var in request.vars}
+    missing = [name for name in variables if name not in columns]
+    if missing:
+        raise ValueError(f"Missing variables: {', '.join(missing)}")
+    size = max((len(columns[name]) for name in variables), default=1)
+    for name in variables:
+        if len(columns[name]) not in (1, size):
+            raise ValueError(f"Variable {name} must have 1 or {size} values, got {len(columns[name])}")
+    values, div_by_zero = evaluate(steps, columns, size)
+    return pb.EvalResult(values=values.tolist(), div_by_zero=np.flatnonzero(div_by_zero).tolist())
+
+
 class CalculatorServicer(pb_grpc.CalculatorServicer):
     def Add(self, request, context):
         return pb.Result(value=request.a + request.b)
@@ -16,13 +158,86 @@ class CalculatorServicer(pb_grpc.CalculatorServicer):
         if request.b == 0:
             context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Division by zero")
         return pb.Result(value=request.a / request.b)
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+
+    def BatchCompute(self, request, context):
+        try:
+            return batch_compute(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    def Compute(self, request_iterator, context):
+        for batch in request_iterator:
+            yield compute_batch(batch)
+
+    def Evaluate(self, request, context):
+        try:
+            return evaluate_request(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+
+class AioCalculatorServicer(pb_grpc.CalculatorServicer):
+    """
+    Mesmo serviço em grpc.aio: streams longos não ocupam uma thread cada. O trabalho pesado
+    em NumPy (BatchCompute, Evaluate) roda em threads via asyncio.to_thread para não travar o loop.
+    """
+
+    async def Add(self, request, context):
+        return pb.Result(value=request.a + request.b)
+
+    async def Mul(self, request, context):
+        return pb.Result(value=request.a * request.b)
+
+    async def Div(self, request, context):
+        if request.b == 0:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Division by zero")
+        return pb.Result(value=request.a / request.b)
+
+    async def BatchCompute(self, request, context):
+        try:
+            return await asyncio.to_thread(batch_compute, request)
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    async def Compute(self, request_iterator, context):
+        async for batch in request_iterator:
+            yield compute_batch(batch)
+
+    async def Evaluate(self, request, context):
+        try:
+            return await asyncio.to_thread(evaluate_request, request)
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Servidor gRPC da calculadora")
+    p.add_argument("--port", type=int, default=50051, help="Porta (padrão: 50051)")
+    p.add_argument("--aio", action="store_true", help="Usar grpc.aio (asyncio) em vez do pool de threads")
+    return p.parse_args()
+
+
+def serve(port=50051):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), options=GRPC_OPTIONS)
     pb_grpc.add_CalculatorServicer_to_server(CalculatorServicer(), server)
-    server.add_insecure_port("[::]:50051")
-    print("Servidor gRPC ouvindo em 0.0.0.0:50051")
+    server.add_insecure_port(f"[::]:{port}")
+    print(f"Servidor gRPC ouvindo em 0.0.0.0:{port}")
     server.start()
     server.wait_for_termination()
 
+
+async def serve_aio(port=50051):
+    server = grpc.aio.server(options=GRPC_OPTIONS)
+    pb_grpc.add_CalculatorServicer_to_server(AioCalculatorServicer(), server)
+    server.add_insecure_port(f"[::]:{port}")
+    print(f"Servidor gRPC (aio) ouvindo em 0.0.0.0:{port}")
+    await server.start()
+    await server.wait_for_termination()
+
+
 if __name__ == "__main__":
-    serve()
+    args = parse_args()
+    if args.aio:
+        asyncio.run(serve_aio(args.port))
+    else:
+        serve(args.port)
@@ -1,50 +1,130 @@
+import argparse
+import asyncio
 import os
 import sys
+import time
 import grpc
 
 import file_pb2 as pb
 import file_pb2_grpc as pb_grpc
 
 
-def chunked_file_reader(path, send_name=None, chunk_size=1024):
-    """Gera UploadChunk em blocos para o stub.Upload."""
+# blocos adaptativos: começam em MIN_CHUNK e dobram enquanto cada um é consumido pelo gRPC em
+# menos de CHUNK_TARGET segundos (caem pela metade acima de 4x isso); em rede rápida poucos
+# blocos grandes, em rede lenta menores, com progresso e cancelamento mais responsivos.
+# MAX_CHUNK fica abaixo do limite de 4 MB por mensagem do gRPC.
+MIN_CHUNK = 64 * 1024
+MAX_CHUNK = 2 * 1024 * 1024
+CHUNK_TARGET = 0.05
+
+
+class ChunkSizer:
+    """Tamanho do próximo bloco a partir do tempo desde o pedido do bloco anterior."""
+
+    def __init__(self):
+        self.size = MIN_CHUNK
+        self.last = None
+
+    def next(self):
+        now = time.perf_counter()
+        if self.last is not None:
+            elapsed = now - self.last
+            if elapsed < CHUNK_TARGET:
+                self.size = min(self.size * 2, MAX_CHUNK)
+            elif elapsed > 4 * CHUNK_TARGET:
+                self.size = max(self.size // 2, MIN_CHUNK)
+        self.last = now
+        return self.size
+
+
+def upload_header(f, path, send_name):
+    name = send_name or os.path.basename(path)
+    return pb.UploadChunk(header=pb.UploadHeader(filename=name, size=os.fstat(f.fileno()).st_size))
+
+
+def chunked_file_reader(path, send_name=None, chunk_size=None):
+    """Gera o cabeçalho e depois os blocos para o stub.Upload; chunk_size None = blocos adaptativos."""
+    sizer = ChunkSizer()
     with open(path, "rb") as f:
+        yield upload_header(f, path, send_name)
         while True:
-            data = f.read(chunk_size)
+            data = f.read(chunk_size or sizer.next())
             if not data:
                 break
-            yield pb.UploadChunk(filename=send_name, data=data)
+            yield pb.UploadChunk(data=data)
 
 
-def main():
-    # Uso:
-    #   python client.py <arquivo_local> [nome_no_servidor]
-    #
+async def aio_chunked_file_reader(path, send_name=None, chunk_size=None):
+    """Versão assíncrona de chunked_file_reader: a leitura do disco não bloqueia o event loop."""
+    sizer = ChunkSizer()
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        yield upload_header(f, path, send_name)
+        while True:
+            data = await asyncio.to_thread(f.read, chunk_size or sizer.next())
+            if not data:
+                break
+            yield pb.UploadChunk(data=data)
+    finally:
+        f.close()
+
+
+def parse_args():
     # Ex:
     #   python client.py exemplo.txt exemplo_remoto.txt
-    if len(sys.argv) < 2:
-        print("Uso: python client.py <arquivo_local> [nome_no_servidor]")
-        sys.exit(1)
+    p = argparse.ArgumentParser(description="Cliente gRPC de upload de arquivos")
+    p.add_argument("local_path", help="Arquivo local a enviar")
+    p.add_argument("remote_name", nargs="?", default=None, help="Nome do arquivo no servidor")
+    p.add_argument("--target", default="localhost:50051", help="Servidor (padrão: localhost:50051)")
+    p.add_argument("--aio", action="store_true", help="Usar grpc.aio (asyncio) em vez do cliente bloqueante")
+    p.add_argument("--chunk-size", type=int, default=0, metavar="BYTES",
+                   help="Blocos de tamanho fixo; 0 = adaptativo, de 64 KB a 2 MB (padrão: 0)")
+    return p.parse_args()
 
-    local_path = sys.argv[1]
-    remote_name = sys.argv[2] if len(sys.argv) > 2 else None
 
-    if not os.path.isfile(local_path):
-        print(f"Arquivo local não encontrado: {local_path}")
-        sys.exit(1)
+def print_status(status, elapsed):
+    print("OK?" , status.ok)
+    print("Msg:", status.message)
+    print("Bytes recebidos:", status.bytes_received)
+    print("Salvo em:", status.saved_path)
+    print(f"Tempo: {elapsed:.2f}s ({status.bytes_received / max(elapsed, 1e-9) / 1e6:.1f} MB/s)")
+
+
+def upload(local_path, remote_name, target="localhost:50051", chunk_size=None):
+    with grpc.insecure_channel(target) as channel:
+        stub = pb_grpc.FileServiceStub(channel)
+        try:
+            start = time.perf_counter()
+            status = stub.Upload(chunked_file_reader(local_path, remote_name, chunk_size))
+            print_status(status, time.perf_counter() - start)
+        except grpc.RpcError as e:
+            print("Erro gRPC:", e.code().name, e.details())
 
-    with grpc.insecure_channel("localhost:50051") as channel:
+
+async def upload_aio(local_path, remote_name, target="localhost:50051", chunk_size=None):
+    async with grpc.aio.insecure_channel(target) as channel:
         stub = pb_grpc.FileServiceStub(channel)
         try:
-            status = stub.Upload(chunked_file_reader(local_path, remote_name))
-            print("OK?" , status.ok)
-            print("Msg:", status.message)
-            print("Bytes recebidos:", status.bytes_received)
-            print("Salvo em:", status.saved_path)
+            start = time.perf_counter()
+            status = await stub.Upload(aio_chunked_file_reader(local_path, remote_name, chunk_size))
+            print_status(status, time.perf_counter() - start)
         except grpc.RpcError as e:
             print("Erro gRPC:", e.code().name, e.details())
 
 
+def main():
+    args = parse_args()
+
+    if not os.path.isfile(args.local_path):
+        print(f"Arquivo local não encontrado: {args.local_path}")
+        sys.exit(1)
+
+    if args.aio:
+        asyncio.run(upload_aio(args.local_path, args.remote_name, args.target, args.chunk_size or None))
+    else:
+        upload(args.local_path, args.remote_name, args.target, args.chunk_size or None)
+
+
 if __name__ == "__main__":
     main()
 
@@ -1,4 +1,8 @@
+import argparse
+import asyncio
+import errno
 import os
+import uuid
 import grpc
 from concurrent import futures
 
@@ -6,70 +10,192 @@ import file_pb2 as pb
 import file_pb2_grpc as pb_grpc
 
 
+# escrita com buffer deste tamanho; no modo aio os blocos recebidos também são juntados até ele
+# antes de cada escrita em thread
+WRITE_BUFFER = 1024 * 1024
+# maior upload aceito (anunciado no cabeçalho ou, sem tamanho, recebido); a pré-alocação também
+# exige que o tamanho anunciado caiba no espaço livre, para um cabeçalho sozinho não encher o disco
+MAX_UPLOAD_SIZE = 16 * 1024 * 1024 * 1024
+
+
+class UploadFile:
+    """
+    Destino de um upload: nome saneado do cabeçalho, arquivo pré-alocado com o tamanho anunciado
+    (menos fragmentação, e falta de espaço aparece antes de receber os dados) e escrita com buffer.
+    Cabeçalho inválido ou total diferente do anunciado: ValueError. Os dados vão para um arquivo
+    temporário próprio em out_dir, renomeado para o nome final só em finish(): um upload que falha
+    não apaga a versão anterior, e uploads simultâneos do mesmo nome não se misturam (o último a
+    terminar fica). Se o upload não termina, discard() apaga só o temporário.
+    """
+
+    def __init__(self, chunk, out_dir):
+        if chunk is None or not chunk.HasField("header"):
+            raise ValueError("a primeira mensagem do upload deve ser o cabeçalho (header)")
+        # sanitiza nome simples (sem diretórios do cliente)
+        name = os.path.basename(chunk.header.filename.strip())
+        if name in ("", ".", ".."):
+            raise ValueError(f"nome de arquivo inválido: {chunk.header.filename!r}")
+        if not 0 <= chunk.header.size <= MAX_UPLOAD_SIZE:
+            raise ValueError(f"tamanho inválido no cabeçalho: {chunk.header.size} (máximo {MAX_UPLOAD_SIZE})")
+        self.path = os.path.join(out_dir, name)
+        self.expected = chunk.header.size
+        self.limit = self.expected or MAX_UPLOAD_SIZE
+        self.received = 0
+        if self.expected:
+            st = os.statvfs(out_dir)
+            if self.expected > st.f_bavail * st.f_frsize:
+                raise OSError(errno.ENOSPC, f"{self.expected} bytes anunciados, espaço livre insuficiente")
+        self.tmp_path = os.path.join(out_dir, f".{name}.{uuid.uuid4().hex}.part")
+        self.f = open(self.tmp_path, "xb", buffering=WRITE_BUFFER)
+        if self.expected and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self.f.fileno(), 0, self.expected)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    self.discard()
+                    raise
+                # sistema de arquivos sem suporte: segue sem pré-alocar
+
+    def write(self, data):
+        if self.received + len(data) > self.limit:
+            raise ValueError(f"upload passou de {self.limit} bytes")
+        self.f.write(data)
+        self.received += len(data)
+
+    def finish(self):
+        """Fecha e publica o arquivo no nome final; se chegou menos que o anunciado, apaga-o e levanta ValueError."""
+        if self.received != self.expected and self.expected:
+            self.discard()
+            raise ValueError(f"recebidos {self.received} bytes, o cabeçalho anunciou {self.expected}")
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        try:
+            self.f.close()
+        except OSError:
+            pass
+        try:
+            os.unlink(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+def upload_error(e):
+    """(código, mensagem) para abortar um upload que falhou com `e`."""
+    if isinstance(e, ValueError):
+        return grpc.StatusCode.INVALID_ARGUMENT, str(e)
+    if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+        return grpc.StatusCode.RESOURCE_EXHAUSTED, f"Sem espaço para o upload: {e}"
+    return grpc.StatusCode.INTERNAL, f"Falha no upload: {e}"
+
+
 class FileServiceServicer(pb_grpc.FileServiceServicer):
     def Upload(self, request_iterator, context):
         """
         Handler de client-streaming:
-        - request_iterator: itera sobre UploadChunk enviados pelo cliente
+        - request_iterator: UploadChunk com o cabeçalho (nome e tamanho) e depois só dados
         - retorna um único UploadStatus no final
         """
         out_dir = "uploads"
         os.makedirs(out_dir, exist_ok=True)
 
-        file_handle = None
-        saved_path = None
-        total = 0
-        filename_seen = None
-
+        target = None
         try:
+            target = UploadFile(next(request_iterator, None), out_dir)
             for chunk in request_iterator:
-                # na 1ª iteração, abrimos o arquivo
-                if file_handle is None:
-                    filename_seen = chunk.filename.strip()
-                    # sanitiza nome simples (sem diretórios do cliente)
-                    filename_seen = os.path.basename(filename_seen)
-                    saved_path = os.path.join(out_dir, filename_seen)
-                    file_handle = open(saved_path, "wb")
-
-                # valida nome consistente (opcional)
-                if chunk.filename and os.path.basename(chunk.filename) != filename_seen:
-                    # Abortamos se o cliente mudar o nome no meio do stream
-                    context.abort(grpc.StatusCode.INVALID_ARGUMENT,
-                                  "filename mudou durante o upload")
-
-                if chunk.data:
-                    file_handle.write(chunk.data)
-                    total += len(chunk.data)
-
-            # fim do stream
-            if file_handle:
-                file_handle.close()
-
-            return pb.UploadStatus(
-                ok=True,
-                message="Upload concluído",
-                bytes_received=total,
-                saved_path=saved_path,
-            )
+                if chunk.HasField("header"):
+                    raise ValueError("cabeçalho repetido durante o upload")
+                target.write(chunk.data)
+            target.finish()
+        except Exception as e:
+            if target:
+                target.discard()
+            context.abort(*upload_error(e))
+
+        return pb.UploadStatus(
+            ok=True,
+            message="Upload concluído",
+            bytes_received=target.received,
+            saved_path=target.path,
+        )
+
+
+class AioFileServiceServicer(pb_grpc.FileServiceServicer):
+    async def Upload(self, request_iterator, context):
+        """
+        Upload em grpc.aio: o stream não ocupa uma thread do servidor enquanto o cliente envia.
+        open/write/close bloqueiam, então rodam em threads (asyncio.to_thread), com os blocos
+        juntados em até WRITE_BUFFER bytes para não pagar uma troca de thread por bloco.
+        """
+        out_dir = "uploads"
+        await asyncio.to_thread(os.makedirs, out_dir, exist_ok=True)
 
+        target = None
+        pending = bytearray()
+        try:
+            async for chunk in request_iterator:
+                if target is None:
+                    target = await asyncio.to_thread(UploadFile, chunk, out_dir)
+                    continue
+                if chunk.HasField("header"):
+                    raise ValueError("cabeçalho repetido durante o upload")
+                pending += chunk.data
+                if len(pending) >= WRITE_BUFFER:
+                    await asyncio.to_thread(target.write, bytes(pending))
+                    pending.clear()
+            if target is None:
+                raise ValueError("a primeira mensagem do upload deve ser o cabeçalho (header)")
+            if pending:
+                await asyncio.to_thread(target.write, bytes(pending))
+            await asyncio.to_thread(target.finish)
+        except asyncio.CancelledError:
+            # cliente cancelou ou desconectou: não deixa o arquivo parcial para trás
+            if target:
+                target.discard()
+            raise
         except Exception as e:
-            if file_handle:
-                try:
-                    file_handle.close()
-                except:
-                    pass
-            # Em caso de erro interno
-            context.abort(grpc.StatusCode.INTERNAL, f"Falha no upload: {e}")
+            if target:
+                target.discard()
+            await context.abort(*upload_error(e))
+
+        return pb.UploadStatus(
+            ok=True,
+            message="Upload concluído",
+            bytes_received=target.received,
+            saved_path=target.path,
+        )
+
 
+def parse_args():
+    p = argparse.ArgumentParser(description="Servidor gRPC de upload de arquivos")
+    p.add_argument("--port", type=int, default=50051, help="Porta (padrão: 50051)")
+    p.add_argument("--aio", action="store_true",
+                   help="Usar grpc.aio (asyncio): uploads simultâneos não ficam limitados ao número de threads")
+    return p.parse_args()
 
-def serve():
+
+def serve(port=50051):
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=8))
     pb_grpc.add_FileServiceServicer_to_server(FileServiceServicer(), server)
-    server.add_insecure_port("[::]:50051")
-    print("Servidor gRPC (Upload) ouvindo em 0.0.0.0:50051")
+    server.add_insecure_port(f"[::]:{port}")
+    print(f"Servidor gRPC (Upload) ouvindo em 0.0.0.0:{port}")
     server.start()
     server.wait_for_termination()
 
 
+async def serve_aio(port=50051):
+    server = grpc.aio.server()
+    pb_grpc.add_FileServiceServicer_to_server(AioFileServiceServicer(), server)
+    server.add_insecure_port(f"[::]:{port}")
+    print(f"Servidor gRPC (Upload, aio) ouvindo em 0.0.0.0:{port}")
+    await server.start()
+    await server.wait_for_termination()
+
+
 if __name__ == "__main__":
-    serve()
+    args = parse_args()
+    if args.aio:
+        asyncio.run(serve_aio(args.port))
+    else:
+        serve(args.port)
@@ -4,22 +4,29 @@ examples/multicast_client.py
 
 Cliente multicast simples: envia mensagens JSON para um grupo multicast IPv4.
 Pode enviar mensagens interativamente ou apenas uma vez com --once/--message.
-Também pode aguardar respostas unicast (timeout configurável).
+Respostas unicast são recebidas em segundo plano, associadas à mensagem pelo msg_id e
+agregadas por mensagem (todas as respostas até --timeout); o envio nunca espera por elas.
+Com --probe vira gerador de tráfego de medição (ver multicast_server.py --stats).
 
 Exemplos:
   python examples/multicast_client.py --group 224.0.0.1 --port 5007 --name Cliente1
   python examples/multicast_client.py --once --message "Olá" --timeout 3
   python examples/multicast_client.py --iface 192.168.1.11 --name PC --timeout 5
+  python examples/multicast_client.py --probe --rate 20000 --size 64,512,1400 --burst 10 --duration 30
 """
 
 import argparse
 import json
+import select
 import socket
 import struct
+import threading
 import time
 import uuid
 import sys
 
+from probe import encode_probe, parse_sizes
+
 
 def get_default_interface():
     try:
@@ -39,12 +46,143 @@ def parse_args():
     p.add_argument('--iface', default=None, help='IP da interface local a usar (opcional)')
     p.add_argument('--name', default=None, help='Nome exibido nas mensagens (padrão: hostname)')
     p.add_argument('--ttl', type=int, default=1, help='TTL do multicast (padrão: 1)')
-    p.add_argument('--timeout', type=float, default=2.0, help='Tempo (s) para aguardar resposta unicast (padrão: 2s)')
+    p.add_argument('--timeout', type=float, default=2.0, help='Tempo (s) coletando respostas de cada mensagem (padrão: 2s)')
     p.add_argument('--once', action='store_true', help='Enviar apenas uma mensagem e sair')
     p.add_argument('--message', default=None, help='Mensagem a enviar com --once')
+    p.add_argument('--probe', action='store_true', help='Gerar tráfego de medição (numerado) em vez de ler mensagens')
+    p.add_argument('--rate', type=float, default=1000.0, help='(probe) Datagramas por segundo (padrão: 1000)')
+    p.add_argument('--size', default='1200',
+                   help='(probe) Tamanho do datagrama em bytes; lista separada por vírgulas alterna entre eles (padrão: 1200)')
+    p.add_argument('--burst', type=int, default=1,
+                   help='(probe) Datagramas enviados em sequência a cada rajada, mantendo a taxa média (padrão: 1)')
+    p.add_argument('--duration', type=float, default=10.0, help='(probe) Duração em segundos (padrão: 10)')
     return p.parse_args()
 
 
+def run_probe(sock, dest, rate, sizes, burst, duration):
+    """
+    Envia datagramas numerados a `rate` por segundo: rajadas de `burst` datagramas sem pausa,
+    espaçadas para manter a taxa média. Os horários são absolutos (a partir do início), então
+    atrasos de um envio não se acumulam.
+    """
+    session = uuid.uuid4().bytes[:8]
+    burst_interval = burst / rate
+    total = int(rate * duration)
+    seq = sent = sent_bytes = errors = 0
+    start = time.perf_counter()
+    next_report = start + 1.0
+    while seq < total:
+        due = start + (seq // burst) * burst_interval
+        delay = due - time.perf_counter()
+        if delay > 0.001:
+            time.sleep(delay - 0.0005)
+            continue
+        while time.perf_counter() < due:
+            pass  # espera ativa no último meio milissegundo: sleep não tem essa resolução
+        for _ in range(min(burst, total - seq)):
+            data = encode_probe(session, seq, time.time(), sizes[seq % len(sizes)])
+            seq += 1
+            try:
+                sock.sendto(data, dest)
+            except OSError:
+                errors += 1  # ENOBUFS/EAGAIN: fila de saída cheia na taxa pedida
+                continue
+            sent += 1
+            sent_bytes += len(data)
+        now = time.perf_counter()
+        if now >= next_report:
+            next_report += 1.0
+            print(f"[{now - start:5.1f}s] enviados {sent}, erros {errors}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Sessão {session.hex()}: {sent} datagramas ({sent_bytes} bytes) em {elapsed:.2f}s, "
+          f"{sent / elapsed:.0f} datagramas/s, {sent_bytes * 8 / elapsed / 1e6:.2f} Mbit/s, erros de envio: {errors}")
+
+
+class ReplyCollector:
+    """
+    Recebe respostas unicast em uma thread própria e as associa às mensagens enviadas pelo
+    msg_id (campo reply_to da resposta). Cada mensagem coleta respostas de todos os servidores
+    por `timeout` segundos; ao expirar, imprime o resumo (quantas respostas e RTTs).
+    """
+
+    def __init__(self, sock, timeout):
+        self.sock = sock
+        self.timeout = timeout
+        self.pending = {}  # msg_id -> {'seq', 'sent', 'replies': [(servidor, rtt)]}
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='replies', daemon=True)
+        self.thread.start()
+
+    def track(self, msg_id, seq, sent):
+        with self.lock:
+            self.pending[msg_id] = {'seq': seq, 'sent': sent, 'replies': []}
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                readable, _, _ = select.select([self.sock], [], [], 0.2)
+            except (OSError, ValueError):
+                return  # socket fechado
+            if readable:
+                try:
+                    data, addr = self.sock.recvfrom(65536)
+                except OSError:
+                    continue
+                self._on_reply(data, addr, time.time())
+            self._expire(time.time())
+
+    def _on_reply(self, data, addr, now):
+        try:
+            obj = json.loads(data.decode('utf-8'))
+            msg_id = obj.get('reply_to') if isinstance(obj, dict) else None
+        except Exception:
+            obj, msg_id = None, None
+        with self.lock:
+            entry = self.pending.get(msg_id)
+            if entry is not None:
+                rtt = now - entry['sent']
+                # vários servidores podem compartilhar ip:porta (SO_REUSEADDR): preferir o nome que eles enviam
+                entry['replies'].append((obj.get('server') or addr, rtt))
+                seq = entry['seq']
+        if entry is None:
+            # resposta sem msg_id conhecido (servidor antigo ou mensagem já expirada)
+            try:
+                print('Resposta de', addr, data.decode('utf-8'))
+            except Exception:
+                print('Resposta bruta de', addr, data)
+            return
+        print(f"Resposta #{seq} de {addr[0]}:{addr[1]} ({rtt * 1000:.1f} ms): {obj.get('text', obj)}")
+
+    def _expire(self, now):
+        with self.lock:
+            expired = [(k, e) for k, e in self.pending.items() if now - e['sent'] >= self.timeout]
+            for msg_id, _entry in expired:
+                del self.pending[msg_id]
+            if not self.pending:
+                self.idle.notify_all()
+        for _msg_id, entry in expired:
+            replies = entry['replies']
+            if not replies:
+                print(f"#{entry['seq']}: nenhuma resposta em {self.timeout:.1f}s")
+                continue
+            rtts = sorted(rtt for _server, rtt in replies)
+            responders = len({server for server, _rtt in replies})
+            print(f"#{entry['seq']}: {len(replies)} respostas de {responders} servidores, "
+                  f"RTT min/max {rtts[0] * 1000:.1f}/{rtts[-1] * 1000:.1f} ms")
+
+    def wait_idle(self):
+        """Espera todas as mensagens enviadas expirarem (no máximo timeout + folga)."""
+        with self.lock:
+            self.idle.wait_for(lambda: not self.pending, timeout=self.timeout + 1.0)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+
 def main():
     args = parse_args()
     group = args.group
@@ -84,11 +222,29 @@ def main():
         # ignora, não crítico
         pass
 
+    if args.probe:
+        print(f"Medição para {group}:{port} via iface {iface} (TTL={ttl}): {args.rate:.0f} datagramas/s, "
+              f"tamanhos {args.size}, rajadas de {args.burst}, {args.duration:.0f}s")
+        try:
+            run_probe(sock, dest, args.rate, parse_sizes(args.size), max(1, args.burst), args.duration)
+        except KeyboardInterrupt:
+            print('\nInterrompido')
+        finally:
+            sock.close()
+        return
+
     print(f"Enviando para {group}:{port} via iface {iface} (TTL={ttl}) — pressione Ctrl-C para sair")
 
+    collector = ReplyCollector(sock, timeout)
+    counter = [0]
+
     def send_text(text):
-        msg = {'id': local_id, 'name': name, 'text': text, 'ts': time.time()}
+        counter[0] += 1
+        msg_id = uuid.uuid4().hex
+        msg = {'id': local_id, 'msg_id': msg_id, 'name': name, 'text': text, 'ts': time.time()}
         b = json.dumps(msg).encode('utf-8')
+        # registrar antes de enviar: a resposta pode chegar antes de sendto retornar
+        collector.track(msg_id, counter[0], time.time())
         try:
             sock.sendto(b, dest)
         except Exception as e:
@@ -98,19 +254,10 @@ def main():
         if args.once:
             text = args.message if args.message is not None else input('Mensagem: ')
             send_text(text)
-            # aguardar resposta opcional
-            sock.settimeout(timeout)
-            try:
-                data, addr = sock.recvfrom(65536)
-                try:
-                    print('Resposta de', addr, data.decode('utf-8'))
-                except Exception:
-                    print('Resposta bruta de', addr, data)
-            except socket.timeout:
-                pass
+            collector.wait_idle()
             return
 
-        # modo interativo
+        # modo interativo: as respostas são impressas pelo coletor à medida que chegam
         while True:
             try:
                 text = input()
@@ -120,19 +267,10 @@ def main():
             if not text:
                 continue
             send_text(text)
-            # aguardar resposta curta
-            sock.settimeout(timeout)
-            try:
-                data, addr = sock.recvfrom(65536)
-                try:
-                    print('Resposta de', addr, data.decode('utf-8'))
-                except Exception:
-                    print('Resposta bruta de', addr, data)
-            except socket.timeout:
-                # sem resposta — continue
-                pass
+        collector.wait_idle()
 
     finally:
+        collector.close()
         try:
             sock.close()
         except Exception:
@@ -3,11 +3,15 @@
 examples/multicast_server.py
 
 Servidor UDP que ingressa em um grupo multicast IPv4 e exibe mensagens recebidas.
-Opcionalmente responde (unicast) ao remetente com um echo.
+Opcionalmente responde (unicast) ao remetente com um echo em JSON; reply_to leva o msg_id da
+mensagem original, para o cliente associar respostas de vários servidores.
+Com --stats mede o tráfego gerado por multicast_client.py --probe: vazão, perda, reordenação,
+duplicatas e jitter por remetente, a cada intervalo.
 
 Exemplos:
   python examples/multicast_server.py --group 224.0.0.1 --port 5007
   python examples/multicast_server.py --group 239.255.0.1 --port 5007 --iface 192.168.1.10 --reply
+  python examples/multicast_server.py --stats --interval 1 --rcvbuf 8388608
 
 Observações:
  - Em sistemas com múltiplas interfaces, informe --iface para garantir que o join use a interface correta.
@@ -15,11 +19,16 @@ Observações:
 """
 
 import argparse
+import json
+import os
+import select
 import socket
 import struct
 import time
 import sys
 
+from probe import decode_probe
+
 
 def get_default_interface():
     try:
@@ -39,9 +48,133 @@ def parse_args():
     p.add_argument('--iface', default=None, help='IP da interface local a usar (opcional)')
     p.add_argument('--reply', action='store_true', help='Enviar resposta unicast de eco ao remetente')
     p.add_argument('--bufsize', type=int, default=65536, help='Tamanho do buffer para recvfrom')
+    p.add_argument('--stats', action='store_true', help='Medir o tráfego de multicast_client.py --probe em vez de exibir')
+    p.add_argument('--interval', type=float, default=1.0, help='(stats) Intervalo entre relatórios em segundos (padrão: 1)')
+    p.add_argument('--rcvbuf', type=int, default=None, help='SO_RCVBUF em bytes (buffers maiores absorvem rajadas)')
     return p.parse_args()
 
 
+# sequências abaixo de (maior vista - DUP_WINDOW) não são mais lembradas: chegam como "atrasadas"
+DUP_WINDOW = 65536
+
+
+class SenderStats:
+    """Contadores de um remetente (ip, sessão) no modo --stats; totais e do intervalo corrente."""
+
+    def __init__(self):
+        self.first_seq = None
+        self.max_seq = -1
+        self.seen = set()
+        self.unique = 0
+        self.totals = {'rx': 0, 'bytes': 0, 'reordered': 0, 'duplicates': 0, 'late': 0}
+        self.interval = dict.fromkeys(self.totals, 0)
+        self.lost_reported = 0
+        self.max_seq_reported = -1
+        self.jitter = 0.0
+        self.last_transit = None
+
+    def lost(self):
+        if self.first_seq is None:
+            return 0
+        return (self.max_seq - self.first_seq + 1) - self.unique
+
+    def add(self, seq, sent_ts, size, now):
+        counters = ('rx', 'bytes')
+        if seq in self.seen:
+            counters += ('duplicates',)
+        elif seq < self.max_seq - DUP_WINDOW:
+            counters += ('late',)
+        else:
+            if seq < self.max_seq:
+                counters += ('reordered',)
+            self.seen.add(seq)
+            self.unique += 1
+            self.first_seq = seq if self.first_seq is None else min(self.first_seq, seq)
+            self.max_seq = max(self.max_seq, seq)
+            if len(self.seen) > 2 * DUP_WINDOW:
+                self.seen = {s for s in self.seen if s >= self.max_seq - DUP_WINDOW}
+        for key in counters:
+            inc = size if key == 'bytes' else 1
+            self.totals[key] += inc
+            self.interval[key] += inc
+        # jitter entre chegadas (RFC 3550): só diferenças de tempo de trânsito, então a
+        # diferença entre os relógios do remetente e do receptor se cancela
+        transit = now - sent_ts
+        if self.last_transit is not None:
+            self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16.0
+        self.last_transit = transit
+
+    def report(self, elapsed):
+        """Linha do intervalo que terminou; zera os contadores do intervalo."""
+        c = self.interval
+        # perdas de intervalos anteriores recuperadas agora (chegaram fora de ordem) reduzem lost();
+        # elas já aparecem em "fora de ordem", então a perda do intervalo não fica negativa
+        lost = max(0, self.lost() - self.lost_reported)
+        expected = self.max_seq - max(self.max_seq_reported, self.first_seq - 1)
+        loss_pct = 100.0 * lost / expected if expected > 0 else 0.0
+        line = (f"{c['bytes'] * 8 / elapsed / 1e6:8.2f} Mbit/s {c['rx'] / elapsed:9.0f} dgr/s  "
+                f"perdidos {lost:6d} ({loss_pct:5.2f}%)  fora de ordem {c['reordered']:5d}  "
+                f"duplicados {c['duplicates']:4d}  atrasados {c['late']:4d}  jitter {self.jitter * 1000:7.3f} ms")
+        self.lost_reported = self.lost()
+        self.max_seq_reported = self.max_seq
+        self.interval = dict.fromkeys(self.totals, 0)
+        return line
+
+    def summary(self):
+        t = self.totals
+        expected = self.max_seq - self.first_seq + 1 if self.first_seq is not None else 0
+        loss_pct = 100.0 * self.lost() / expected if expected else 0.0
+        return (f"recebidos {t['rx']} ({t['bytes']} bytes), perdidos {self.lost()} de {expected} ({loss_pct:.2f}%), "
+                f"fora de ordem {t['reordered']}, duplicados {t['duplicates']}, atrasados {t['late']}, "
+                f"jitter {self.jitter * 1000:.3f} ms")
+
+
+def serve_stats(sock, bufsize, interval):
+    senders = {}
+    others = 0
+    start = last_report = time.monotonic()
+    next_report = start + interval
+    try:
+        while True:
+            timeout = max(0.0, next_report - time.monotonic())
+            readable, _, _ = select.select([sock], [], [], timeout)
+            if readable:
+                # drenar o que estiver na fila antes de voltar ao select
+                while True:
+                    try:
+                        data, addr = sock.recvfrom(bufsize, socket.MSG_DONTWAIT)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    now = time.time()
+                    probe = decode_probe(data)
+                    if probe is None:
+                        others += 1
+                        continue
+                    session, seq, sent_ts = probe
+                    key = (addr[0], session.hex())
+                    stats = senders.get(key)
+                    if stats is None:
+                        stats = senders[key] = SenderStats()
+                        print(f'Novo remetente {key[0]} (sessão {key[1]})')
+                    stats.add(seq, sent_ts, len(data), now)
+
+            now = time.monotonic()
+            if now < next_report:
+                continue
+            elapsed = now - last_report
+            last_report = now
+            next_report = now + interval
+            for (ip, session), stats in senders.items():
+                if stats.interval['rx'] or stats.lost() != stats.lost_reported:
+                    print(f'[{now - start:6.1f}s] {ip} {session[:8]} {stats.report(elapsed)}')
+    except KeyboardInterrupt:
+        print('\nInterrompido pelo usuário. Totais:')
+        for (ip, session), stats in senders.items():
+            print(f'  {ip} {session}: {stats.summary()}')
+        if others:
+            print(f'  datagramas que não são de medição: {others}')
+
+
 def main():
     args = parse_args()
     group = args.group
@@ -58,6 +191,9 @@ def main():
     except Exception:
         pass
 
+    if args.rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, args.rcvbuf)
+
     # Em muitos sistemas bind em '' (INADDR_ANY) permite receber datagramas multicast na porta
     try:
         sock.bind(('', port))
@@ -89,6 +225,9 @@ def main():
     print('Servidor multicast pronto. Aguardando mensagens...')
 
     try:
+        if args.stats:
+            serve_stats(sock, args.bufsize, args.interval)
+            return
         while True:
             try:
                 data, addr = sock.recvfrom(args.bufsize)
@@ -104,7 +243,12 @@ def main():
             print(f'[{ts}] {addr[0]}:{addr[1]} -> {text}')
 
             if reply:
-                resp = f'Echo from multicast-server: {text}'
+                try:
+                    msg_id = json.loads(text).get('msg_id')
+                except Exception:
+                    msg_id = None
+                resp = json.dumps({'reply_to': msg_id, 'server': f'{socket.gethostname()}/{os.getpid()}',
+                                   'text': f'Echo from multicast-server: {text}'})
                 try:
                     # responder diretamente ao remetente (unicast)
                     sock.sendto(resp.encode('utf-8'), addr)
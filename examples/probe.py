@@ -0,0 +1,33 @@
+"""
+examples/probe.py
+
+Formato dos datagramas de medição trocados por multicast_client.py --probe e
+multicast_server.py --stats: [magic (4)] [sessão (8)] [sequência (8)] [timestamp de envio (8)],
+completado com zeros até o tamanho pedido. Binário para que o custo de montar e ler o
+datagrama não limite a taxa medida.
+"""
+
+import struct
+
+PROBE_MAGIC = b'MPRB'
+PROBE_HEADER = struct.Struct('!4s8sQd')
+
+
+def parse_sizes(spec):
+    """'1200' -> [1200]; '64,512,1400' -> alterna entre os tamanhos. Nunca menor que o cabeçalho."""
+    sizes = [int(s) for s in spec.split(',') if s.strip()]
+    if not sizes:
+        raise ValueError('nenhum tamanho informado')
+    return [max(PROBE_HEADER.size, s) for s in sizes]
+
+
+def encode_probe(session, seq, ts, size):
+    return PROBE_HEADER.pack(PROBE_MAGIC, session, seq, ts).ljust(size, b'\0')
+
+
+def decode_probe(data):
+    """Retorna (sessão, sequência, timestamp) ou None se o datagrama não é de medição."""
+    if len(data) < PROBE_HEADER.size or not data.startswith(PROBE_MAGIC):
+        return None
+    _magic, session, seq, ts = PROBE_HEADER.unpack_from(data)
+    return session, seq, ts
@@ -1,28 +1,338 @@
+#!/usr/bin/env python3
+"""
+examples/simple_client_socket.py
+
+Cliente TCP. Por padrão fala com o simple_server_socket.py (porta 65432): envia uma mensagem
+crua e imprime a resposta. Com --framed, usa o protocolo com quadros (framing.py) do
+chat_msg_aleatoria.py (porta 9003): um pool de conexões persistentes com keepalive e verificação
+de saúde, e pipelining de pedidos (várias requisições em voo por conexão; as respostas chegam na
+ordem de envio), com modo carga (--load).
+
+O pool também pode ser usado como biblioteca:
+
+  with ConnectionPool('localhost', 9003, size=4) as pool:
+      resposta = pool.call(b'usuario|oi')
+      futuros = [pool.request(b'usuario|oi') for _ in range(100)]
+
+Exemplos:
+  python examples/simple_server_socket.py &
+  python examples/simple_client_socket.py
+
+  python examples/chat_msg_aleatoria.py --host 127.0.0.1 --quiet &
+  python examples/simple_client_socket.py --host 127.0.0.1 --port 9003 --framed
+  python examples/simple_client_socket.py --host 127.0.0.1 --port 9003 --framed --load --rate 5000 --duration 10 --conns 8
+"""
+
+import argparse
+import collections
 import socket
+import threading
+import time
+from concurrent.futures import Future
+
+from bench_client_socket import percentile
+from framing import FrameError, encode_frame, recv_frame
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Cliente TCP (mensagem crua, ou com --framed: pool de conexões e pipelining)')
+    p.add_argument('--host', default='localhost', help='Servidor (padrão: localhost)')
+    p.add_argument('--port', type=int, default=65432,
+                   help='Porta TCP (padrão: 65432, do simple_server_socket.py; o chat_msg_aleatoria.py usa 9003)')
+    p.add_argument('--framed', action='store_true',
+                   help='Protocolo com quadros do chat_msg_aleatoria.py: pool de conexões, pipelining e modo carga')
+    p.add_argument('--message', default=None,
+                   help='Mensagem enviada em cada pedido (padrão: "Olá, servidor!"; com --framed, "usuario|Olá, servidor!")')
+    p.add_argument('--conns', type=int, default=1, help='(--framed) Conexões no pool (padrão: 1)')
+    p.add_argument('--max-in-flight', type=int, default=64,
+                   help='(--framed) Pedidos sem resposta por conexão antes de bloquear o envio (padrão: 64)')
+    p.add_argument('--timeout', type=float, default=5.0, help='Timeout de conexão e de cada pedido, em segundos (padrão: 5)')
+    p.add_argument('--health-interval', type=float, default=5.0,
+                   help='(--framed) Intervalo da verificação de saúde do pool, em segundos; 0 desliga (padrão: 5)')
+    p.add_argument('--health-payload', default=None,
+                   help='(--framed) Pedido enviado às conexões ociosas na verificação de saúde (padrão: nenhum, só repõe as que caíram)')
+    p.add_argument('--no-keepalive', action='store_true', help='(--framed) Não ativar TCP keepalive nas conexões')
+    p.add_argument('--load', action='store_true', help='(--framed) Modo carga: enviar a uma taxa fixa e medir latência')
+    p.add_argument('--rate', type=float, default=1000.0, help='(carga) Pedidos por segundo (padrão: 1000)')
+    p.add_argument('--duration', type=float, default=10.0, help='(carga) Duração em segundos (padrão: 10)')
+    args = p.parse_args()
+    if args.load and not args.framed:
+        p.error('--load requer --framed (para o simple_server_socket.py, use bench_client_socket.py)')
+    if args.message is None:
+        args.message = 'usuario|Olá, servidor!' if args.framed else 'Olá, servidor!'
+    return args
+
+
+def set_keepalive(sock, idle=30, interval=10, count=3):
+    """Ativa TCP keepalive: o kernel detecta pares mortos em conexões ociosas do pool."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # opções específicas do Linux; em outros sistemas fica o padrão do kernel
+    for name, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count)):
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
+class PooledConnection:
+    """Conexão persistente com pipelining: envia sem esperar e casa as respostas com os pedidos em ordem (FIFO)."""
+
+    def __init__(self, address, max_in_flight, connect_timeout=5.0, keepalive=True):
+        self.address = address
+        self.sock = socket.create_connection(address, timeout=connect_timeout)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if keepalive:
+            set_keepalive(self.sock)
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.pending = collections.deque()
+        self.lock = threading.Lock()  # protege pending/healthy; nunca é mantido durante E/S
+        self.send_lock = threading.Lock()  # serializa os envios: a ordem dos quadros é a ordem de pending
+        self.healthy = True
+        self.last_used = time.monotonic()
+        self.reader = threading.Thread(target=self._read_loop, name=f'conn-{address[0]}:{address[1]}', daemon=True)
+        self.reader.start()
+
+    def in_flight(self):
+        return len(self.pending)
+
+    def request(self, payload):
+        """Envia um pedido e devolve um Future com a resposta. Bloqueia se max_in_flight já está em voo."""
+        self.slots.acquire()
+        future = Future()
+        frame = encode_frame(payload)
+        with self.send_lock:
+            with self.lock:
+                if not self.healthy:
+                    self.slots.release()
+                    future.set_exception(ConnectionError('conexão encerrada'))
+                    return future
+                # o pedido entra na fila antes do envio: a resposta pode chegar antes de sendall retornar
+                self.pending.append(future)
+                self.last_used = time.monotonic()
+            # sendall fora de self.lock: se o buffer de envio encher, o leitor continua
+            # consumindo respostas (e liberando o servidor) em vez de esperar por este lock
+            try:
+                self.sock.sendall(frame)
+            except OSError as e:
+                with self.lock:
+                    if future in self.pending:  # senão _fail já falhou o pedido
+                        self.pending.remove(future)
+                        self.slots.release()
+                        future.set_exception(e)
+                    self._fail(e)
+        return future
+
+    def _read_loop(self):
+        try:
+            while True:
+                payload = recv_frame(self.sock)
+                if payload is None:
+                    raise ConnectionError('servidor encerrou a conexão')
+                with self.lock:
+                    future = self.pending.popleft() if self.pending else None
+                if future is None:
+                    raise FrameError('resposta sem pedido correspondente')
+                self.slots.release()
+                future.set_result(payload)
+        except (OSError, FrameError) as e:
+            with self.lock:
+                self._fail(e)
+
+    def _fail(self, error):
+        # chamado com self.lock: falha todos os pedidos em voo, o pool substitui a conexão
+        if not self.healthy:
+            return
+        self.healthy = False
+        while self.pending:
+            self.slots.release()
+            self.pending.popleft().set_exception(ConnectionError(f'conexão perdida: {error}'))
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        with self.lock:
+            self._fail('conexão fechada pelo cliente')
+        self.sock.close()
+
+
+class ConnectionPool:
+    """Pool de conexões persistentes: distribui os pedidos pela conexão menos ocupada e repõe as que caírem."""
+
+    def __init__(self, host, port, size=1, max_in_flight=64, timeout=5.0, keepalive=True,
+                 health_interval=5.0, health_payload=None):
+        self.address = (host, port)
+        self.size = size
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.health_payload = health_payload
+        self.conns = []
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.metrics = {'connects': 0, 'connect_errors': 0, 'replaced': 0, 'health_failures': 0}
+        for _ in range(size):
+            self.conns.append(self._connect())
+        self.health_thread = None
+        if health_interval > 0:
+            self.health_thread = threading.Thread(target=self._health_loop, args=(health_interval,),
+                                                  name='pool-health', daemon=True)
+            self.health_thread.start()
+
+    def _connect(self):
+        try:
+            conn = PooledConnection(self.address, self.max_in_flight, self.timeout, self.keepalive)
+        except OSError:
+            self.metrics['connect_errors'] += 1
+            raise
+        self.metrics['connects'] += 1
+        return conn
+
+    def _acquire(self):
+        with self.lock:
+            if self.closed.is_set():
+                raise ConnectionError('pool fechado')
+            for i, conn in enumerate(self.conns):
+                if not conn.healthy:
+                    conn.close()
+                    self.conns[i] = self._connect()
+                    self.metrics['replaced'] += 1
+            return min(self.conns, key=PooledConnection.in_flight)
+
+    def request(self, payload):
+        """Envia pelo pool e devolve um Future; as respostas de uma mesma conexão chegam em ordem."""
+        return self._acquire().request(payload)
+
+    def call(self, payload, timeout=None):
+        """Pedido síncrono: envia e espera a resposta."""
+        return self.request(payload).result(timeout if timeout is not None else self.timeout)
+
+    def _health_loop(self, interval):
+        # repõe conexões que caíram e, se houver health_payload, testa as ociosas com um pedido real
+        while not self.closed.wait(interval):
+            now = time.monotonic()
+            with self.lock:
+                conns = list(self.conns)
+            for conn in conns:
+                if not conn.healthy or self.health_payload is None or now - conn.last_used < interval:
+                    continue
+                try:
+                    conn.request(self.health_payload).result(self.timeout)
+                except Exception as e:
+                    self.metrics['health_failures'] += 1
+                    with conn.lock:
+                        conn._fail(e)
+            try:
+                self._acquire()
+            except OSError:
+                pass  # servidor fora do ar: tenta de novo no próximo intervalo
+
+    def close(self):
+        self.closed.set()
+        with self.lock:
+            for conn in self.conns:
+                conn.close()
+            self.conns = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_load(pool, payload, rate, duration, timeout):
+    """
+    Envia pedidos em laço aberto a `rate` por segundo durante `duration` segundos. A latência é
+    medida a partir do instante agendado do pedido, então atrasos do próprio cliente (pool cheio)
+    também aparecem nos percentis.
+    """
+    latencies = []
+    errors = collections.Counter()
+    results_lock = threading.Lock()  # os callbacks rodam na thread leitora de cada conexão
+    futures = []
+    interval = 1.0 / rate
+    total = int(rate * duration)
+    start = time.perf_counter()
+    for i in range(total):
+        scheduled = start + i * interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        def done(future, scheduled=scheduled):
+            now = time.perf_counter()
+            with results_lock:
+                if future.exception() is None:
+                    latencies.append(now - scheduled)
+                else:
+                    errors[type(future.exception()).__name__] += 1
+
+        try:
+            future = pool.request(payload)
+        except OSError as e:
+            with results_lock:
+                errors[type(e).__name__] += 1
+            continue
+        future.add_done_callback(done)
+        futures.append(future)
+    send_elapsed = time.perf_counter() - start
+
+    for future in futures:
+        try:
+            future.result(timeout)
+        except Exception:
+            pass  # já contado em errors pelo callback
+    elapsed = time.perf_counter() - start
+
+    # cópia sob o lock: pedidos que estouraram o timeout ainda podem completar depois daqui
+    with results_lock:
+        latencies = sorted(latencies)
+        errors = collections.Counter(errors)
+    print(f"Pedidos: {total} (taxa alvo {rate:.0f}/s, enviados em {send_elapsed:.2f}s), "
+          f"respostas: {len(latencies)} em {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s)")
+    if errors:
+        print("Erros: " + ', '.join(f"{name}={count}" for name, count in errors.most_common()))
+    if latencies:
+        print("Latência (ms): " + ', '.join(
+            f"p{pct}={percentile(latencies, pct) * 1000:.2f}" for pct in (50, 90, 99, 99.9)
+        ) + f", max={latencies[-1] * 1000:.2f}")
+    print(f"Pool: {pool.metrics}")
+
 
-conn_info = ('localhost', 65432)
+def send_raw(host, port, payload, timeout):
+    """Uma mensagem crua em uma conexão nova, como espera o simple_server_socket.py; devolve a resposta."""
+    with socket.create_connection((host, port), timeout=timeout) as client_socket:
+        client_socket.sendall(payload)
+        return client_socket.recv(1024)
 
-# Cria um socket TCP
-client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
-try:
-    # Conecta ao servidor
-    client_socket.connect(conn_info)
+def main():
+    args = parse_args()
 
-    # Envia uma mensagem
-    message = "Olá, servidor!"
-    client_socket.send(message.encode('utf-8'))
+    try:
+        payload = args.message.encode('utf-8')
+        if not args.framed:
+            response = send_raw(args.host, args.port, payload, args.timeout)
+            print(f"Resposta do servidor: {response.decode('utf-8')}")
+            return
+        health_payload = args.health_payload.encode('utf-8') if args.health_payload is not None else None
+        with ConnectionPool(args.host, args.port, size=args.conns, max_in_flight=args.max_in_flight,
+                            timeout=args.timeout, keepalive=not args.no_keepalive,
+                            health_interval=args.health_interval,
+                            health_payload=health_payload) as pool:
+            if args.load:
+                run_load(pool, payload, args.rate, args.duration, args.timeout)
+            else:
+                response = pool.call(payload)
+                print(f"Resposta do servidor: {response.decode('utf-8')}")
 
-    # Recebe a resposta do servidor
-    response = client_socket.recv(1024)
-    print(f"Resposta do servidor: {response.decode('utf-8')}")
+    except ConnectionRefusedError as e:
+        print(f"Erro de conexão: {e}")
 
-except ConnectionRefusedError as e:
-    print(f"Erro de conexão: {e}")
+    except UnicodeEncodeError as e:
+        print(f"Erro de codificação: {e}")
 
-except UnicodeEncodeError as e:
-    print(f"Erro de codificação: {e}")
 
-finally:
-    # Fecha o socket
-    client_socket.close()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,213 @@
+import argparse
+import codecs
+import errno
+import selectors
 import socket
+import time
 
-conn_info = ('0.0.0.0', 65432)
+RESPONSE = "Mensagem recebida".encode('utf-8')
 
-# Cria um socket TCP/IP
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# (eventos) Limites do buffer de saída por conexão: acima de OUTBUF_HIGH paramos de ler
+# (o cliente que não lê as respostas fica bloqueado no próprio envio); voltamos a ler
+# quando o buffer cai abaixo de OUTBUF_LOW.
+OUTBUF_HIGH = 1024 * 1024
+OUTBUF_LOW = 256 * 1024
 
-# Liga o socket a um endereço e porta
-server_socket.bind(conn_info)
+# (eventos) accept() sem descritores livres (EMFILE/ENFILE) ou memória: o listener sai do selector
+# até uma conexão fechar ou por ACCEPT_BACKOFF segundos, em vez de derrubar o loop.
+# Conexões abortadas ainda na fila (ECONNABORTED) só são puladas.
+ACCEPT_BACKOFF = 1.0
+ACCEPT_TRANSIENT_ERRORS = (errno.ECONNABORTED, errno.EPROTO, errno.ECONNRESET)
 
-# Define o número máximo de conexões em fila
-server_socket.listen(5)
 
-print("Servidor pronto e aguardando conexões...")
+def parse_args():
+    p = argparse.ArgumentParser(description='Servidor TCP simples')
+    p.add_argument('--host', default='0.0.0.0', help='Endereço de bind (padrão: 0.0.0.0)')
+    p.add_argument('--port', type=int, default=65432, help='Porta TCP (padrão: 65432)')
+    p.add_argument('--modo', choices=('simples', 'eventos'), default='simples',
+                   help='simples: uma conexão por vez (bloqueante); eventos: selectors/epoll, milhares de conexões em uma thread')
+    p.add_argument('--backlog', type=int, default=5, help='Tamanho da fila de conexões pendentes (padrão: 5)')
+    p.add_argument('--idle-timeout', type=float, default=30.0, help='(eventos) Fecha conexões ociosas após N segundos (padrão: 30)')
+    p.add_argument('--verbose', action='store_true', help='(eventos) Imprimir cada conexão e mensagem')
+    return p.parse_args()
 
-while True:
-    # Aceita uma nova conexão
-    client_socket, client_address = server_socket.accept()
-    print(f"Conexão estabelecida com {client_address}")
 
-    try:
-        # Recebe dados do cliente
-        data = client_socket.recv(1024)
+def serve_simple(server_socket):
+    while True:
+        # Aceita uma nova conexão
+        client_socket, client_address = server_socket.accept()
+        print(f"Conexão estabelecida com {client_address}")
+
+        try:
+            # Recebe dados do cliente
+            data = client_socket.recv(1024)
+
+            # Decodifica a mensagem recebida
+            decoded_data = data.decode('utf-8')
+            print(f"Recebido: {decoded_data}")
+
+            # Envia uma resposta ao cliente
+            client_socket.send(RESPONSE)
+
+        except UnicodeDecodeError as e:
+            print(f"Erro de decodificação: {e}")
+            client_socket.send("Erro de decodificação".encode('utf-8'))
+
+        finally:
+            # Fecha a conexão
+            client_socket.close()
+
+
+class Connection:
+    """Estado de uma conexão no modo eventos: decodificador de entrada, buffer de escrita e última atividade."""
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.decoder = codecs.getincrementaldecoder('utf-8')()  # guarda caracteres multibyte cortados entre leituras
+        self.outbuf = bytearray()
+        self.throttled = False  # leitura suspensa até o buffer de saída esvaziar
+        self.last_activity = time.monotonic()
+
+
+def serve_events(server_socket, idle_timeout, verbose=False):
+    # Cada leitura recebida gera uma resposta; a conexão continua aberta até o cliente fechar
+    # ou ficar ociosa por idle_timeout segundos.
+    sel = selectors.DefaultSelector()
+    server_socket.setblocking(False)
+    sel.register(server_socket, selectors.EVENT_READ, None)
+    conns = {}
+    accept_paused_until = None  # listener fora do selector até este instante (ou até uma conexão fechar)
+
+    def pause_accept(error):
+        nonlocal accept_paused_until
+        if accept_paused_until is None:
+            sel.unregister(server_socket)
+            print(f"accept falhou ({error}); pausando novas conexões ({len(conns)} abertas)")
+        accept_paused_until = time.monotonic() + ACCEPT_BACKOFF
+
+    def resume_accept():
+        nonlocal accept_paused_until
+        if accept_paused_until is not None:
+            accept_paused_until = None
+            sel.register(server_socket, selectors.EVENT_READ, None)
 
-        # Decodifica a mensagem recebida
-        decoded_data = data.decode('utf-8')
-        print(f"Recebido: {decoded_data}")
+    def close(conn):
+        sel.unregister(conn.sock)
+        conn.sock.close()
+        del conns[conn.sock]
+        resume_accept()  # um descritor foi liberado
 
-        # Envia uma resposta ao cliente
-        response = "Mensagem recebida"
-        client_socket.send(response.encode('utf-8'))
+    def accept():
+        # aceitar tudo o que estiver pendente (rajadas de conexões)
+        while True:
+            try:
+                client_socket, client_address = server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if e.errno in ACCEPT_TRANSIENT_ERRORS:
+                    continue
+                pause_accept(e)
+                return
+            client_socket.setblocking(False)
+            conn = Connection(client_socket, client_address)
+            conns[client_socket] = conn
+            sel.register(client_socket, selectors.EVENT_READ, conn)
+            if verbose:
+                print(f"Conexão estabelecida com {client_address}")
 
-    except UnicodeDecodeError as e:
-        print(f"Erro de decodificação: {e}")
-        client_socket.send("Erro de decodificação".encode('utf-8'))
+    def on_read(conn):
+        try:
+            data = conn.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionError:
+            data = b''
+        if not data:
+            close(conn)
+            return
+        conn.last_activity = time.monotonic()
+        try:
+            decoded_data = conn.decoder.decode(data)
+        except UnicodeDecodeError as e:
+            print(f"Erro de decodificação: {e}")
+            conn.decoder.reset()
+            conn.outbuf += "Erro de decodificação".encode('utf-8')
+        else:
+            if verbose:
+                print(f"Recebido de {conn.address}: {decoded_data}")
+            conn.outbuf += RESPONSE
+        on_write(conn)
 
+    def on_write(conn):
+        if conn.outbuf:
+            try:
+                sent = conn.sock.send(conn.outbuf)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except ConnectionError:
+                close(conn)
+                return
+            del conn.outbuf[:sent]
+            if sent:
+                conn.last_activity = time.monotonic()  # cliente lento, mas consumindo respostas
+        if len(conn.outbuf) >= OUTBUF_HIGH:
+            conn.throttled = True
+        elif len(conn.outbuf) <= OUTBUF_LOW:
+            conn.throttled = False
+        events = (0 if conn.throttled else selectors.EVENT_READ) | (selectors.EVENT_WRITE if conn.outbuf else 0)
+        sel.modify(conn.sock, events, conn)
+
+    next_sweep = time.monotonic() + 1.0
+    while True:
+        for key, mask in sel.select(timeout=1.0):
+            if key.data is None:
+                accept()
+                continue
+            conn = key.data
+            if mask & selectors.EVENT_READ:
+                on_read(conn)
+            if mask & selectors.EVENT_WRITE and conn.sock in conns:
+                on_write(conn)
+
+        now = time.monotonic()
+        if accept_paused_until is not None and now >= accept_paused_until:
+            resume_accept()
+        if now >= next_sweep:
+            next_sweep = now + 1.0
+            for conn in [c for c in conns.values() if now - c.last_activity > idle_timeout]:
+                if verbose:
+                    print(f"Fechando conexão ociosa {conn.address}")
+                close(conn)
+
+
+def main():
+    args = parse_args()
+    conn_info = (args.host, args.port)
+
+    # Cria um socket TCP/IP
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    # Liga o socket a um endereço e porta
+    server_socket.bind(conn_info)
+
+    # Define o número máximo de conexões em fila
+    server_socket.listen(args.backlog)
+
+    print(f"Servidor pronto e aguardando conexões (modo {args.modo})...")
+
+    try:
+        if args.modo == 'eventos':
+            serve_events(server_socket, args.idle_timeout, args.verbose)
+        else:
+            serve_simple(server_socket)
+    except KeyboardInterrupt:
+        print("\nEncerrando servidor...")
     finally:
-        # Fecha a conexão
-        client_socket.close()
\ No newline at end of file
+        server_socket.close()
+
+
+if __name__ == '__main__':
+    main()
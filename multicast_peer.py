@@ -14,7 +14,12 @@ O peer imprime mensagens recebidas em tempo real e evita eco usando um identific
 """
 
 import argparse
+import asyncio
+import collections
+import cProfile
+import ctypes
 import json
+import select
 import socket
 import struct
 import threading
@@ -22,6 +27,10 @@ import time
 import uuid
 import sys
 import logging
+import os
+import pstats
+import tracemalloc
+import zlib
 
 
 logger = logging.getLogger(__name__)
@@ -38,13 +47,45 @@ def get_default_interface_ip():
         return "0.0.0.0"
 
 
-def make_mcast_socket(bind_port, mcast_group, iface_ip=None, ttl=1, loop=True, debug=False):
+SO_RCVBUFFORCE = getattr(socket, 'SO_RCVBUFFORCE', 33)
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40)
+DEFAULT_RCVBUF = 1 << 20
+
+
+def set_rcvbuf(sock, size, explicit=True):
+    """Ajusta o buffer de recepção. SO_RCVBUFFORCE ignora net.core.rmem_max, mas exige CAP_NET_ADMIN.
+
+    explicit=False (tamanho padrão, não pedido pelo usuário): ficar abaixo dele é só informado,
+    já que sem privilégios é o resultado normal.
+    """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, size)
+    except OSError:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        except OSError:
+            logger.warning('Aviso: não foi possível ajustar SO_RCVBUF')
+            return None
+    effective = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    if effective < size:  # o Linux reporta o dobro do pedido; menor que o pedido = limitado por rmem_max
+        logger.log(logging.WARNING if explicit else logging.INFO,
+                   'SO_RCVBUF efetivo %d menor que o solicitado %d (limite net.core.rmem_max?)', effective, size)
+    else:
+        logger.debug('SO_RCVBUF efetivo: %d', effective)
+    return effective
+
+
+def make_mcast_socket(bind_port, mcast_group, iface_ip=None, ttl=1, loop=True, debug=False, rcvbuf=None,
+                      rcvbuf_explicit=True):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     try:
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     except Exception:
         pass
 
+    if rcvbuf:
+        set_rcvbuf(sock, rcvbuf, rcvbuf_explicit)
+
     # Bind para receber datagramas multicast
     try:
         sock.bind(("", bind_port))
@@ -91,158 +132,633 @@ def make_mcast_socket(bind_port, mcast_group, iface_ip=None, ttl=1, loop=True, d
     return sock
 
 
-def listener_thread(sock, state, debug=False):
+def make_ucast_socket(iface_ip=None, rcvbuf=None, rcvbuf_explicit=True):
+    """Socket UDP em porta efêmera para o tráfego ponto a ponto (iam, join_ack, heartbeat_ack, new_member).
+
+    Cada peer tem a sua porta, então vários peers no mesmo host continuam endereçáveis
+    individualmente (o que não acontece com a porta do grupo, compartilhada via SO_REUSEADDR).
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    if rcvbuf:
+        set_rcvbuf(sock, rcvbuf, rcvbuf_explicit)
+    try:
+        sock.bind((iface_ip or '', 0))
+    except OSError:
+        sock.bind(('', 0))
+    logger.debug('Socket unicast ouvindo na porta %d', sock.getsockname()[1])
+    return sock
+
+
+# Cabeçalho binário opcional (modo --bpf): campos em offsets fixos para o filtro no kernel.
+#   0: magic 'MC' (2 bytes) | 2: versão (1) | 3: código do tipo (1) | 4: hash do destino (4) | 8: hash do remetente (4)
+WIRE_MAGIC = 0x4d43
+WIRE_VERSION = 1
+WIRE_HEADER = struct.Struct('!HBBII')
+HASH_ALL = 0xFFFFFFFF
+MSG_TYPES = {
+    'chat': 1, 'whois': 2, 'iam': 3, 'join_request': 4,
+    'join_ack': 5, 'new_member': 6, 'heartbeat': 7, 'heartbeat_ack': 8,
+}
+# tipos que cada papel nunca processa no socket do grupo
+ROLE_DROPPED_TYPES = {
+    'joining': (),
+    'member': ('whois', 'join_request', 'iam', 'join_ack', 'heartbeat_ack'),
+    'coordinator': ('iam', 'join_ack', 'new_member', 'heartbeat'),
+}
+
+SO_ATTACH_FILTER = getattr(socket, 'SO_ATTACH_FILTER', 26)
+UDP_PAYLOAD_OFFSET = 8  # em sockets UDP o filtro enxerga o cabeçalho UDP antes do payload
+
+# opcodes BPF clássico usados pelo filtro
+BPF_LD_H_ABS = 0x28
+BPF_LD_B_ABS = 0x30
+BPF_LD_W_ABS = 0x20
+BPF_JEQ_K = 0x15
+BPF_RET_K = 0x06
+
+
+class SockFilter(ctypes.Structure):
+    _fields_ = [('code', ctypes.c_ushort), ('jt', ctypes.c_ubyte), ('jf', ctypes.c_ubyte), ('k', ctypes.c_uint32)]
+
+
+class SockFprog(ctypes.Structure):
+    _fields_ = [('len', ctypes.c_ushort), ('filter', ctypes.POINTER(SockFilter))]
+
+
+def id_hash(peer_id):
+    if peer_id == 'all':
+        return HASH_ALL
+    return zlib.crc32(str(peer_id).encode('utf-8')) & 0xFFFFFFFF
+
+
+def encode_msg(msg, header=False):
+    """Serializa msg em JSON, opcionalmente precedido do cabeçalho binário de tamanho fixo."""
+    payload = json.dumps(msg).encode('utf-8')
+    if not header:
+        return payload
+    head = WIRE_HEADER.pack(WIRE_MAGIC, WIRE_VERSION, MSG_TYPES.get(msg.get('type'), 0),
+                            id_hash(msg.get('to', 'all')), id_hash(msg.get('id')))
+    return head + payload
+
+
+def decode_msg(data, local_id=None):
+    """Decodifica um datagrama (com ou sem cabeçalho). Retorna None se não for JSON válido.
+
+    Com local_id, datagramas com cabeçalho destinados a outro peer são descartados sem parse do JSON.
+    """
+    if len(data) >= WIRE_HEADER.size and data[:2] == b'MC':
+        _magic, _version, _code, dst, _src = WIRE_HEADER.unpack_from(data)
+        if local_id is not None and dst not in (HASH_ALL, id_hash(local_id)):
+            return None
+        data = data[WIRE_HEADER.size:]
+    try:
+        return json.loads(data.decode('utf-8', errors='replace'))
+    except ValueError:
+        return None
+
+
+def peer_role(state):
+    if state.get('status') != 'chatting':
+        return 'joining'
+    return 'coordinator' if is_coordinator(state) else 'member'
+
+
+def build_bpf_filter(local_id, role):
+    """Gera o programa BPF: aceita datagramas sem cabeçalho; com cabeçalho, descarta eco,
+    tipos irrelevantes ao papel e destinos diferentes de 'all'/local_id."""
+    base = UDP_PAYLOAD_OFFSET
+    dropped = [MSG_TYPES[t] for t in ROLE_DROPPED_TYPES[role]]
+    local_hash = id_hash(local_id)
+    # layout: [0] ldh magic, [1] jeq magic, [2] ld src, [3] jeq eco, [4] ldb tipo,
+    #         [5..5+n) jeq tipos, [5+n] ld dst, jeq all, jeq local, [8+n] ret drop, [9+n] ret accept
+    n = len(dropped)
+    drop = 8 + n
+    accept = drop + 1
+    prog = [
+        (BPF_LD_H_ABS, 0, 0, base + 0),
+        (BPF_JEQ_K, 0, accept - 2, WIRE_MAGIC),
+        (BPF_LD_W_ABS, 0, 0, base + 8),
+        (BPF_JEQ_K, drop - 4, 0, local_hash),
+        (BPF_LD_B_ABS, 0, 0, base + 3),
+    ]
+    for i, code in enumerate(dropped):
+        pc = 5 + i
+        prog.append((BPF_JEQ_K, drop - pc - 1, 0, code))
+    prog += [
+        (BPF_LD_W_ABS, 0, 0, base + 4),
+        (BPF_JEQ_K, accept - (6 + n) - 1, 0, HASH_ALL),
+        (BPF_JEQ_K, accept - (7 + n) - 1, 0, local_hash),
+        (BPF_RET_K, 0, 0, 0),
+        (BPF_RET_K, 0, 0, 0xFFFFFFFF),
+    ]
+    return prog
+
+
+def update_socket_filter(sock, state):
+    """(Re)instala o filtro BPF do socket do grupo conforme o id e o papel atuais do peer.
+
+    Só age no modo --bpf; deve ser chamada sempre que o id atribuído ou o papel mudarem.
+    """
+    if not state.get('wire_header'):
+        return
+    key = [state['id'], peer_role(state)]
+    if state.get('bpf_filter') == key:
+        return
+    if not sys.platform.startswith('linux'):
+        logger.warning('Filtro BPF disponível apenas no Linux; filtrando em espaço de usuário')
+        return
+    prog = build_bpf_filter(*key)
+    insns = (SockFilter * len(prog))(*[SockFilter(*i) for i in prog])
+    fprog = SockFprog(len(prog), insns)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, bytes(fprog))
+    except OSError:
+        logger.exception('Falha ao instalar filtro BPF')
+        return
+    state['bpf_filter'] = key
+    logger.debug('Filtro BPF instalado (id=%s, papel=%s, %d instruções)', key[0], key[1], len(prog))
+
+
+# Transferência de estado (snapshot) por TCP para peers que estão entrando.
+# Formato: sequência de quadros [tamanho (4) | crc32 (4) | dados]; o quadro final tem tamanho 0
+# e carrega o crc32 do snapshot inteiro.
+HISTORY_LIMIT = 500
+SNAPSHOT_CHUNK = 64 * 1024
+SNAPSHOT_FRAME = struct.Struct('!II')
+SNAPSHOT_TIMEOUT = 5.0
+# duplicatas de chat: os últimos SEEN_PER_SENDER HLCs de cada remetente (datagramas fora de ordem
+# não são duplicatas; só o mesmo par (remetente, HLC) é)
+SEEN_PER_SENDER = 1024
+
+
+def build_snapshot(state):
+    return {
+        'members': dict(state['members']),
+        'peers': dict(state['peers']),
+        'history': list(state['history']),
+        'watermarks': dict(state['watermarks']),
+        'last_heartbeat': time.time(),
+    }
+
+
+def mark_seen(state, peer_id, stamp):
+    """Registra (peer_id, stamp) entre os vistos. Retorna False se o par já estava lá."""
+    seen, order = state['seen'].setdefault(peer_id, (set(), collections.deque()))
+    key = tuple(stamp)
+    if key in seen:
+        return False
+    seen.add(key)
+    order.append(key)
+    if len(order) > SEEN_PER_SENDER:
+        seen.discard(order.popleft())
+    return True
+
+
+def record_chat(state, obj):
+    """Guarda a mensagem de chat no histórico. Retorna False se já foi vista: o mesmo (remetente, HLC)
+    entre os recentes ou coberta pela marca d'água do snapshot recebido ao entrar."""
+    peer_id, ts = obj.get('id'), obj.get('ts') or 0
+    stamp = list(obj.get('hlc') or [int(ts * 1000), 0])
+    if stamp <= state['snapshot_marks'].get(peer_id, [0, 0]) or not mark_seen(state, peer_id, stamp):
+        return False
+    state['watermarks'][peer_id] = max(stamp, state['watermarks'].get(peer_id, [0, 0]))
+    state['history'].append({'id': peer_id, 'ts': ts, 'hlc': stamp, 'text': (obj.get('content') or {}).get('text', '')})
+    return True
+
+
+def write_snapshot(conn, payload):
+    for offset in range(0, len(payload), SNAPSHOT_CHUNK):
+        chunk = payload[offset:offset + SNAPSHOT_CHUNK]
+        conn.sendall(SNAPSHOT_FRAME.pack(len(chunk), zlib.crc32(chunk)) + chunk)
+    conn.sendall(SNAPSHOT_FRAME.pack(0, zlib.crc32(payload)))
+
+
+def recv_exact(conn, size):
+    buf = bytearray()
+    while len(buf) < size:
+        part = conn.recv(size - len(buf))
+        if not part:
+            raise ConnectionError('conexão encerrada no meio do snapshot')
+        buf += part
+    return bytes(buf)
+
+
+def serve_snapshot(state, timeout=SNAPSHOT_TIMEOUT):
+    """Abre um listener TCP efêmero que entrega um único snapshot do estado atual e se encerra.
+
+    O snapshot é serializado aqui, então reflete o estado no momento do join. Retorna (porta, tamanho).
+    """
+    payload = json.dumps(build_snapshot(state)).encode('utf-8')
+    srv = socket.create_server(('', 0))
+    srv.settimeout(timeout)
+
+    def serve():
+        try:
+            conn, addr = srv.accept()
+            with conn:
+                conn.settimeout(timeout)
+                write_snapshot(conn, payload)
+                logger.debug('Snapshot de %d bytes enviado para %s', len(payload), addr)
+        except OSError:
+            logger.warning('Snapshot não foi retirado (porta %d)', srv.getsockname()[1])
+        finally:
+            srv.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return srv.getsockname()[1], len(payload)
+
+
+def fetch_snapshot(host, port, size=None, timeout=SNAPSHOT_TIMEOUT):
+    """Baixa e valida (crc por quadro e do total) um snapshot servido por serve_snapshot."""
+    parts = []
+    with socket.create_connection((host, port), timeout=timeout) as conn:
+        while True:
+            length, crc = SNAPSHOT_FRAME.unpack(recv_exact(conn, SNAPSHOT_FRAME.size))
+            if length == 0:
+                break
+            chunk = recv_exact(conn, length)
+            if zlib.crc32(chunk) != crc:
+                raise ValueError('checksum inválido em quadro do snapshot')
+            parts.append(chunk)
+    payload = b''.join(parts)
+    if zlib.crc32(payload) != crc or (size is not None and len(payload) != size):
+        raise ValueError('snapshot incompleto ou corrompido')
+    return json.loads(payload.decode('utf-8'))
+
+
+# Contabilidade de descartes no kernel (fila de recepção cheia)
+PROC_UDP_INTERVAL = 1.0
+
+
+def enable_drop_counter(sock):
+    """Liga SO_RXQ_OVFL: cada datagrama passa a trazer, como dado auxiliar, o total de descartes do socket."""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+        return True
+    except OSError:
+        return False
+
+
+def proc_udp_drops(sock):
+    """Lê a coluna 'drops' de /proc/net/udp para o socket (pelo inode). None se indisponível."""
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        with open('/proc/net/udp') as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if fields[9] == inode:
+                    return int(fields[-1])
+    except (OSError, IndexError, ValueError, StopIteration):
+        pass
+    return None
+
+
+def proc_snmp_rcvbuf_errors():
+    """Udp RcvbufErrors de /proc/net/snmp: descartes por fila cheia em todo o sistema. None se indisponível."""
+    try:
+        with open('/proc/net/snmp') as f:
+            header, values = [line.split() for line in f if line.startswith('Udp:')][:2]
+        return int(values[header.index('RcvbufErrors')])
+    except (OSError, ValueError):
+        return None
+
+
+def note_kernel_drops(rx, track, total, name):
+    """Atualiza as métricas com o contador cumulativo de descartes do socket e avisa (no máx. 1x/s) quando ele cresce.
+
+    rx['kernel_drops'] conta só descartes por fila cheia. Com filtro BPF no socket (track['filtered']),
+    o contador do socket também inclui o que o filtro rejeitou: desses, a parte atribuída a fila cheia
+    é o aumento de RcvbufErrors (/proc/net/snmp, do sistema todo) e o resto vai para
+    rx['filtered_drops']. Essa divisão é feita no máximo 1x/s, junto com os avisos.
+    """
+    delta = total - track['socket_drops']
+    if delta <= 0:
+        return
+    track['socket_drops'] = total
+    if track['filtered']():
+        track['unsplit'] += delta
+    else:
+        rx['kernel_drops'] += delta
+        track['pending'] += delta
+    now = time.monotonic()
+    if now - track['last_warning'] <= 1.0:
+        return
+    track['last_warning'] = now
+    if track['unsplit']:
+        unsplit, track['unsplit'] = track['unsplit'], 0
+        errors = proc_snmp_rcvbuf_errors()
+        overflow = 0
+        if errors is not None and track['rcvbuf_errors'] is not None:
+            overflow = min(unsplit, max(0, errors - track['rcvbuf_errors']))
+        track['rcvbuf_errors'] = errors
+        rx['kernel_drops'] += overflow
+        rx['filtered_drops'] += unsplit - overflow
+        track['pending'] += overflow
+        logger.debug('Descartes no socket %s: %d pelo filtro, %d por fila cheia', name, unsplit - overflow, overflow)
+    pending, track['pending'] = track['pending'], 0
+    if pending:
+        logger.warning('Kernel descartou %d datagramas no socket %s (total %d) — listener atrasado; ajuste --rcvbuf',
+                       pending, name, rx['kernel_drops'])
+
+
+def recv_datagram(sock, rx, track, name, ovfl=False, flags=0):
+    """recvfrom que também coleta o contador de descartes (SO_RXQ_OVFL ou, na falta dele, /proc/net/udp)."""
+    if ovfl:
+        data, ancdata, _flags, addr = sock.recvmsg(65536, socket.CMSG_SPACE(4), flags)
+        for level, ctype, cdata in ancdata:
+            if level == socket.SOL_SOCKET and ctype == SO_RXQ_OVFL and len(cdata) >= 4:
+                note_kernel_drops(rx, track, struct.unpack('=I', cdata[:4])[0], name)
+    else:
+        data, addr = sock.recvfrom(65536, flags)
+        now = time.monotonic()
+        if now - track['last_proc_check'] > PROC_UDP_INTERVAL:
+            track['last_proc_check'] = now
+            total = proc_udp_drops(sock)
+            if total is not None:
+                note_kernel_drops(rx, track, total, name)
+    rx['packets'] += 1
+    return data, addr
+
+
+# Captura de datagramas (--capture): arquivo binário iniciado por TRACE_MAGIC e seguido de registros
+#   [ts float64 | direção (1) | canal (1) | ip (4) | porta (2) | tamanho (4)] + dados
+# Registros TRACE_META carregam, em JSON, o id/papel/membros do peer no momento (para o replay).
+TRACE_MAGIC = b'MPTRACE1'
+TRACE_RECORD = struct.Struct('!dBB4sHI')
+TRACE_RX, TRACE_TX, TRACE_META = 0, 1, 2
+TRACE_CHANNELS = ('group', 'unicast')
+
+
+class TraceWriter:
+    """Grava cada datagrama recebido/enviado (com timestamp e endereço) em um trace binário compacto."""
+
+    def __init__(self, path):
+        self.f = open(path, 'wb', buffering=1 << 16)
+        self.f.write(TRACE_MAGIC)
+        self.lock = threading.Lock()
+
+    def record(self, direction, addr, data, channel='group'):
+        try:
+            ip = socket.inet_aton(addr[0])
+        except OSError:
+            ip = bytes(4)
+        head = TRACE_RECORD.pack(time.time(), direction, TRACE_CHANNELS.index(channel), ip, addr[1], len(data))
+        with self.lock:
+            if not self.f.closed:
+                self.f.write(head)
+                self.f.write(data)
+
+    def meta(self, state):
+        info = {k: state.get(k) for k in ('id', 'coordinator_id', 'group', 'port', 'status', 'wire_header')}
+        info['members'] = list(state.get('members', {}))
+        self.record(TRACE_META, ('0.0.0.0', 0), json.dumps(info).encode('utf-8'))
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+def read_trace(path):
+    """Itera sobre os registros de um trace: (ts, direção, canal, (ip, porta), dados)."""
+    with open(path, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f'{path} não é um trace do multicast_peer')
+        while True:
+            head = f.read(TRACE_RECORD.size)
+            if len(head) < TRACE_RECORD.size:
+                return
+            ts, direction, channel, ip, port, size = TRACE_RECORD.unpack(head)
+            data = f.read(size)
+            if len(data) < size:
+                return  # registro truncado (captura interrompida)
+            yield ts, direction, TRACE_CHANNELS[channel], (socket.inet_ntoa(ip), port), data
+
+
+# Encerramento dos listeners: recv sem bloquear (MSG_DONTWAIT, o socket do grupo também é usado
+# para enviar e continua bloqueante) e, com a fila vazia, espera por select com timeout, conferindo
+# state['_stop'] a cada LISTEN_POLL segundos. Sem MSG_DONTWAIT o listener só sai com o socket fechado.
+RECV_NOWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+LISTEN_POLL = 0.5
+
+
+def wait_readable(sock, stop):
+    """Espera sock ter datagramas. False se stop foi acionado ou o socket foi fechado."""
+    while not stop.is_set():
+        try:
+            if select.select([sock], [], [], LISTEN_POLL)[0]:
+                return True
+        except (OSError, ValueError):
+            return False
+    return False
+
+
+def listener_thread(sock, state, debug=False, recv_sock=None):
     """Listener que também implementa comportamento do coordenador quando state['is_coordinator']==True.
 
     state: dict compartilhado com chaves: is_coordinator (bool), members (dict), next_id (int).
+    recv_sock: socket de onde ler (padrão: sock); respostas sempre saem por sock.
     """
     logger.debug('Listener thread started')
-    group, port = state.get('group'), state.get('port')
-    while True:
+    name = 'group' if recv_sock is None or recv_sock is sock else 'unicast'
+    recv_sock = recv_sock or sock
+    ovfl = enable_drop_counter(recv_sock)
+    # kernel_drops: fila de recepção cheia; filtered_drops: rejeitados pelo filtro BPF (ver note_kernel_drops)
+    rx = {'packets': 0, 'kernel_drops': 0, 'filtered_drops': 0}
+    # o filtro BPF (--bpf) só é instalado no socket do grupo, e pode ser trocado depois
+    track = {'pending': 0, 'socket_drops': 0, 'unsplit': 0, 'last_warning': 0.0, 'last_proc_check': 0.0,
+             'rcvbuf_errors': proc_snmp_rcvbuf_errors(),
+             'filtered': lambda: name == 'group' and state.get('bpf_filter') is not None}
+    state['metrics'].setdefault('recv', {})[name] = rx
+    stop = state.setdefault('_stop', threading.Event())
+    while not stop.is_set():
         try:
             logger.debug('Waiting to receive data...')
-            data, addr = sock.recvfrom(65536)
+            data, addr = recv_datagram(recv_sock, rx, track, name, ovfl, RECV_NOWAIT)
             logger.debug('Data received from %s', addr)
+        except BlockingIOError:
+            if not wait_readable(recv_sock, stop):
+                break
+            continue
         except OSError:
             logger.info('OSError in listener thread, exiting')
             break
         if not data:
             logger.info('No data received, continuing')
             continue
-        # tentar decodificar JSON
-        try:
-            obj = json.loads(data.decode('utf-8', errors='replace'))
-            logger.debug('Data decoded as JSON: %s', obj)
-        except Exception:
-            continue
-
-        if obj.get('to') not in ('all', state.get('id')):
-            if debug:
-                logger.debug('Mensagem não destinada a este peer (to=%s), ignorando', obj.get('to'))
-            continue
+        trace = state.get('_trace')
+        if trace is not None:
+            trace.record(TRACE_RX, addr, data, name)
+        prof = state.get('_cprofile')
+        if prof is not None:
+            prof.run(handle_datagram, sock, state, data, addr, debug)
+        else:
+            handle_datagram(sock, state, data, addr, debug)
 
-        # protocolo: tratar mensagens administrativas quando houver 'type'
-        mtype = obj.get('type')
 
-        # Ignorar mensagens locais (eco) — campo id das mensagens de chat
-        if obj.get('id') == state.get('id'):
-            if debug:
-                logger.debug('Ignorando mensagem local (eco)')
-                logger.debug('Id local: %s', state.get('id'))
-                logger.debug('Mensagem ignorada: %s', obj)
-            continue
-
-        # Se for mensagem administrativa e somos coordenador, tratar
-        if mtype == 'whois' and is_coordinator(state):
-            resp = message(sender_id=state['id'], mtype='iam', to=obj.get('id'))
-            try:
-                # responder por multicast para que o solicitante descubra o endereço do coordenador
-                sock.sendto(json.dumps(resp).encode('utf-8'), (group, port))
-                logger.debug('Respondido whois via multicast')
-            except Exception:
-                logger.exception('Falha ao responder whois')
+def handle_datagram(sock, state, data, addr, debug=False):
+    """Processa um datagrama recebido (decodificação, protocolo de coordenação e chat).
 
-            # whois não são exibidos como chat
-            continue
-
-        if mtype == 'iam': # todo: verificar necessidade pos inclusao do campo 'to' nas mensagens
-            # recepção de anúncio de coordenador — ignorar aqui (main já usou discovery)
-            continue
-
-        if mtype == 'join_request' and is_coordinator(state):
-            logger.debug('Recebido join_request de %s', addr)
-            if is_coordinator(state):
-                # atribuir id único e responder unicast
-                new_member_id = obj.get('id')
-                logger.debug('Atribuindo id para novo membro: %s', new_member_id)
-                ip = addr[0]
-                assigned_id = f'{new_member_id}@{ip}' # apenas o 'ip' ja bastava, pois ja eh um identificador unico que a rede resolve para mim, so estou adicionando o nome pelo requisito de atribuição de id para o trabalho
-                if assigned_id in state['members'].keys():
-                    logger.debug('Membro %s já existe, gerando id complementar', assigned_id)
-                    complement = uuid.uuid4().hex[:6]
-                    assigned_id = f'{new_member_id}_{complement}@{ip}'
-                state['members'][assigned_id] = time.time()
-                content = {'assigned_id': assigned_id, 'members': state['members'], 'last_heartbeat': time.time()}
-                ack = message(sender_id=state['id'], mtype='join_ack', to=obj.get('id'), content=content)
-
-                try:
-                    logger.debug('Enviando join_ack %s para %s', ack, addr)
-                    sock.sendto(json.dumps(ack).encode('utf-8'), (group, port))
-                    logger.info('Atribuído id %s para %s (%s)', assigned_id, obj.get('id'), addr)
-                except Exception:
-                    logger.exception('Falha ao enviar join_ack')
-
-                for m in state['members'].keys(): # let all members know about the new member
-                    if m != assigned_id:
-                        notify = message(sender_id=state['id'], mtype='new_member', to=m, content={'new_member_id': assigned_id})
-                        try:
-                            sock.sendto(json.dumps(notify).encode('utf-8'), (group, port))
-                            logger.debug('Notificado membro %s sobre novo membro %s', m, assigned_id)
-                        except Exception:
-                            logger.exception('Falha ao notificar membro %s sobre novo membro %s', m, assigned_id)
-            continue
-
-        if mtype == 'join_ack': # todo: verificar necessidade pos inclusao do campo 'to' nas mensagens
-            # join_ack recebido — main thread trata de join, aqui apenas ignorar
-            continue
+    Não lê de socket algum: sock só é usado para respostas, o que permite alimentar a lógica
+    do peer a partir de um trace (ver peer_replay.py).
+    """
+    # tentar decodificar JSON (cabeçalho binário, se houver, permite descartar antes do parse)
+    obj = decode_msg(data, state.get('id'))
+    if obj is None:
+        return
+    logger.debug('Data decoded as JSON: %s', obj)
 
-        if obj['id'] not in state['members'].keys():
-            logger.debug('Remetente %s não é membro conhecido, ignorando', obj['id'])
-            continue
+    if obj.get('hlc') and obj.get('id') != state.get('id'):
+        hlc_merge(state, obj['hlc'])
 
-        if mtype == 'new_member':
-            new_member_id = obj.get('content', {}).get('new_member_id')
-            if new_member_id and new_member_id not in state['members'].keys():
-                state['members'][new_member_id] = time.time()
-                logger.info('Novo membro adicionado: %s', new_member_id)
-            continue
+    if obj.get('to') not in ('all', state.get('id')):
+        if debug:
+            logger.debug('Mensagem não destinada a este peer (to=%s), ignorando', obj.get('to'))
+        return
 
-        if mtype == 'heartbeat' and not is_coordinator(state):
-            # atualizar lista de membros a partir do heartbeat do coordenador
-            cur_members = set(state['members'].keys())
-            incoming_members = set(obj['content']['members'].keys())
-            absent_members = cur_members - incoming_members
+    # protocolo: tratar mensagens administrativas quando houver 'type'
+    mtype = obj.get('type')
 
-            for am in absent_members:
-                del state['members'][am]
-                logger.info('Membro removido por ausência (segundo heartbeat): %s', am)            
-            state['last_heartbeat'] = time.time()
+    # Ignorar mensagens locais (eco) — campo id das mensagens de chat
+    if obj.get('id') == state.get('id'):
+        if debug:
+            logger.debug('Ignorando mensagem local (eco)')
+            logger.debug('Id local: %s', state.get('id'))
+            logger.debug('Mensagem ignorada: %s', obj)
+        return
+
+    # Se for mensagem administrativa e somos coordenador, tratar
+    if mtype == 'whois' and is_coordinator(state):
+        resp = message(sender_id=state['id'], mtype='iam', to=obj.get('id'), content={'ucast_port': state.get('ucast_port')}, state=state)
+        try:
+            # responder direto ao solicitante; o id dele ainda não é único, então endereçamos pelo addr
+            dest = send_msg(sock, state, resp, addr=reply_addr(obj, addr))
+            logger.debug('Respondido whois para %s', dest)
+        except Exception:
+            logger.exception('Falha ao responder whois')
+
+        # whois não são exibidos como chat
+        return
+
+    if mtype == 'iam': # todo: verificar necessidade pos inclusao do campo 'to' nas mensagens
+        # recepção de anúncio de coordenador — ignorar aqui (main já usou discovery)
+        return
+
+    if mtype == 'join_request' and is_coordinator(state):
+        logger.debug('Recebido join_request de %s', addr)
+        if is_coordinator(state):
+            # atribuir id único e responder unicast
+            new_member_id = obj.get('id')
+            logger.debug('Atribuindo id para novo membro: %s', new_member_id)
+            ip = addr[0]
+            assigned_id = f'{new_member_id}@{ip}' # apenas o 'ip' ja bastava, pois ja eh um identificador unico que a rede resolve para mim, so estou adicionando o nome pelo requisito de atribuição de id para o trabalho
+            if assigned_id in state['members'].keys():
+                logger.debug('Membro %s já existe, gerando id complementar', assigned_id)
+                complement = uuid.uuid4().hex[:6]
+                assigned_id = f'{new_member_id}_{complement}@{ip}'
+            state['members'][assigned_id] = time.time()
+            new_addr = reply_addr(obj, addr)
+            if new_addr is not None:
+                state['peers'][assigned_id] = list(new_addr)
+            # o estado completo vai por TCP; o join_ack só aponta para o snapshot
+            try:
+                # state['_serve_snapshot'] substitui o listener TCP (o peer_replay só mede a serialização)
+                snap_port, snap_size = state.get('_serve_snapshot', serve_snapshot)(state)
+            except OSError:
+                logger.exception('Falha ao abrir listener do snapshot')
+                return
+            content = {'assigned_id': assigned_id, 'snapshot': {'port': snap_port, 'size': snap_size}}
+            ack = message(sender_id=state['id'], mtype='join_ack', to=obj.get('id'), content=content, state=state)
 
-            # send back ack to coordinator
-            ack = message(sender_id=state['id'], mtype='heartbeat_ack', to=state['coordinator_id'])
             try:
-                sock.sendto(json.dumps(ack).encode('utf-8'), (group, port))
-                logger.debug('Respondido heartbeat_ack para o coordenador')
+                logger.debug('Enviando join_ack %s para %s', ack, addr)
+                send_msg(sock, state, ack, addr=new_addr)
+                logger.info('Atribuído id %s para %s (%s)', assigned_id, obj.get('id'), addr)
             except Exception:
-                logger.exception('Falha ao enviar heartbeat_ack')
+                logger.exception('Falha ao enviar join_ack')
 
-            if debug:
-                logger.debug('Heartbeat recebido do coordenador, membros atualizados: %s', state['members'])
+            for m in state['members'].keys(): # let all members know about the new member
+                if m != assigned_id and m != state['id']:
+                    notify = message(sender_id=state['id'], mtype='new_member', to=m, content={'new_member_id': assigned_id, 'addr': state['peers'].get(assigned_id)}, state=state)
+                    try:
+                        send_msg(sock, state, notify)
+                        logger.debug('Notificado membro %s sobre novo membro %s', m, assigned_id)
+                    except Exception:
+                        logger.exception('Falha ao notificar membro %s sobre novo membro %s', m, assigned_id)
+        return
+
+    if mtype == 'join_ack': # todo: verificar necessidade pos inclusao do campo 'to' nas mensagens
+        # join_ack recebido — main thread trata de join, aqui apenas ignorar
+        return
+
+    if obj['id'] not in state['members'].keys():
+        logger.debug('Remetente %s não é membro conhecido, ignorando', obj['id'])
+        return
+
+    if mtype == 'new_member':
+        new_member_id = obj.get('content', {}).get('new_member_id')
+        if new_member_id and new_member_id not in state['members'].keys():
+            state['members'][new_member_id] = time.time()
+            logger.info('Novo membro adicionado: %s', new_member_id)
+        new_member_addr = obj.get('content', {}).get('addr')
+        if new_member_id and new_member_addr:
+            state['peers'][new_member_id] = new_member_addr
+        return
+
+    if mtype == 'heartbeat' and not is_coordinator(state):
+        # atualizar lista de membros a partir do heartbeat do coordenador
+        cur_members = set(state['members'].keys())
+        incoming_members = set(obj['content']['members'].keys())
+        absent_members = cur_members - incoming_members
+
+        for am in absent_members:
+            del state['members'][am]
+            state['peers'].pop(am, None)
+            logger.info('Membro removido por ausência (segundo heartbeat): %s', am)            
+        state['last_heartbeat'] = time.time()
+
+        # send back ack to coordinator
+        ack = message(sender_id=state['id'], mtype='heartbeat_ack', to=state['coordinator_id'], state=state)
+        try:
+            send_msg(sock, state, ack)
+            logger.debug('Respondido heartbeat_ack para o coordenador')
+        except Exception:
+            logger.exception('Falha ao enviar heartbeat_ack')
 
-            continue
+        if debug:
+            logger.debug('Heartbeat recebido do coordenador, membros atualizados: %s', state['members'])
 
-        if mtype == 'heartbeat_ack' and is_coordinator(state):
-            # coordenador recebeu ack de heartbeat — pode usar para monitorar membros ativos
-            state['members'][obj.get('id')] = time.time()
-            if debug:
-                logger.debug('Recebido heartbeat_ack de %s', obj.get('id'))
-            continue
+        return
 
-        if mtype == 'chat':
-            try:
-                peer_id = obj.get('id')
-                text = obj.get('content', {}).get('text', '')
-                ts = obj.get('ts')
-                stamp = ''
-                if ts:
-                    try:
-                        stamp = time.strftime('%H:%M:%S', time.localtime(float(ts)))
-                    except Exception:
-                        stamp = str(ts)
-                logger.info(f'[{stamp}] {peer_id}: {text}')
-            except Exception:
-                logger.exception('Erro ao processar mensagem recebida: %s', obj)
-                continue
+    if mtype == 'heartbeat_ack' and is_coordinator(state):
+        # coordenador recebeu ack de heartbeat — pode usar para monitorar membros ativos
+        state['members'][obj.get('id')] = time.time()
+        if debug:
+            logger.debug('Recebido heartbeat_ack de %s', obj.get('id'))
+        return
+
+    if mtype == 'chat':
+        if not record_chat(state, obj):
+            return
+        deliver = state.get('_deliver')
+        if deliver is not None:
+            # consumidor embutido (PeerNode): entrega a mensagem crua, sem log nem formatação
+            deliver(obj)
+            return
+        try:
+            peer_id = obj.get('id')
+            text = obj.get('content', {}).get('text', '')
+            ts = obj.get('ts')
+            stamp = ''
+            if ts:
+                try:
+                    stamp = time.strftime('%H:%M:%S', time.localtime(float(ts)))
+                except Exception:
+                    stamp = str(ts)
+            logger.info(f'[{stamp}] {peer_id}: {text}')
+        except Exception:
+            logger.exception('Erro ao processar mensagem recebida: %s', obj)
+            return
 
 
 def parse_args():
@@ -255,6 +771,14 @@ def parse_args():
     p.add_argument('--debug', action='store_true', help='Modo debug (logs adicionais)')
     p.add_argument('--logfile', default='multicast_peer.log', help='Arquivo para gravar logs (padrão: multicast_peer.log)')
     p.add_argument('--join-timeout', type=float, default=2.0, help='Tempo (s) para descobrir coordenador/aguardar join_ack (padrão: 2.0)')
+    p.add_argument('--rcvbuf', type=int, default=None,
+                   help=f'Tamanho (bytes) do buffer de recepção dos sockets; 0 mantém o padrão do sistema (padrão: {DEFAULT_RCVBUF})')
+    p.add_argument('--queue-limits', type=int, nargs=3, default=list(DEFAULT_QUEUE_LIMITS), metavar=('CONTROL', 'CHAT', 'BULK'),
+                   help='Tamanho máximo de cada fila de saída (padrão: %(default)s)')
+    p.add_argument('--capture', default=None, metavar='ARQUIVO',
+                   help='Gravar todos os datagramas recebidos/enviados em um trace binário (ver peer_replay.py)')
+    p.add_argument('--profile-dir', default='.', help='Diretório dos arquivos gerados por \\profile e \\mem (padrão: .)')
+    p.add_argument('--bpf', action='store_true', help='(Linux) Cabeçalho binário + filtro BPF no socket do grupo: tráfego de outros peers é descartado no kernel')
     return p.parse_args()
 
 
@@ -263,14 +787,27 @@ def is_coordinator(state):
 
 
 def wait_reply(sock, reply_type='all', reply_from='all', reply_to='all', timeout=2.0):
+    """Aguarda a primeira mensagem compatível em sock (um socket ou uma lista de sockets)."""
+    socks = list(sock) if isinstance(sock, (list, tuple)) else [sock]
+    deadline = time.time() + timeout
     while True:
-        sock.settimeout(timeout)
-        try:
-            data, addr = sock.recvfrom(65536)
-            obj = json.loads(data.decode('utf-8', errors='replace'))
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        ready, _, _ = select.select(socks, [], [], remaining)
+        if not ready:
+            return None
+        for s in ready:
+            try:
+                data, addr = s.recvfrom(65536)
+            except OSError:
+                continue
+            obj = decode_msg(data)
+            if obj is None:
+                continue
             logger.debug('Dados recebidos de %s: %s', addr, obj)
-            if reply_type != 'all' and obj['type'] != reply_type:
-                logger.debug('Tipo de mensagem %s não corresponde ao esperado %s, ignorando', obj['type'], reply_type)
+            if reply_type != 'all' and obj.get('type') != reply_type:
+                logger.debug('Tipo de mensagem %s não corresponde ao esperado %s, ignorando', obj.get('type'), reply_type)
                 continue
             if reply_from != 'all' and obj.get('id') != reply_from:
                 logger.debug('Mensagem de %s não corresponde ao esperado %s, ignorando', addr[0], reply_from)
@@ -279,23 +816,186 @@ def wait_reply(sock, reply_type='all', reply_from='all', reply_to='all', timeout
                 logger.debug('Mensagem para id %s não corresponde ao esperado %s, ignorando', obj.get('id'), reply_to)
                 continue
             return obj, addr
-        except socket.timeout:
+
+
+def message(sender_id, mtype, to='all', content=None, state=None):
+    msg = {'id': sender_id, 'to': to, 'type': mtype, 'content': content, 'ts': time.time()}
+    if state is not None and 'hlc' in state:
+        msg['hlc'] = hlc_now(state)
+    return msg
+
+
+# Relógio lógico híbrido (HLC): [tempo físico em ms, contador]. Comparar as listas
+# lexicograficamente dá uma ordem consistente com a causalidade sem depender de
+# relógios sincronizados nem de sequenciamento pelo coordenador.
+_hlc_lock = threading.Lock()
+
+
+def hlc_now(state):
+    """Avança o HLC local para um envio/evento local e retorna o novo timestamp."""
+    with _hlc_lock:
+        pt = int(time.time() * 1000)
+        l_old, c_old = state['hlc']
+        l = max(l_old, pt)
+        c = c_old + 1 if l == l_old else 0
+        state['hlc'] = [l, c]
+        return [l, c]
+
+
+def hlc_merge(state, remote):
+    """Incorpora o HLC de uma mensagem recebida ao relógio local."""
+    with _hlc_lock:
+        pt = int(time.time() * 1000)
+        l_old, c_old = state['hlc']
+        l_msg, c_msg = remote
+        l = max(l_old, l_msg, pt)
+        if l == l_old and l == l_msg:
+            c = max(c_old, c_msg) + 1
+        elif l == l_old:
+            c = c_old + 1
+        elif l == l_msg:
+            c = c_msg + 1
+        else:
+            c = 0
+        state['hlc'] = [l, c]
+        return [l, c]
+
+
+def ordered_history(state):
+    """Histórico de chat em ordem causal (HLC, com o id do remetente como desempate)."""
+    return sorted(state['history'], key=lambda m: (m['hlc'], m['id']))
+
+
+def reply_addr(obj, addr):
+    """Endereço unicast anunciado pelo remetente (ip de origem + 'ucast_port' do conteúdo), se houver."""
+    ucast_port = (obj.get('content') or {}).get('ucast_port')
+    if not ucast_port:
+        return None
+    return (addr[0], int(ucast_port))
+
+
+# Classes de prioridade da fila de saída (menor valor = mais prioritário)
+PRIO_CONTROL, PRIO_CHAT, PRIO_BULK = 0, 1, 2
+PRIO_NAMES = ('control', 'chat', 'bulk')
+DEFAULT_QUEUE_LIMITS = (1024, 1024, 256)
+
+
+def msg_priority(msg):
+    mtype = msg.get('type')
+    if mtype == 'chat':
+        return PRIO_CHAT
+    if mtype in MSG_TYPES:
+        return PRIO_CONTROL
+    return PRIO_BULK
+
+
+class SendScheduler:
+    """Escalonador único de saída: uma fila limitada por classe, atendidas em prioridade estrita.
+
+    Controle/associação (heartbeat, acks, join) nunca espera atrás de rajadas de chat. As métricas
+    por classe (enviados, descartados, latência de fila média/máxima em ms) ficam em metrics.
+    """
+
+    def __init__(self, sock, metrics, limits=DEFAULT_QUEUE_LIMITS, trace=None):
+        self.sock = sock
+        self.limits = limits
+        self.trace = trace
+        self.queues = [collections.deque() for _ in PRIO_NAMES]
+        self.cond = threading.Condition()
+        self.closed = False
+        self.last_drop_warning = 0.0
+        self.metrics = metrics
+        for name in PRIO_NAMES:
+            metrics[name] = {'sent': 0, 'dropped': 0, 'errors': 0, 'lat_avg_ms': 0.0, 'lat_max_ms': 0.0}
+
+    def submit(self, data, dest, prio, channel='group'):
+        """Enfileira um datagrama. Retorna False (e contabiliza descarte) se a fila da classe estiver cheia.
+
+        channel ('group' ou 'unicast') é o registrado no trace quando o datagrama sai.
+        """
+        with self.cond:
+            queue = self.queues[prio]
+            if len(queue) >= self.limits[prio]:
+                self.metrics[PRIO_NAMES[prio]]['dropped'] += 1
+                now = time.monotonic()
+                if now - self.last_drop_warning > 1.0:
+                    self.last_drop_warning = now
+                    logger.warning('Fila de saída %s cheia (%d), descartando', PRIO_NAMES[prio], len(queue))
+                return False
+            queue.append((time.monotonic(), data, dest, channel))
+            self.cond.notify()
+            return True
+
+    def next_item(self):
+        with self.cond:
+            while not self.closed:
+                for prio, queue in enumerate(self.queues):
+                    if queue:
+                        return prio, queue.popleft()
+                self.cond.wait()
             return None
-        finally:
-            sock.settimeout(None)
 
+    def run(self):
+        logger.debug('Sender thread started')
+        while True:
+            item = self.next_item()
+            if item is None:
+                break
+            prio, (queued_at, data, dest, channel) = item
+            m = self.metrics[PRIO_NAMES[prio]]
+            try:
+                self.sock.sendto(data, dest)
+            except OSError:
+                m['errors'] += 1
+                logger.exception('Falha ao enviar datagrama para %s', dest)
+                continue
+            if self.trace is not None:
+                self.trace.record(TRACE_TX, dest, data, channel)
+            lat_ms = (time.monotonic() - queued_at) * 1000
+            m['sent'] += 1
+            m['lat_avg_ms'] += (lat_ms - m['lat_avg_ms']) * 0.1  # média móvel exponencial
+            m['lat_max_ms'] = max(m['lat_max_ms'], lat_ms)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='sender', daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
 
-def message(sender_id, mtype, to='all', content=None):
-    return {'id': sender_id, 'to': to, 'type': mtype, 'content': content, 'ts': time.time()}
+
+def send_msg(sock, state, msg, addr=None):
+    """Envia msg por unicast quando o endereço do destinatário é conhecido; caso contrário, pelo grupo.
+
+    Mensagens com to='all' sempre vão para o grupo. Se houver um SendScheduler em state['_sender'],
+    o datagrama passa pela fila da sua classe de prioridade. Retorna o destino usado.
+    """
+    if addr is None and msg.get('to') != 'all':
+        addr = state.get('peers', {}).get(msg.get('to'))
+    dest = tuple(addr) if addr else (state['group'], state['port'])
+    channel = 'unicast' if addr else 'group'
+    data = encode_msg(msg, state.get('wire_header', False))
+    sender = state.get('_sender')
+    if sender is not None:
+        sender.submit(data, dest, msg_priority(msg), channel)
+    else:
+        sock.sendto(data, dest)
+        trace = state.get('_trace')
+        if trace is not None:
+            trace.record(TRACE_TX, dest, data, channel)
+    return dest
 
 
 def send_text(sock, state, text):
-    group, port = state['group'], state['port']
     logger.debug('sending text: %s', text)
-    msg = message(sender_id=state['id'], mtype='chat', content={'text': text})
-    b = json.dumps(msg).encode('utf-8')
+    msg = message(sender_id=state['id'], mtype='chat', content={'text': text}, state=state)
+    if 'history' in state:
+        record_chat(state, msg)
     try:
-        sock.sendto(b, (group, port))
+        send_msg(sock, state, msg)
         logger.debug('message sent')
     except Exception as e:
         logger.exception('Erro ao enviar mensagem: %s', e)
@@ -313,59 +1013,412 @@ def check_absence(state, threshold):
             to_remove.append(member_id)
     for member_id in to_remove:
         del state['members'][member_id]
+        state.get('peers', {}).pop(member_id, None)
         logger.info('Membro removido por ausência: %s', member_id)
 
 
+def heartbeat_once(sock, state, interval, debug=False):
+    check_absence(state, interval * 2) # remover membros ausentes
+    hb_msg = message(sender_id=state['id'], mtype='heartbeat', content={'members': state['members']}, state=state)
+    try:
+        send_msg(sock, state, hb_msg)
+        if debug:
+            logger.debug('Heartbeat enviado')
+    except Exception:
+        logger.exception('Falha ao enviar heartbeat')
+
+
 def heartbeat(sock, state, debug=False):
     """Envia periodicamente mensagens heartbeat para o grupo multicast."""
-    group, port = state.get('group'), state.get('port')
     interval = 5.0  # segundos
     logger.debug('Heartbeat thread started')
-    while True:
-        time.sleep(interval)
-        check_absence(state, interval * 2) # remover membros ausentes
-        hb_msg = message(sender_id=state['id'], mtype='heartbeat', content={'members': state['members']})
-        try:
-            sock.sendto(json.dumps(hb_msg).encode('utf-8'), (group, port))
-            if debug:
-                logger.debug('Heartbeat enviado')
-        except Exception:
-            logger.exception('Falha ao enviar heartbeat')
+    stop = state.setdefault('_stop', threading.Event())
+    while not stop.wait(interval):
+        prof = state.get('_cprofile')
+        if prof is not None:
+            prof.run(heartbeat_once, sock, state, interval, debug)
+        else:
+            heartbeat_once(sock, state, interval, debug)
 
 
-def main():
-    args = parse_args()
-    group = args.group
-    port = args.port
-    name = args.name or socket.gethostname()
-    ttl = args.ttl
-    loop = args.loop
-    debug = args.debug
-    logfile = args.logfile
-    join_timeout = args.join_timeout
-    iface_ip = get_default_interface_ip() or '0.0.0.0'
+# Perfilamento sob demanda (comandos \profile e \mem do modo interativo)
+PROFILED_THREADS = ('listener', 'heartbeat', 'sender')
+CPROFILED_THREADS = ('listener', 'heartbeat')  # as que chamam state['_cprofile'].run
+SAMPLE_INTERVAL = 0.005
+
+
+class CProfileSession:
+    """cProfile nas threads do peer: cada thread usa o seu próprio Profile em cada unidade de trabalho
+    (um datagrama no listener, um ciclo no heartbeat); no stop os perfis são somados.
+
+    Uma unidade perfilada por vez (lock): no Python 3.12+ o cProfile usa sys.monitoring, que vale
+    para o interpretador todo, e um segundo Profile ativo ao mesmo tempo levanta ValueError. Se
+    mesmo assim o cProfile falhar (outra ferramenta já ativa), a sessão é desligada e o trabalho
+    segue sem perfil.
+    """
+
+    def __init__(self):
+        self.profiles = {}
+        self.lock = threading.Lock()
+        self.run_lock = threading.Lock()
+        self.error = None
+
+    def run(self, func, *args):
+        if self.error is not None:
+            return func(*args)
+        tid = threading.get_ident()
+        with self.lock:
+            prof = self.profiles.get(tid)
+            if prof is None:
+                prof = self.profiles[tid] = cProfile.Profile()
+        with self.run_lock:
+            try:
+                prof.enable()
+            except ValueError as e:
+                self.error = e
+                logger.warning('cProfile indisponível (%s); perfilamento desligado, use \\profile start sample', e)
+                return func(*args)
+            try:
+                return func(*args)
+            finally:
+                prof.disable()
+
+    def stop(self, path):
+        with self.lock:
+            profiles = [prof for prof in self.profiles.values() if prof.getstats()]
+        if not profiles:
+            return None
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(path)
+        return stats
+
+
+def cprofile_available():
+    """O cProfile pode ser ligado agora? (No 3.12+ falha se outro profiler já estiver ativo.)"""
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        return False
+    prof.disable()
+    return True
 
-    # Configure logging: file + console (console INFO, file DEBUG/INFO)
-    setup_logger(logfile, debug)
 
-    with make_mcast_socket(port, group, iface_ip=iface_ip, ttl=ttl, loop=loop, debug=debug) as sock:
-        # State for coordinator logic
-        state = build_state(group, port, name)
+class SamplingProfiler:
+    """Amostra periodicamente as pilhas das threads do peer (sys._current_frames), sem instrumentá-las.
+
+    O resultado é gravado no formato de pilhas colapsadas (uma linha 'thread;f1;f2 contagem'),
+    aceito por flamegraph.pl/speedscope.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, prefixes=PROFILED_THREADS):
+        self.interval = interval
+        self.prefixes = prefixes
+        self.counts = collections.Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate() if t.name.startswith(self.prefixes)}
+            for tid, frame in sys._current_frames().items():
+                name = names.get(tid)
+                if name is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                stack.append(name)
+                self.counts[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self, path):
+        self.stop_event.set()
+        self.thread.join()
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f'{stack} {count}\n')
+        return self.counts
+
+
+def profile_command(state, arg, out_dir='.'):
+    """\\profile start [sample|cprofile] | \\profile stop"""
+    parts = arg.split()
+    action = parts[0] if parts else ''
+    if action == 'start':
+        if state.get('_profiler') is not None:
+            logger.info('Perfilamento já em andamento')
+            return
+        mode = parts[1] if len(parts) > 1 else 'sample'
+        if mode not in ('sample', 'cprofile'):
+            logger.info('Modo desconhecido: %s (use sample ou cprofile)', mode)
+            return
+        if mode == 'cprofile' and not cprofile_available():
+            logger.warning('cProfile indisponível (outro profiler ativo); usando o modo sample')
+            mode = 'sample'
+        if mode == 'cprofile':
+            session = CProfileSession()
+            state['_cprofile'] = session
+            threads = CPROFILED_THREADS
+        else:
+            session = SamplingProfiler().start()
+            threads = PROFILED_THREADS
+        state['_profiler'] = (mode, session, time.time())
+        logger.info('Perfilamento %s iniciado nas threads %s', mode, ', '.join(threads))
+    elif action == 'stop':
+        if state.get('_profiler') is None:
+            logger.info('Nenhum perfilamento em andamento')
+            return
+        mode, session, started = state.pop('_profiler')
+        state.pop('_cprofile', None)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        if mode == 'cprofile':
+            path = os.path.join(out_dir, f'profile-{stamp}.prof')
+            stats = session.stop(path)
+            if stats is None:
+                logger.info('Nenhuma atividade perfilada em %.1fs', time.time() - started)
+                return
+        else:
+            path = os.path.join(out_dir, f'profile-{stamp}.folded')
+            counts = session.stop(path)
+            leaves = collections.Counter()
+            for stack, count in counts.items():
+                leaves[stack.rsplit(';', 1)[-1]] += count
+            total = sum(leaves.values()) or 1
+            logger.info('Funções no topo da pilha (%% das amostras de %d ciclos; inclui esperas em recv/sleep):', session.samples)
+            for leaf, count in leaves.most_common(5):
+                logger.info('  %5.1f%%  %s', 100.0 * count / total, leaf)
+        logger.info('Perfil (%s, %.1fs) salvo em %s', mode, time.time() - started, path)
+    else:
+        logger.info('Uso: \\profile start [sample|cprofile] | \\profile stop')
+
+
+def mem_command(state, arg, out_dir='.'):
+    """\\mem snapshot (linha de base) | \\mem diff (compara com a linha de base)"""
+    action = arg.strip()
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    if action == 'snapshot':
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+        snapshot = tracemalloc.take_snapshot()
+        path = os.path.join(out_dir, f'mem-{stamp}.snapshot')
+        snapshot.dump(path)
+        state['_mem_snapshot'] = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        logger.info('Snapshot de memória salvo em %s (atual %.1f KiB, pico %.1f KiB)', path, current / 1024, peak / 1024)
+    elif action == 'diff':
+        base = state.get('_mem_snapshot')
+        if base is None:
+            logger.info('Use \\mem snapshot antes de \\mem diff')
+            return
+        diff = tracemalloc.take_snapshot().compare_to(base, 'lineno')
+        path = os.path.join(out_dir, f'mem-diff-{stamp}.txt')
+        with open(path, 'w') as f:
+            for stat in diff[:100]:
+                f.write(f'{stat}\n')
+        for stat in diff[:10]:
+            logger.info('  %s', stat)
+        logger.info('Diferença de memória salva em %s', path)
+    else:
+        logger.info('Uso: \\mem snapshot | \\mem diff')
+
+
+BACKPRESSURE_POLICIES = ('block', 'drop_oldest', 'drop_new')
+
+
+class PeerNode:
+    """Peer embutível: descoberta, entrada no grupo, listeners e envio, sem depender de input()/logs.
+
+    As mensagens de chat recebidas (dicts crus, como chegam na rede) são entregues ao callback
+    on_message, chamado na thread do listener, ou, sem callback, a uma caixa de entrada limitada
+    consumida por messages() (iterador bloqueante), get() ou stream() (async). Quando a caixa
+    enche, backpressure decide: 'block' segura o listener (o excesso acaba descartado no kernel e
+    aparece em metrics['recv']), 'drop_oldest' descarta a mais antiga e 'drop_new' a recém-chegada.
+    Com log_messages=True as mensagens vão para o logger, como no modo interativo.
+
+        with PeerNode(name='app') as node:
+            node.send('olá')
+            for msg in node.messages():
+                print(msg['id'], msg['content']['text'])
+    """
+
+    def __init__(self, name=None, group='239.0.0.1', port=5007, iface_ip=None, ttl=1, loop=False,
+                 join_timeout=2.0, bpf=False, rcvbuf=None, queue_limits=DEFAULT_QUEUE_LIMITS,
+                 on_message=None, inbox_size=1024, backpressure='drop_oldest', log_messages=False,
+                 capture=None, debug=False):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f'backpressure deve ser um de {BACKPRESSURE_POLICIES}')
+        self.name = name or socket.gethostname()
+        self.group = group
+        self.port = port
+        self.iface_ip = iface_ip or get_default_interface_ip() or '0.0.0.0'
+        self.ttl = ttl
+        self.loop = loop
+        self.join_timeout = join_timeout
+        self.bpf = bpf
+        # None = DEFAULT_RCVBUF sem aviso se o sistema limitar (o usuário não pediu esse tamanho)
+        self.rcvbuf = DEFAULT_RCVBUF if rcvbuf is None else rcvbuf
+        self.rcvbuf_explicit = rcvbuf is not None
+        self.queue_limits = tuple(queue_limits)
+        self.on_message = on_message
+        self.inbox_size = inbox_size
+        self.backpressure = backpressure
+        self.log_messages = log_messages
+        self.capture = capture
+        self.debug = debug
+        self.inbox = collections.deque()
+        self.inbox_cond = threading.Condition()
+        self.sock = None
+        self.ucast_sock = None
+        self.state = None
+        self.closed = False
+
+    def start(self):
+        """Descobre o coordenador (ou assume a coordenação), entra no grupo e inicia os listeners.
+
+        Levanta ConnectionError se o coordenador não responder ao join.
+        """
+        self.sock = make_mcast_socket(self.port, self.group, iface_ip=self.iface_ip, ttl=self.ttl,
+                                      loop=self.loop, debug=self.debug, rcvbuf=self.rcvbuf,
+                                      rcvbuf_explicit=self.rcvbuf_explicit)
+        self.ucast_sock = make_ucast_socket(self.iface_ip, rcvbuf=self.rcvbuf, rcvbuf_explicit=self.rcvbuf_explicit)
+        sock, ucast_sock = self.sock, self.ucast_sock
+        state = self.state = build_state(self.group, self.port, self.name, ucast_port=ucast_sock.getsockname()[1])
+        state['wire_header'] = self.bpf
+        state['metrics']['inbox'] = {'delivered': 0, 'dropped': 0}
+        update_socket_filter(sock, state)
+        if self.capture:
+            state['_trace'] = TraceWriter(self.capture)
+        state['_sender'] = SendScheduler(sock, state['metrics']['send'], self.queue_limits, state.get('_trace')).start()
+        if not self.log_messages:
+            state['_deliver'] = self.on_message or self.deliver
 
         # DISCOVERY: procurar coordenador enviando whois e aguardando iam
-        state['coordinator_id'] = get_coordinator(sock, state)
+        state['coordinator_id'] = get_coordinator(sock, state, ucast_sock)
 
         if state['coordinator_id'] is None: # nenhum coordenador detectado -> assumir coordenação
-            assume_coordination(sock, name, state, debug)
+            assume_coordination(sock, self.name, state, self.debug)
 
         # Se não for coordenador, enviar join_request e aguardar join_ack
-        if not is_coordinator(state):
-            connect_to_chat(sock, state, join_timeout)
+        if not is_coordinator(state) and not connect_to_chat(sock, state, self.join_timeout, ucast_sock):
+            self.close()
+            raise ConnectionError('não foi possível entrar no chat')
+
+        # id atribuído/papel definidos: regenerar filtro
+        update_socket_filter(sock, state)
+        if self.capture:
+            state['_trace'].meta(state)
+
+        # listeners (após discovery/join): grupo e unicast
+        for name, recv_sock in (('listener-group', None), ('listener-unicast', ucast_sock)):
+            t = threading.Thread(target=listener_thread, args=(sock, state, self.debug, recv_sock), name=name, daemon=True)
+            t.start()
+            state['_threads'].append(t)
+        return self
+
+    def send(self, text):
+        send_text(self.sock, self.state, text)
+
+    def deliver(self, msg):
+        """Coloca msg na caixa de entrada aplicando a política de backpressure."""
+        metrics = self.state['metrics']['inbox']
+        with self.inbox_cond:
+            if len(self.inbox) >= self.inbox_size:
+                if self.backpressure == 'drop_new':
+                    metrics['dropped'] += 1
+                    return
+                if self.backpressure == 'drop_oldest':
+                    self.inbox.popleft()
+                    metrics['dropped'] += 1
+                else:
+                    while len(self.inbox) >= self.inbox_size and not self.closed:
+                        self.inbox_cond.wait()
+            self.inbox.append(msg)
+            metrics['delivered'] += 1
+            self.inbox_cond.notify_all()
+
+    def get(self, timeout=None):
+        """Próxima mensagem da caixa de entrada, ou None após timeout/fechamento."""
+        with self.inbox_cond:
+            if not self.inbox_cond.wait_for(lambda: self.inbox or self.closed, timeout):
+                return None
+            if not self.inbox:
+                return None
+            msg = self.inbox.popleft()
+            self.inbox_cond.notify_all()
+            return msg
+
+    def messages(self, timeout=None):
+        """Itera sobre as mensagens recebidas; termina no fechamento ou após timeout sem mensagens."""
+        while True:
+            msg = self.get(timeout)
+            if msg is None:
+                return
+            yield msg
+
+    async def stream(self, poll=0.5):
+        """Versão assíncrona de messages(): a espera roda no executor padrão do loop."""
+        loop = asyncio.get_running_loop()
+        while not self.closed:
+            msg = await loop.run_in_executor(None, self.get, poll)
+            if msg is not None:
+                yield msg
+
+    def close(self, timeout=5.0):
+        """Para listeners, heartbeat e envio, espera essas threads (até timeout) e fecha os sockets."""
+        if self.closed:
+            return
+        self.closed = True
+        with self.inbox_cond:
+            self.inbox_cond.notify_all()
+        if self.state is not None:
+            self.state['status'] = 'closed'
+            self.state['_stop'].set()
+            threads = list(self.state['_threads'])
+            sender = self.state.get('_sender')
+            if sender is not None:
+                sender.close()
+                threads.append(sender.thread)
+            deadline = time.monotonic() + timeout
+            for t in threads:
+                if t is not threading.current_thread():  # close() chamado de dentro de on_message
+                    t.join(max(0.0, deadline - time.monotonic()))
+        for s in (self.sock, self.ucast_sock):
+            if s is not None:
+                s.close()
+        if self.state is not None and self.state.get('_trace') is not None:
+            self.state['_trace'].close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
 
-        # Start listener thread (após discovery/join)
-        t = threading.Thread(target=listener_thread, args=(sock, state, debug), daemon=True)
-        t.start()
 
+def main():
+    args = parse_args()
+
+    # Configure logging: file + console (console INFO, file DEBUG/INFO)
+    setup_logger(args.logfile, args.debug)
+
+    node = PeerNode(name=args.name, group=args.group, port=args.port, ttl=args.ttl, loop=args.loop,
+                    join_timeout=args.join_timeout, bpf=args.bpf, rcvbuf=args.rcvbuf,
+                    queue_limits=args.queue_limits, log_messages=True, capture=args.capture, debug=args.debug)
+    try:
+        node.start()
+    except ConnectionError:
+        sys.exit(1)
+    state = node.state
+
+    try:
         logger.info('Digite mensagens e pressione Enter para enviar. Ctrl-C para sair.')
         while True:
             try:
@@ -373,8 +1426,12 @@ def main():
                 if text == '\\state':
                     logger.info('Estado atual:')
                     for k, v in state.items():
+                        if k.startswith('_'): # objetos de runtime (ex.: _sender)
+                            continue
                         if k == 'last_heartbeat':
                             v = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(v))
+                        if k == 'history':
+                            v = f'{len(v)} mensagens (\\history para listar)'
                         if k == 'members':
                             logger.info('  members:')
                             for mk, mv in v.items():
@@ -384,61 +1441,99 @@ def main():
                         else:
                             logger.info('  %s: %s', k, v)
                     continue
+                if text.startswith('\\profile'):
+                    profile_command(state, text[len('\\profile'):], args.profile_dir)
+                    continue
+                if text.startswith('\\mem'):
+                    mem_command(state, text[len('\\mem'):], args.profile_dir)
+                    continue
+                if text == '\\history':
+                    for m in ordered_history(state):
+                        stamp = time.strftime('%H:%M:%S', time.localtime(m['ts']))
+                        logger.info('[%s] %s: %s', stamp, m['id'], m['text'])
+                    continue
                 logger.debug('sending: %s', text)
-                send_text(sock, state, text)
+                node.send(text)
             except (EOFError, KeyboardInterrupt):
                 logger.info('\nSaindo...')
                 break
+    finally:
+        node.close()
 
-def build_state(group, port, name):
+def build_state(group, port, name, ucast_port=None):
     return {
         'id': name,
         'members': {},
+        'peers': {},  # id -> [ip, porta unicast], aprendido em whois/join_request
+        'history': collections.deque(maxlen=HISTORY_LIMIT),
+        'watermarks': {},  # id -> maior HLC de mensagem de chat vista (vai no snapshot)
+        'snapshot_marks': {},  # id -> marca d'água do snapshot recebido: o que está abaixo já veio nele
+        'seen': {},  # id -> (set, deque) dos HLCs recentes, ver mark_seen
+        'hlc': [0, 0],
+        'metrics': {'send': {}},
         'group': group,
         'port': port,
+        'ucast_port': ucast_port,
         'coordinator_id': None,
         'last_heartbeat': 0,
-        'status': 'initialized'
+        'status': 'initialized',
+        '_stop': threading.Event(),  # acionado no close: listeners e heartbeat terminam
+        '_threads': [],  # threads do peer, aguardadas no close
     }
 
 
-def connect_to_chat(sock, state, join_timeout):
+def connect_to_chat(sock, state, join_timeout, ucast_sock=None):
     logger.info('Iniciando entrada na chat...')
-    group, port = state['group'], state['port']
-    join_req = message(sender_id=state['id'], mtype='join_request', to=state['coordinator_id'])
+    join_req = message(sender_id=state['id'], mtype='join_request', to=state['coordinator_id'], content={'ucast_port': state.get('ucast_port')}, state=state)
     tries = 3
 
     old_id = state['id']
     for attempt in range(tries):
         try:
-            sock.sendto(json.dumps(join_req).encode('utf-8'), (group, port))
-            logger.debug('Enviado join_request para %s', state['coordinator_id'])
+            dest = send_msg(sock, state, join_req)
+            logger.debug('Enviado join_request para %s (%s)', state['coordinator_id'], dest)
         except Exception:
             logger.exception('Falha ao enviar join_request')
 
-        sock.settimeout(join_timeout)
         logger.debug('Aguardando join_ack...')
-        reply = wait_reply(sock, reply_type='join_ack', reply_to=state['id'])
+        reply = wait_reply([s for s in (ucast_sock, sock) if s is not None], reply_type='join_ack', reply_to=state['id'], timeout=join_timeout)
             
         if reply is None:
             logger.debug('Timeout aguardando join_ack (tentativa %d/%d)', attempt + 1, tries)
             continue
 
-        obj, _addr = reply
+        obj, addr = reply
         logger.debug('join_ack recebido: %s', obj)
 
-        content                 = obj['content']
+        content = obj['content']
+        snap = content.get('snapshot')
+        try:
+            snapshot = fetch_snapshot(addr[0], snap['port'], snap.get('size')) if snap else content
+        except (OSError, ValueError):
+            logger.exception('Falha ao obter snapshot do estado (tentativa %d/%d)', attempt + 1, tries)
+            continue
+
         state['id']             = content['assigned_id']
-        state['members']        = content['members']
-        state['last_heartbeat'] = content['last_heartbeat']
+        state['members']        = snapshot['members']
+        state['peers'].update(snapshot.get('peers', {}))
+        state['history'].extend(snapshot.get('history', []))
+        state['watermarks'].update(snapshot.get('watermarks', {}))
+        state['snapshot_marks'] = dict(snapshot.get('watermarks', {}))
+        for entry in snapshot.get('history', []):
+            mark_seen(state, entry['id'], entry['hlc'])
+        for stamp in list(state['watermarks'].values()) + [obj.get('hlc') or [0, 0]]:
+            hlc_merge(state, stamp)
+        state['last_heartbeat'] = snapshot['last_heartbeat']
         state['status']         = 'chatting'
+        logger.info('Estado recebido: %d membros, %d mensagens no histórico', len(state['members']), len(state['history']))
         break
 
     if state['id'] == old_id:
         logger.error('Não foi possível entrar no chat')
-        sys.exit(1)
+        return False
 
     logger.info('entrada na rede concluída com id %s', state['id'])
+    return True
 
 def assume_coordination(sock, name, state, debug):
     local_ip                = socket.gethostbyname(socket.gethostname())
@@ -446,32 +1541,36 @@ def assume_coordination(sock, name, state, debug):
     state['coordinator_id'] = state['id']
     state['status']         = 'chatting'
     state['members'][state['id']] = time.time()
-    t1 = threading.Thread(target=heartbeat, args=(sock, state, debug), daemon=True)
+    t1 = threading.Thread(target=heartbeat, args=(sock, state, debug), name='heartbeat', daemon=True)
     t1.start()
+    state.setdefault('_threads', []).append(t1)
     logger.info('Nenhum coordenador encontrado — assumindo coordenação (id=%s)', state['coordinator_id'])
 
-def get_coordinator(sock, state):
+def get_coordinator(sock, state, ucast_sock=None):
     group, port = state['group'], state['port']
     logger.info('Procurando coordenador no grupo %s:%d...', group, port)
-    whois = message(sender_id=state['id'], mtype='whois')
+    whois = message(sender_id=state['id'], mtype='whois', content={'ucast_port': state.get('ucast_port')}, state=state)
 
     # enviar whois algumas vezes para aumentar chance de receber
     for _ in range(3):
         try:
-            sock.sendto(json.dumps(whois).encode('utf-8'), (group, port))
+            send_msg(sock, state, whois)
             logger.debug('Enviado whois para %s:%d', group, port)
         except Exception:
             logger.exception('Falha ao enviar whois')
 
         logger.debug('Aguardando iam do coordenador...')
-        reply = wait_reply(sock, reply_type='iam', reply_to=state['id'])
+        reply = wait_reply([s for s in (ucast_sock, sock) if s is not None], reply_type='iam', reply_to=state['id'])
 
         if reply is None:
             logger.debug('Timeout aguardando iam')
             continue
 
-        obj, _addr = reply
+        obj, addr = reply
         coord_id = obj.get('id')
+        coord_addr = reply_addr(obj, addr)
+        if coord_addr is not None:
+            state.setdefault('peers', {})[coord_id] = list(coord_addr)
         logger.info('Coordenador %s detectado', coord_id)
         return coord_id
     
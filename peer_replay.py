@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+peer_replay.py
+
+Reproduz um trace gravado com `multicast_peer.py --capture` diretamente na lógica do peer
+(handle_datagram), sem sockets: as respostas vão para um socket nulo que só as conta.
+Serve para depurar comportamentos observados em produção e para medir/perfilar o caminho
+quente do listener com tráfego real.
+
+Uso:
+  python peer_replay.py trace.bin                 # velocidade máxima
+  python peer_replay.py trace.bin --speed 1       # tempo real (1x)
+  python peer_replay.py trace.bin --speed 10 --loops 5
+  python peer_replay.py trace.bin --profile replay.prof
+"""
+
+import argparse
+import cProfile
+import json
+import logging
+import time
+
+import multicast_peer as mp
+
+
+logger = logging.getLogger(__name__)
+
+
+class NullSocket:
+    """Substitui o socket nas respostas do peer: conta os datagramas e descarta."""
+
+    def __init__(self):
+        self.sent = 0
+        self.bytes = 0
+
+    def sendto(self, data, addr):
+        self.sent += 1
+        self.bytes += len(data)
+        return len(data)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Replay de trace do multicast_peer sem sockets')
+    p.add_argument('trace', help='Arquivo gerado com multicast_peer.py --capture')
+    p.add_argument('--speed', type=float, default=0.0, help='Fator de velocidade (1 = tempo real, N = N vezes; 0 = máxima)')
+    p.add_argument('--loops', type=int, default=1, help='Quantas vezes repetir o trace (padrão: 1)')
+    p.add_argument('--no-learn', action='store_true', help='Não cadastrar como membros os remetentes vistos no trace')
+    p.add_argument('--log', action='store_true', help='Manter o log das mensagens de chat (padrão: entrega sem formatação)')
+    p.add_argument('--profile', default=None, metavar='ARQUIVO', help='Rodar sob cProfile e salvar as estatísticas')
+    return p.parse_args()
+
+
+def load_trace(path):
+    """Separa os datagramas recebidos e o primeiro registro de metadados do trace."""
+    received, meta = [], None
+    for ts, direction, channel, addr, data in mp.read_trace(path):
+        if direction == mp.TRACE_META and meta is None:
+            meta = json.loads(data.decode('utf-8'))
+        elif direction == mp.TRACE_RX:
+            received.append((ts, addr, data))
+    return received, meta or {}
+
+
+def build_replay_state(received, meta, learn=True):
+    """Reconstrói o estado do peer capturado (id, papel e membros) a partir dos metadados do trace."""
+    state = mp.build_state(meta.get('group', '239.0.0.1'), meta.get('port', 5007), meta.get('id', 'replay'))
+    state['coordinator_id'] = meta.get('coordinator_id')
+    state['status'] = 'chatting'
+    state['wire_header'] = bool(meta.get('wire_header'))
+    now = time.time()
+    for member in meta.get('members', []):
+        state['members'][member] = now
+    if learn:
+        for _ts, _addr, data in received:
+            obj = mp.decode_msg(data)
+            if obj and obj.get('id') and obj.get('id') != state['id']:
+                state['members'].setdefault(obj['id'], now)
+    return state
+
+
+def replay(received, state, speed=0.0, loops=1):
+    """Alimenta handle_datagram com os datagramas do trace; speed=0 não espera entre eles."""
+    sock = NullSocket()
+    processed = 0
+    for _ in range(loops):
+        # o HLC e os HLCs vistos descartariam as mensagens já vistas na volta anterior
+        state['watermarks'].clear()
+        state['seen'].clear()
+        state['hlc'] = [0, 0]
+        t0 = received[0][0] if received else 0.0
+        start = time.monotonic()
+        for ts, addr, data in received:
+            if speed > 0:
+                delay = (ts - t0) / speed - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            mp.handle_datagram(sock, state, data, addr)
+            processed += 1
+    return processed, sock
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    mp.logger.setLevel(logging.INFO if args.log else logging.WARNING)
+
+    received, meta = load_trace(args.trace)
+    if not received:
+        logger.error('Trace sem datagramas recebidos: %s', args.trace)
+        return
+    state = build_replay_state(received, meta, learn=not args.no_learn)
+    delivered = []
+    if not args.log:
+        state['_deliver'] = delivered.append
+    # join_request no replay não deve abrir listener TCP: mede só a serialização do snapshot
+    state['_serve_snapshot'] = lambda st: (0, len(json.dumps(mp.build_snapshot(st))))
+
+    logger.info('Replay de %d datagramas (id=%s, papel=%s, velocidade=%s)', len(received), state['id'],
+                mp.peer_role(state), f'{args.speed}x' if args.speed > 0 else 'máxima')
+    profiler = cProfile.Profile() if args.profile else None
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    processed, sock = replay(received, state, args.speed, args.loops)
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    elapsed = time.perf_counter() - start
+
+    logger.info('%d datagramas em %.3fs (%.0f datagramas/s, %.1f µs/datagrama)', processed, elapsed,
+                processed / elapsed if elapsed else 0.0, elapsed / processed * 1e6)
+    logger.info('Respostas geradas: %d (%d bytes); mensagens de chat entregues: %d', sock.sent, sock.bytes, len(delivered))
+    if profiler:
+        logger.info('Perfil salvo em %s', args.profile)
+
+
+if __name__ == '__main__':
+    main()